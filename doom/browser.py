@@ -0,0 +1,124 @@
+import logging
+import warnings
+import threading
+import contextlib
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+"""
+a pool of warm headless browser sessions, so pages that need
+javascript don't pay for a browser start on every fetch
+"""
+
+
+class BrowserPool:
+    def __init__(self, size=4, factory=webdriver.PhantomJS, implicit_wait=30):
+        self.size = size
+        self.factory = factory
+        self.implicit_wait = implicit_wait
+        # most recently returned last, it's the one most likely to be warm
+        self._idle = []
+        self._created = 0
+        # notified whenever a browser is returned or discarded, so a
+        # waiter can take it or start a replacement
+        self._available = threading.Condition()
+
+    def _start(self):
+        warnings.filterwarnings("ignore")
+        # this throws a warning which i'm just ignoring for now
+        driver = self.factory()
+        driver.implicitly_wait(self.implicit_wait)
+        logging.debug("started browser %d of %d" % (self._created, self.size))
+        return driver
+
+    def acquire(self):
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return self._start()
+        except Exception:
+            self._forget()
+            raise
+
+    def release(self, driver, broken=False):
+        if broken:
+            self._discard(driver)
+            return
+
+        try:
+            driver.get("about:blank")
+        except Exception:
+            self._discard(driver)
+            return
+
+        with self._available:
+            self._idle.append(driver)
+            self._available.notify()
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.debug("error quitting browser: %s" % e)
+        self._forget()
+
+    def _forget(self):
+        with self._available:
+            self._created -= 1
+            self._available.notify()
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        check a browser out for the duration of a with block. one that
+        raised is thrown away rather than handed to the next caller
+        """
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def close(self):
+        """
+        quit every idle browser
+        """
+        with self._available:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            self._discard(driver)
+
+
+def page_height(driver):
+    return driver.execute_script("return document.body.scrollHeight")
+
+
+def scroll_to_bottom(driver):
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+
+
+def wait_for_growth(driver, last_height, timeout=5, poll=0.25):
+    """
+    wait until the page grows past `last_height`, returning
+    the new height or None if it never did
+    """
+
+    def grown(d):
+        height = page_height(d)
+        return height if height > last_height else False
+
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=poll).until(grown)
+    except TimeoutException:
+        return None
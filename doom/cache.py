@@ -0,0 +1,285 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from collections import namedtuple
+
+"""
+on-disk caches kept in sqlite: http responses for the crawler and
+language predictions for the song reader.
+
+response bodies are stored once per distinct content (keyed by digest)
+and urls point at them, along with the validators needed to revalidate
+a stale entry. every thread of every process opens its own connection,
+so a cache object can be handed to pool workers and their threads as-is
+"""
+
+CachedResponse = namedtuple(
+    "CachedResponse", ["body", "etag", "last_modified", "fresh"]
+)
+
+schema = [
+    """
+    create table if not exists responses (
+        url text primary key,
+        digest text not null,
+        etag text,
+        last_modified text,
+        fetched real not null,
+        accessed real not null
+    )
+    """,
+    "create index if not exists responses_accessed on responses (accessed)",
+    """
+    create table if not exists bodies (
+        digest text primary key,
+        body blob not null,
+        size integer not null
+    )
+    """,
+    """
+    create table if not exists artist_ids (
+        url text primary key,
+        artist_id text not null
+    )
+    """,
+]
+
+
+class SqliteStore:
+    """
+    a sqlite file with one connection per thread, sqlite connections
+    only being usable on the thread that opened them
+    """
+
+    schema = []
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        # a forked child inherits its parent's thread locals, hence the pid
+        local = self._local
+        if getattr(local, "conn", None) is None or local.pid != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            local.conn.execute("pragma journal_mode=wal")
+            local.conn.execute("pragma synchronous=normal")
+            for statement in self.schema:
+                local.conn.execute(statement)
+            local.pid = os.getpid()
+        return local.conn
+
+
+class ResponseCache(SqliteStore):
+    schema = schema
+
+    def __init__(
+        self, path, ttl=7 * 24 * 3600, max_bytes=10 * 2 ** 30, check_every=500
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._stores = 0
+
+    def lookup(self, url):
+        row = self.conn.execute(
+            """
+            select b.body, r.etag, r.last_modified, r.fetched
+            from responses r join bodies b on r.digest = b.digest
+            where r.url = ?
+            """,
+            (url,),
+        ).fetchone()
+
+        if not row:
+            return None
+
+        body, etag, last_modified, fetched = row
+        now = time.time()
+        self.conn.execute(
+            "update responses set accessed = ? where url = ?", (now, url)
+        )
+
+        return CachedResponse(
+            zlib.decompress(body).decode("utf-8"),
+            etag,
+            last_modified,
+            now - fetched < self.ttl,
+        )
+
+    def store(self, url, body, headers):
+        data = body.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        now = time.time()
+
+        # body first, so a response row never points at a missing body
+        self.conn.execute(
+            "insert or ignore into bodies (digest, body, size) values (?, ?, ?)",
+            (digest, zlib.compress(data), len(data)),
+        )
+        self.conn.execute(
+            """
+            insert or replace into responses
+            (url, digest, etag, last_modified, fetched, accessed)
+            values (?, ?, ?, ?, ?, ?)
+            """,
+            (url, digest, headers.get("ETag"), headers.get("Last-Modified"), now, now),
+        )
+
+        self._stores += 1
+        if self._stores % self.check_every == 0:
+            self.evict()
+
+    def revalidated(self, url):
+        """
+        the server said our copy is still good (304)
+        """
+        now = time.time()
+        self.conn.execute(
+            "update responses set fetched = ?, accessed = ? where url = ?",
+            (now, now, url),
+        )
+
+    def evict(self):
+        """
+        drop least recently used responses until the stored
+        (uncompressed) size is back under max_bytes
+        """
+        (total,) = self.conn.execute(
+            "select coalesce(sum(size), 0) from bodies"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        logging.info("cache is %d bytes over, evicting" % excess)
+
+        rows = self.conn.execute(
+            """
+            select r.url, b.size
+            from responses r join bodies b on r.digest = b.digest
+            order by r.accessed
+            """
+        )
+        urls = []
+        for url, size in rows:
+            if excess <= 0:
+                break
+            urls.append((url,))
+            excess -= size
+        rows.close()
+
+        self.conn.executemany("delete from responses where url = ?", urls)
+        self.conn.execute(
+            "delete from bodies where digest not in (select digest from responses)"
+        )
+
+        logging.info("evicted %d responses" % len(urls))
+
+    def artist_id(self, url):
+        row = self.conn.execute(
+            "select artist_id from artist_ids where url = ?", (url,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def artist_ids(self, urls):
+        """
+        the cached artist id of whichever urls we have
+        """
+        found = {}
+        urls = list(urls)
+        # stay under sqlite's limit on bound parameters
+        for start in range(0, len(urls), 500):
+            batch = urls[start : start + 500]
+            rows = self.conn.execute(
+                "select url, artist_id from artist_ids where url in (%s)"
+                % ",".join("?" * len(batch)),
+                batch,
+            )
+            found.update(rows)
+        return found
+
+    def set_artist_id(self, url, artist_id):
+        self.conn.execute(
+            "insert or replace into artist_ids (url, artist_id) values (?, ?)",
+            (url, artist_id),
+        )
+
+
+class LanguageCache(SqliteStore):
+    """
+    language predictions keyed by a 64 bit hash of the text they were made on
+    """
+
+    schema = [
+        """
+        create table if not exists languages (
+            digest integer primary key,
+            language text not null,
+            reliable integer not null
+        )
+        """
+    ]
+
+    @staticmethod
+    def key(text):
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def get_many(self, keys):
+        """
+        the cached (language, reliable) of whichever keys we have
+        """
+        found = {}
+        keys = list(keys)
+        # stay under sqlite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start : start + 500]
+            rows = self.conn.execute(
+                "select digest, language, reliable from languages where digest in (%s)"
+                % ",".join("?" * len(batch)),
+                batch,
+            )
+            for digest, language, reliable in rows:
+                found[digest] = (language, bool(reliable))
+        return found
+
+    def put_many(self, predictions):
+        """
+        store (key, language, reliable) triples in one transaction
+        """
+        self.conn.execute("begin")
+        self.conn.executemany(
+            "insert or replace into languages (digest, language, reliable) "
+            "values (?, ?, ?)",
+            predictions,
+        )
+        self.conn.execute("commit")
+
+
+def validators(cached):
+    """
+    conditional request headers for revalidating a cached response
+    """
+    headers = {}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+    return headers
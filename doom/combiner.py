@@ -1,26 +1,379 @@
+import os
+import re
+import glob
+import time
 import boto3
 import orjson
 import sys
 import logging
+import collections
 from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from .utils import logger_init, worker_init
+from .shards import compress_member, decompress_stream
+from .corpus import BlockWriter, index_path, write_index
 
 lyrics_root = "genius-lyrics"
-s3 = boto3.resource("s3")
+s3_client = boto3.client("s3")
 
 
-def list_bucket():
-    bucket = s3.Bucket(lyrics_root)
-    return bucket.objects.all()
+def list_bucket(prefix=""):
+    """
+    every object in the lyrics bucket under `prefix`,
+    as (key, size, etag, last modified)
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=lyrics_root, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            modified = obj["LastModified"].isoformat()
+            yield obj["Key"], obj["Size"], obj["ETag"], modified
 
 
-def read_object(obj):
-    return obj.get()["Body"].read().decode("utf-8")
+def is_artist_key(key):
+    return key.endswith(".json")
+
+
+def is_shard_key(key):
+    return key.endswith(".ndjson.gz") or key.endswith(".ndjson.zst")
+
+
+def read_object(key):
+    """
+    the artist lines stored in an object: one for a per-artist json
+    object, one per artist for an ndjson shard. a shard's lines are
+    streamed off the response as they're iterated over rather than
+    read into memory
+    """
+    body = s3_client.get_object(Bucket=lyrics_root, Key=key)["Body"]
+    if is_shard_key(key):
+        compression = "zstd" if key.endswith(".zst") else "gzip"
+        return shard_lines(body, compression)
+    else:
+        return [body.read().strip()]
+
+
+def shard_lines(body, compression):
+    try:
+        with decompress_stream(body, compression) as f:
+            for line in f:
+                line = line.rstrip(b"\n")
+                if line:
+                    yield line
+    finally:
+        body.close()
+
+
+def safe_letter(letter):
+    """
+    a letter fit to name a file after: anything but a letter or digit
+    (a "/" or "." say, or no letter at all) is "_"
+    """
+    return letter if letter.isalnum() else "_"
+
+
+def artist_letter(artist):
+    name = artist["name"]
+    return safe_letter(name[0].lower() if name else "")
+
+
+def key_letter(key):
+    """
+    per-artist objects are stored as <letter>/<name>.json
+    """
+    return safe_letter(key.split("/", 1)[0])
+
+
+def letter_file(letter, generation=None):
+    if generation:
+        return "%s.%s.json.gz" % (letter, generation)
+    return "%s.json.gz" % letter
+
+
+# <letter>.<generation>.json.gz, see combine_incremental
+generation_file = re.compile(r"^\w\.\d+\.json\.gz$")
+
+
+def manifest_file(entry):
+    """
+    the file in the output directory an incremental manifest entry is in
+    """
+    return entry.get("file") or letter_file(entry["shard"])
+
+
+def fetch_lines(keys, threads=32, in_flight=None, ordered=False):
+    """
+    fetch objects on a thread pool with at most `in_flight` outstanding,
+    yielding (key, lines) either in listing order or as they finish
+    """
+    in_flight = in_flight if in_flight else 2 * threads
+    keys = iter(keys)
+
+    with ThreadPoolExecutor(threads) as executor:
+        pending = collections.deque()
+
+        def fill():
+            while len(pending) < in_flight:
+                key = next(keys, None)
+                if key is None:
+                    return
+                pending.append((key, executor.submit(read_object, key)))
+
+        fill()
+        while pending:
+            if ordered:
+                key, future = pending.popleft()
+                yield key, future.result()
+            else:
+                wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                for key, future in [p for p in pending if p[1].done()]:
+                    pending.remove((key, future))
+                    yield key, future.result()
+            fill()
+
+
+class Outputs:
+    """
+    gzip ndjson outputs: a single file, one file per artist letter, or stdout.
+    files are block compressed with an artist index next to them, see corpus
+    """
+
+    def __init__(self, path=None, by_letter=False, block_size=2 ** 20):
+        self.path = path
+        self.by_letter = by_letter
+        self.block_size = block_size
+        self.files = {}
+        if by_letter and path:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, line):
+        if not self.path:
+            sys.stdout.buffer.write(line)
+            sys.stdout.buffer.write(b"\n")
+            return len(line) + 1
+
+        artist = orjson.loads(line)
+        name = letter_file(artist_letter(artist)) if self.by_letter else None
+        if name not in self.files:
+            path = os.path.join(self.path, name) if name else self.path
+            self.files[name] = BlockWriter(path, "gzip", self.block_size)
+        return self.files[name].write(line, artist)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def combine(keys, outputs, threads=32, in_flight=None, ordered=False, log_every=1000):
+    start = time.time()
+    objects = 0
+    artists = 0
+    written = 0
+
+    for key, lines in fetch_lines(keys, threads, in_flight, ordered):
+        for line in lines:
+            written += outputs.write(line)
+            artists += 1
+        objects += 1
+
+        if objects % log_every == 0:
+            elapsed = time.time() - start
+            logging.info(
+                "%d objects, %d artists, %0.1f MB in %0.0fs (%0.1f obj/s, %0.2f MB/s)"
+                % (
+                    objects,
+                    artists,
+                    written / 2 ** 20,
+                    elapsed,
+                    objects / elapsed,
+                    written / 2 ** 20 / elapsed,
+                )
+            )
+
+    logging.info(
+        "combined %d objects, %d artists, %0.1f MB in %0.0fs"
+        % (objects, artists, written / 2 ** 20, time.time() - start)
+    )
+
+
+class MemberWriter:
+    """
+    a gzip file written one member per artist, so that any artist
+    can later be copied out by offset without recompressing
+    """
+
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.offset = 0
+
+    def write_member(self, member):
+        start = self.offset
+        self.f.write(member)
+        self.offset += len(member)
+        return start, len(member)
+
+    def write(self, line):
+        return self.write_member(compress_member(line + b"\n"))
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def save_manifest(manifest, path):
+    with open(path + ".tmp", "wb") as f:
+        f.write(orjson.dumps(manifest))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def remove_unused(out_dir, old, manifest):
+    """
+    delete the letter shards (and their indexes) in `out_dir` that the
+    manifest no longer points at: the ones the `old` manifest did, and
+    any generation left by a run that died before saving its manifest.
+    nothing else in the directory is touched
+    """
+    used = {manifest_file(v) for v in manifest.values()}
+    ours = {manifest_file(v) for v in old.values()}
+    for path in glob.glob(os.path.join(out_dir, "*.json.gz")):
+        name = os.path.basename(path)
+        if name not in used and (name in ours or generation_file.match(name)):
+            logging.debug("removing %s" % path)
+            for p in (path, index_path(path)):
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+def combine_incremental(out_dir, manifest_path, threads=32, log_every=1000):
+    """
+    bring a directory of per-letter shards up to date with the bucket.
+
+    the manifest remembers the etag and last modified time of every object
+    along with the shard, offset and length its artist was written to. only
+    new or changed objects are fetched, only shards that gained, changed or
+    lost an artist are rewritten, and unchanged artists in those shards are
+    copied over byte for byte. every artist is its own member, so rewritten
+    shards get a corpus index straight from the manifest
+
+    rewritten shards go to new <letter>.<generation>.json.gz files, and the
+    manifest is saved pointing at them before the files they replace are
+    removed, so a run that dies part way leaves the old manifest and shards
+    as they were
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    old = load_manifest(manifest_path)
+
+    listing = {
+        key: {"etag": etag, "last_modified": last_modified}
+        for key, _, etag, last_modified in list_bucket()
+        if is_artist_key(key)
+    }
+
+    changed = [
+        key
+        for key, version in listing.items()
+        if key not in old
+        or (old[key]["etag"], old[key]["last_modified"])
+        != (version["etag"], version["last_modified"])
+    ]
+    deleted = [key for key in old if key not in listing]
+    stale = set(changed) | set(deleted)
+
+    affected = {key_letter(key) for key in changed}
+    affected.update(old[key]["shard"] for key in stale if key in old)
+
+    logging.info(
+        "%d objects: %d new or changed, %d deleted, rewriting %d of the shards"
+        % (len(listing), len(changed), len(deleted), len(affected))
+    )
+
+    manifest = {k: v for k, v in old.items() if v["shard"] not in affected}
+    generation = "%d" % time.time_ns()
+    files = {}
+    writers = {}
+
+    for shard in sorted(affected):
+        files[shard] = letter_file(shard, generation)
+        writers[shard] = writer = MemberWriter(os.path.join(out_dir, files[shard]))
+
+        kept = sorted(
+            (v["offset"], k)
+            for k, v in old.items()
+            if v["shard"] == shard and k not in stale
+        )
+        if kept:
+            path = os.path.join(out_dir, manifest_file(old[kept[0][1]]))
+            with open(path, "rb") as f:
+                for offset, key in kept:
+                    f.seek(offset)
+                    start, length = writer.write_member(f.read(old[key]["length"]))
+                    manifest[key] = dict(
+                        old[key], file=files[shard], offset=start, length=length
+                    )
+
+    start = time.time()
+    for n, (key, lines) in enumerate(fetch_lines(changed, threads)):
+        shard = key_letter(key)
+        for line in lines:
+            artist = orjson.loads(line)
+            offset, length = writers[shard].write(line)
+            manifest[key] = dict(
+                listing[key],
+                shard=shard,
+                file=files[shard],
+                offset=offset,
+                length=length,
+                artist_id=artist.get("artist_id"),
+                name=artist.get("name"),
+            )
+
+        if (n + 1) % log_every == 0:
+            logging.info(
+                "fetched %d of %d changed objects, %0.1f/s"
+                % (n + 1, len(changed), (n + 1) / (time.time() - start))
+            )
+
+    for shard, writer in writers.items():
+        writer.close()
+        path = os.path.join(out_dir, files[shard])
+
+        members = sorted(
+            (v for v in manifest.values() if v["shard"] == shard),
+            key=lambda v: v["offset"],
+        )
+        write_index(
+            path,
+            (
+                {
+                    "artist_id": v.get("artist_id"),
+                    "name": v.get("name"),
+                    "offset": v["offset"],
+                    "length": v["length"],
+                    "line": 0,
+                }
+                for v in members
+            ),
+        )
+
+    save_manifest(manifest, manifest_path)
+    remove_unused(out_dir, old, manifest)
+    logging.info("manifest now covers %d artists" % len(manifest))
 
 
 def get_optparser():
-    parser = OptionParser(usage="take all the artist data and print to stdout")
+    parser = OptionParser(
+        usage="take all the artist data and write it out as gzipped ndjson"
+    )
     parser.add_option(
         "-L",
         "--log_level",
@@ -30,6 +383,66 @@ def get_optparser():
         help="log level to use",
     )
 
+    parser.add_option(
+        "-o",
+        "--output",
+        action="store",
+        dest="output",
+        default=None,
+        help="(optional) gzipped ndjson file to write to instead of stdout",
+    )
+
+    parser.add_option(
+        "-l",
+        "--by_letter",
+        action="store_true",
+        dest="by_letter",
+        help="treat --output as a directory, writing one <letter>.json.gz each",
+    )
+
+    parser.add_option(
+        "-t",
+        "--threads",
+        action="store",
+        dest="threads",
+        default=32,
+        help="number of objects to fetch concurrently",
+    )
+
+    parser.add_option(
+        "--ordered",
+        action="store_true",
+        dest="ordered",
+        help="write artists in bucket listing order rather than as they arrive",
+    )
+
+    parser.add_option(
+        "-s",
+        "--shards",
+        action="store",
+        dest="shards",
+        default=None,
+        help="(optional) read the ndjson shards under this prefix instead",
+    )
+
+    parser.add_option(
+        "-i",
+        "--incremental",
+        action="store",
+        dest="incremental",
+        default=None,
+        help="(optional) manifest for updating per-letter --output shards in place",
+    )
+
+    parser.add_option(
+        "-b",
+        "--block_size",
+        action="store",
+        dest="block_size",
+        default=2 ** 20,
+        help="bytes of artists per compressed block in --output files",
+    )
+
     return parser
 
 
@@ -37,10 +450,38 @@ def main():
     opt_parser = get_optparser()
     (options, args) = opt_parser.parse_args()
 
-    q_listener, q = logger_init(options.log_level.upper())
+    # keep stdout clean when the artists themselves are going there
+    log_stream = sys.stdout if options.output else sys.stderr
+    q_listener, q = logger_init(options.log_level.upper(), log_stream)
+
+    if options.by_letter and not options.output:
+        opt_parser.error("--by_letter needs an --output directory")
+
+    if options.incremental:
+        if not options.output or options.shards:
+            opt_parser.error("--incremental needs an --output directory, not --shards")
+        combine_incremental(options.output, options.incremental, int(options.threads))
+        q_listener.stop()
+        return
+
+    threads = int(options.threads)
+    in_flight = None
+    if options.shards:
+        listing = list_bucket(options.shards + "/")
+        keys = (k for k, _, _, _ in listing if is_shard_key(k))
+        # a shard is read as it's written out, so there's nothing to gain
+        # from more than the next one or two being opened ahead of time
+        threads = in_flight = min(threads, 2)
+    else:
+        keys = (k for k, _, _, _ in list_bucket() if is_artist_key(k))
+
+    outputs = Outputs(options.output, options.by_letter, int(options.block_size))
+    try:
+        combine(keys, outputs, threads, in_flight, ordered=options.ordered)
+    finally:
+        outputs.close()
 
-    for x in list_bucket():
-        print(read_object(x))
+    q_listener.stop()
 
 
 if __name__ == "__main__":
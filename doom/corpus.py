@@ -0,0 +1,154 @@
+import gzip
+import orjson
+import logging
+import collections
+
+from .shards import compress_member, decompress
+
+"""
+the combined corpus as a seekable, block-compressed file.
+
+artists are written as ndjson lines grouped into blocks of about
+`block_size` bytes, each block compressed as its own gzip member (or
+zstd frame), so the file still reads start to finish like any other
+.gz. alongside it, <file>.index.gz lists every artist's id and name
+with the offset and length of its block and its line in the block,
+which is enough to pull a handful of artists out of the corpus by
+decompressing only the blocks they're in
+"""
+
+
+def index_path(path):
+    return path + ".index.gz"
+
+
+def path_compression(path):
+    return "zstd" if path.endswith(".zst") else "gzip"
+
+
+def write_index(path, entries):
+    with gzip.open(index_path(path), "wb") as f:
+        for entry in entries:
+            f.write(orjson.dumps(entry) + b"\n")
+
+
+def read_index(path):
+    with gzip.open(index_path(path), "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+class BlockWriter:
+    def __init__(self, path, compression=None, block_size=2 ** 20):
+        self.path = path
+        self.compression = compression if compression else path_compression(path)
+        self.block_size = block_size
+        self.f = open(path, "wb")
+        self.offset = 0
+        self.block = []
+        self.block_bytes = 0
+        self.pending = []
+        self.entries = []
+
+    def write(self, line, artist=None):
+        """
+        append an artist's json line; `artist` is the parsed line, if the
+        caller already has it, for the index
+        """
+        artist = artist if artist is not None else orjson.loads(line)
+        self.pending.append(
+            {
+                "artist_id": artist.get("artist_id"),
+                "name": artist.get("name"),
+                "line": len(self.block),
+            }
+        )
+        self.block.append(line)
+        self.block_bytes += len(line) + 1
+
+        if self.block_bytes >= self.block_size:
+            self.flush()
+        return len(line) + 1
+
+    def flush(self):
+        if not self.block:
+            return
+
+        member = compress_member(b"\n".join(self.block) + b"\n", self.compression)
+        self.f.write(member)
+        for entry in self.pending:
+            entry.update(offset=self.offset, length=len(member))
+            self.entries.append(entry)
+
+        self.offset += len(member)
+        self.block = []
+        self.block_bytes = 0
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+        write_index(self.path, self.entries)
+        logging.info(
+            "wrote %d artists in %d bytes to %s"
+            % (len(self.entries), self.offset, self.path)
+        )
+
+
+class CorpusIndex:
+    """
+    random access to the artists of a block-compressed corpus file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.compression = path_compression(path)
+        self.entries = read_index(path)
+        # an artist can have more than one line: a crawler supplement
+        # record adds the songs a retry fetched
+        self.by_id = collections.defaultdict(list)
+        self.by_name = collections.defaultdict(list)
+        for entry in self.entries:
+            self.by_id[entry["artist_id"]].append(entry)
+            if entry["name"]:
+                self.by_name[entry["name"].lower()].append(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, ids=(), names=()):
+        """
+        the index entries for some artist ids and (case insensitive) names
+        """
+        found = []
+        for i in ids:
+            found.extend(self.by_id.get(i, []))
+        for name in names:
+            found.extend(self.by_name.get(name.lower(), []))
+        return found
+
+    def read_entries(self, entries):
+        """
+        the artists for some index entries, decompressing each
+        block they're in once, in file order
+        """
+        blocks = collections.defaultdict(list)
+        for entry in entries:
+            blocks[(entry["offset"], entry["length"])].append(entry["line"])
+
+        with open(self.path, "rb") as f:
+            for offset, length in sorted(blocks):
+                f.seek(offset)
+                lines = decompress(f.read(length), self.compression).splitlines()
+                for line in sorted(set(blocks[(offset, length)])):
+                    yield orjson.loads(lines[line])
+
+    def read_artists(self, ids=(), names=()):
+        return self.read_entries(self.find(ids, names))
+
+
+def read_artists(path, ids=(), names=()):
+    """
+    just the artists with the given ids or names from a corpus file
+    written by BlockWriter, e.g. read_artists(path, names=["MF DOOM"])
+    """
+    return list(CorpusIndex(path).read_artists(ids, names))
@@ -3,64 +3,210 @@ import os
 import re
 import string
 import requests
+import urllib.parse
 import functools
+import itertools
+import collections
 import logging
 import time
-import warnings
 import orjson
 import boto3
-import s3fs
+import asyncio
+import aiohttp
 
 import lyricsgenius as genius
 import multiprocessing as mp
 import pandas as pd
 
+from lyricsgenius.types import Song
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from optparse import OptionParser
-from selenium import webdriver
 from bs4.element import Tag
 from bs4 import BeautifulSoup
 
 from .utils import logger_init, worker_init
+from .browser import BrowserPool, page_height, scroll_to_bottom, wait_for_growth
+from .cache import ResponseCache, validators
+from .journal import Journal, JournalState
+from .scheduler import CrawlStats, largest_first, run_tasks
+from .shards import ShardWriter, read_manifest
+from .ratelimit import RateLimiter, RETRY_STATUSES, backoff_delay, retry_delay
 
-genius = genius.Genius(os.environ.get("GENIUS_ACCESS_TOKEN"), timeout=10, sleep_time=1)
+# no fixed sleep between requests, the shared rate limiter paces them
+genius = genius.Genius(os.environ.get("GENIUS_ACCESS_TOKEN"), timeout=10, sleep_time=0)
 
-pattern = re.compile("api_path.*?/artists/(\d+)")
 s3_client = boto3.client("s3")
-s3 = s3fs.S3FileSystem()
 lyrics_root = "genius-lyrics"
 
+genius_api_url = "https://api.genius.com/"
+genius_url = "https://genius.com/"
+artist_search_url = "https://genius.com/api/search/artist?q=%s"
+
+# keep-alive connection pool shared by every fetch in this process
+session = requests.Session()
+
+# shared across pool workers, see _worker_init
+limiter = None
+cache = None
+journal = None
+song_threads = 8
+max_song_threads = 32
+
+# big catalogs get a thread per this many songs, see song_threads_for
+songs_per_thread = 25
+
+# started lazily, per process, see get_browsers
+browsers = None
+
+# set when artists are written to ndjson shards, see shard_writer
+shard_settings = None
+shards = None
+
 
 class Artist:
-    def __init__(self, name, url, songs=[]):
+    def __init__(self, name, url, songs=[], artist_id=None, missing_songs=None):
         self.name = name
         self.url = url
         self.songs = songs
-        self.artist_id = None
+        self.artist_id = artist_id
+        # {"id", "url"} of songs a previous crawl couldn't fetch
+        self.missing_songs = missing_songs
 
     def get_artist_id(self):
-        html = fetch_with_retries(self.url)
-        self.artist_id = pattern.findall(html)[0]
+        """
+        the artist's id from the cache, else the search api, else the
+        first match in the artist's page, read only as far as the match
+        """
+        self.artist_id = cache.artist_id(self.url) if cache else None
+        if not self.artist_id:
+            search = fetch_with_retries(artist_search_url % self.quoted_name())
+            artist_id = artist_id_from_search(search, self.url)
+            self._set_artist_id(artist_id if artist_id else stream_artist_id(self.url))
+
+        logging.debug("got id: %s for artist %s" % (self.artist_id, self.name))
+        return self
+
+    async def get_artist_id_async(self, client):
+        self.artist_id = cache.artist_id(self.url) if cache else None
+        if not self.artist_id:
+            search = await fetch_with_retries_async(
+                client, artist_search_url % self.quoted_name()
+            )
+            artist_id = artist_id_from_search(search, self.url)
+            if not artist_id:
+                artist_id = await stream_artist_id_async(client, self.url)
+            self._set_artist_id(artist_id)
 
         logging.debug("got id: %s for artist %s" % (self.artist_id, self.name))
         return self
 
+    def quoted_name(self):
+        return urllib.parse.quote(self.name)
+
+    def _set_artist_id(self, artist_id):
+        if not artist_id:
+            raise ValueError("no artist id found for %s" % self.url)
+        self.artist_id = artist_id
+        if cache:
+            cache.set_artist_id(self.url, artist_id)
+
     def get_songs(self):
         return self.songs
 
-    def fetch_songs(self, attempt=0, attempts=5):
-        try:
-            artist = genius.search_artist(
-                self.name, allow_name_change=False, artist_id=self.artist_id
+    def song_listing(self, per_page=50, attempts=5, sort="popularity"):
+        """
+        the api's info for the artist's songs, page by page in the same
+        (popularity) order, keeping what search_artist's defaults kept:
+        songs with lyrics whose primary artist is this one (no features),
+        the first of any repeated title
+        """
+        infos = []
+        titles = set()
+        page = 1
+        while page:
+            response = with_retries(
+                genius_api_url,
+                functools.partial(
+                    genius.artist_songs,
+                    self.artist_id,
+                    per_page=per_page,
+                    page=page,
+                    sort=sort,
+                ),
+                attempts,
             )
-            self.songs = [s.to_dict() for s in artist.songs]
-            return self
-        except Exception as e:
-            if attempt < attempts:
-                logging.info("retrying, on attempt %d" % (attempt + 1))
-                return self.fetch_songs(attempt + 1)
+            for info in response["songs"]:
+                if genius.skip_non_songs and not genius._result_is_lyrics(info):
+                    continue
+                if str(info["primary_artist"]["id"]) != str(self.artist_id):
+                    continue
+                if info["title"] in titles:
+                    continue
+                titles.add(info["title"])
+                infos.append(info)
+            page = response["next_page"]
+        return infos
+
+    def fetch_songs(self, threads=None, attempts=5, record=None, executor=None):
+        """
+        list the artist's songs, then fetch their lyrics on a pool of
+        `threads`, each song retried on its own. a song that still fails
+        is left out (and kept in self.missing_songs, for the journal)
+        rather than failing the whole artist. an artist that already has
+        missing_songs only fetches those. with a shard `record`, songs are
+        added to it as they arrive instead of being kept in self.songs. by
+        default the pool grows with the size of the catalog, see
+        song_threads_for. given an `executor`, songs are fetched on that
+        (shared) one instead
+        """
+        if self.missing_songs:
+            infos = self.missing_songs
+        else:
+            infos = self.song_listing(attempts=attempts)
+
+        if executor is None:
+            threads = threads if threads else song_threads_for(len(infos))
+            with ThreadPoolExecutor(threads) as executor:
+                return self._fetch_song_infos(infos, executor, attempts, record)
+        return self._fetch_song_infos(infos, executor, attempts, record)
+
+    def _fetch_song_infos(self, infos, executor, attempts, record):
+        songs = [None] * len(infos)
+        missing = []
+
+        futures = {
+            executor.submit(fetch_song, info, attempts): i
+            for i, info in enumerate(infos)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                song = future.result()
+            except Exception as e:
+                logging.error("unable to fetch %s, error: %s" % (infos[i]["url"], e))
+                missing.append({"id": infos[i]["id"], "url": infos[i]["url"]})
+                continue
+
+            if record:
+                record.add(song)
             else:
-                logging.error("unable to fetch %s, error: %s" % (self.name, e))
-                raise e
+                songs[i] = song
+
+        if missing:
+            logging.info(
+                "missing %d of %d songs for %s" % (len(missing), len(infos), self.name)
+            )
+        self.missing_songs = missing
+        self.songs = [] if record else [s for s in songs if s is not None]
+        return self
+
+    def head(self):
+        """
+        everything but the songs
+        """
+        return {"name": self.name, "url": self.url, "artist_id": self.artist_id}
 
     def to_dict(self):
         return {
@@ -71,98 +217,522 @@ class Artist:
         }
 
 
-def get_and_scroll(url, attempt=0, attempts=5, implicit_wait=30, scroll_pause_time=3.5):
+class ArtistIdScanner:
+    """
+    finds the first artist id `pattern` matches in a page fed to it a chunk
+    at a time, holding on only to the part of the current line that a
+    match could still start in
+    """
+
+    pattern = re.compile(rb"api_path.*?/artists/(\d+)")
+
+    def __init__(self):
+        self.buffer = b""
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        match = self.pattern.search(self.buffer)
+        if match:
+            # the id could carry on into the next chunk
+            return match.group(1).decode() if match.end() < len(self.buffer) else None
+
+        line = self.buffer.rfind(b"\n") + 1
+        keep = self.buffer.find(b"api_path", line)
+        if keep < 0:
+            keep = max(line, len(self.buffer) - len(b"api_path") + 1)
+        self.buffer = self.buffer[keep:]
+
+    def finish(self):
+        match = self.pattern.search(self.buffer)
+        return match.group(1).decode() if match else None
+
+
+def artist_id_from_search(text, url):
+    """
+    the id of the artist at `url` among the hits of an artist search, if any
+    """
+    if not text:
+        return None
+    response = orjson.loads(text).get("response", {})
+    for section in response.get("sections", []):
+        for hit in section.get("hits", []):
+            result = hit.get("result", {})
+            if result.get("url") == url:
+                return str(result["id"])
+    return None
+
+
+def stream_artist_id(url, chunk_size=2 ** 14, attempt=0, attempts=5):
+    """
+    scan an artist page for its id as it downloads, dropping the
+    connection as soon as the id turns up
+    """
+    try:
+        if limiter:
+            limiter.acquire(url)
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            scanner = ArtistIdScanner()
+            for chunk in response.iter_content(chunk_size):
+                artist_id = scanner.feed(chunk)
+                if artist_id:
+                    return artist_id
+            return scanner.finish()
+    except Exception as e:
+        if attempt < attempts and _should_retry(e):
+            delay = _retry_delay(url, e, attempt)
+            logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+            time.sleep(delay)
+            return stream_artist_id(url, chunk_size, attempt + 1, attempts)
+        else:
+            logging.error("unable to fetch %s, error: %s" % (url, e))
+
+
+async def stream_artist_id_async(
+    client, url, chunk_size=2 ** 14, attempt=0, attempts=5
+):
+    """
+    asyncio version of stream_artist_id
+    """
+    try:
+        if limiter:
+            await limiter.acquire_async(url)
+        async with client.get(url) as response:
+            response.raise_for_status()
+            scanner = ArtistIdScanner()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                artist_id = scanner.feed(chunk)
+                if artist_id:
+                    response.close()
+                    return artist_id
+            return scanner.finish()
+    except Exception as e:
+        if attempt < attempts and _should_retry(e):
+            delay = _retry_delay(url, e, attempt)
+            logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+            await asyncio.sleep(delay)
+            return await stream_artist_id_async(
+                client, url, chunk_size, attempt + 1, attempts
+            )
+        else:
+            logging.error("unable to fetch %s, error: %s" % (url, e))
+
+
+def cached_artist_ids(artists):
+    """
+    fill in every artist id the cache already has with a single lookup,
+    so workers only resolve the rest
+    """
+    if not cache:
+        return artists
+
+    missing = [a for a in artists if not a.artist_id]
+    found = cache.artist_ids(a.url for a in missing)
+    for a in missing:
+        a.artist_id = found.get(a.url)
+
+    logging.info("%d of %d missing artist ids were cached" % (len(found), len(missing)))
+    return artists
+
+
+def with_retries(url, fetch, attempts=5):
+    """
+    call `fetch` under the rate limit for `url`'s host,
+    backing off and retrying when it fails
+    """
+    attempt = 0
+    while True:
+        try:
+            if limiter:
+                limiter.acquire(url)
+            return fetch()
+        except Exception as e:
+            if attempt < attempts and _should_retry(e):
+                delay = _retry_delay(url, e, attempt)
+                logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+                time.sleep(delay)
+                attempt += 1
+            else:
+                raise
+
+
+def song_threads_for(songs):
+    """
+    threads to fetch an artist's lyrics with: song_threads, or one per
+    songs_per_thread songs for a big catalog, up to max_song_threads
+    """
+    return max(song_threads, min(max_song_threads, -(-songs // songs_per_thread)))
+
+
+def fetch_song(info, attempts=5):
+    """
+    a song's lyrics, scraped from its page, along with the api's full
+    info on it, the same fields search_artist's get_full_info gave
+    """
+    full = with_retries(
+        genius_api_url, functools.partial(genius.song, info["id"]), attempts
+    )
+    info = dict(info, **full["song"])
+
+    lyrics = ""
+    if info.get("lyrics_state") == "complete" and not info.get("instrumental"):
+        lyrics = with_retries(
+            genius_url,
+            functools.partial(genius.lyrics, song_url=info["url"]),
+            attempts,
+        )
+    return Song(genius, info, lyrics or "").to_dict()
+
+
+def get_browsers(size=4, implicit_wait=30):
+    """
+    this process's pool of warm browsers, started on first use and
+    quit when the process exits
+    """
+    global browsers
+    if browsers is None:
+        browsers = BrowserPool(size, implicit_wait=implicit_wait)
+        mp.util.Finalize(browsers, browsers.close, exitpriority=10)
+    return browsers
+
+
+def get_and_scroll(
+    url,
+    attempt=0,
+    attempts=5,
+    implicit_wait=30,
+    scroll_timeout=5,
+    pool=None,
+):
     """
     crawl the specified url and try to continually scroll
-    to the bottom of the page in order to reveal any 
+    to the bottom of the page in order to reveal any
     'infinite scroll' elements
+
+    each scroll waits for the page to grow rather than sleeping, and
+    gives up once it hasn't grown for `scroll_timeout` seconds. pages
+    backed by a paginated api are better read with fetch_json_pages,
+    which needs no browser at all
     """
 
-    warnings.filterwarnings("ignore")
-    # this throws a warning which i'm just ignoring for now
-    driver = webdriver.PhantomJS()
-    driver.implicitly_wait(implicit_wait)
+    pool = pool if pool else get_browsers(implicit_wait=implicit_wait)
 
     try:
-        driver.get(url)
+        with pool.session() as driver:
+            driver.get(url)
 
-        last_height = driver.execute_script("return document.body.scrollHeight")
+            last_height = page_height(driver)
 
-        while True:
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(scroll_pause_time)
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            print("last height: %d new height: %d" % (last_height, new_height))
-            if new_height == last_height:
-                break
-            last_height = new_height
+            while True:
+                scroll_to_bottom(driver)
+                new_height = wait_for_growth(driver, last_height, scroll_timeout)
+                logging.debug(
+                    "last height: %d new height: %s" % (last_height, new_height)
+                )
+                if not new_height:
+                    break
+                last_height = new_height
 
-        return driver.page_source
+            return driver.page_source
 
     except Exception as e:
         if attempt < attempts:
-            logging.info("retrying, on attept %d" % (attempt + 1))
-            return get_and_scroll(url, attempt + 1)
+            delay = backoff_delay(attempt)
+            logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+            time.sleep(delay)
+            return get_and_scroll(
+                url, attempt + 1, attempts, implicit_wait, scroll_timeout, pool=pool
+            )
         else:
             logging.error("unable to fetch %s, error: %s" % (url, e))
-    finally:
-        driver.quit()
+
+
+def fetch_json_pages(url, first_page=1, max_page=1000):
+    """
+    follow `next_page` through a paginated genius api listing,
+    yielding the `response` object of every page
+    """
+    page = first_page
+    separator = "&" if "?" in url else "?"
+    while page and page <= max_page:
+        text = fetch_with_retries("%s%spage=%d" % (url, separator, page))
+        if not text:
+            return
+
+        response = orjson.loads(text).get("response", {})
+        yield response
+        page = response.get("next_page")
 
 
 def fetch_with_retries(url, attempt=0, attempts=5):
     try:
-        response = requests.get(url)
+        cached = cache.lookup(url) if cache else None
+        if cached and cached.fresh:
+            return cached.body
+
+        if limiter:
+            limiter.acquire(url)
+        response = session.get(url, headers=validators(cached))
+        if cached and response.status_code == 304:
+            cache.revalidated(url)
+            return cached.body
         response.raise_for_status()
+        if cache:
+            cache.store(url, response.text, response.headers)
         return response.text
     except Exception as e:
-        if attempt < attempts:
-            logging.info("retrying, on attept %d" % (attempt + 1))
-            return fetch_with_retries(url, attempt + 1)
+        if attempt < attempts and _should_retry(e):
+            delay = _retry_delay(url, e, attempt)
+            logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+            time.sleep(delay)
+            return fetch_with_retries(url, attempt + 1, attempts)
+        else:
+            logging.error("unable to fetch %s, error: %s" % (url, e))
+
+
+async def fetch_with_retries_async(client, url, attempt=0, attempts=5):
+    """
+    asyncio version of fetch_with_retries. requests go through
+    the (pooled, keep-alive) connector of the supplied client session
+    """
+    try:
+        cached = cache.lookup(url) if cache else None
+        if cached and cached.fresh:
+            return cached.body
+
+        if limiter:
+            await limiter.acquire_async(url)
+        async with client.get(url, headers=validators(cached)) as response:
+            if cached and response.status == 304:
+                cache.revalidated(url)
+                return cached.body
+            response.raise_for_status()
+            text = await response.text()
+            if cache:
+                cache.store(url, text, response.headers)
+            return text
+    except Exception as e:
+        if attempt < attempts and _should_retry(e):
+            delay = _retry_delay(url, e, attempt)
+            logging.info("retrying in %0.1fs, on attept %d" % (delay, attempt + 1))
+            await asyncio.sleep(delay)
+            return await fetch_with_retries_async(client, url, attempt + 1, attempts)
         else:
             logging.error("unable to fetch %s, error: %s" % (url, e))
 
 
+def _response_error(e):
+    """
+    the status and headers behind a failed request, if it got a response
+    """
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code, e.response.headers
+    elif isinstance(e, requests.HTTPError) and e.args and isinstance(e.args[0], int):
+        # lyricsgenius raises HTTPError(status, message), without the response
+        return e.args[0], None
+    elif isinstance(e, aiohttp.ClientResponseError):
+        return e.status, e.headers
+    else:
+        return None, None
+
+
+def _should_retry(e):
+    status, _ = _response_error(e)
+    return status is None or status in RETRY_STATUSES
+
+
+def _retry_delay(url, e, attempt):
+    """
+    jittered backoff, or whatever Retry-After asks for. a 429 holds back
+    every worker sharing the limiter, not just this one
+    """
+    status, headers = _response_error(e)
+    delay = retry_delay(status, headers, attempt)
+    if status == 429 and limiter:
+        limiter.pause(url, delay)
+    return delay
+
+
+def open_client(concurrency=100, timeout=10):
+    """
+    a client session whose connector caps the number of open
+    connections and keeps them alive between requests
+    """
+    connector = aiohttp.TCPConnector(
+        limit=concurrency, limit_per_host=concurrency, keepalive_timeout=60
+    )
+    return aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)
+    )
+
+
 def fetch_all_letters(
     base_url="https://genius.com/artists-index/%s/all?page=%d",
     letters=string.ascii_lowercase,
     processes=-1,
     pool=None,
+    resume=None,
 ):
 
     num_processes = processes if processes > 0 else mp.cpu_count()
     pool = pool if pool else mp.Pool(num_processes)
 
-    artist_list = functools.reduce(
-        lambda acc, x: acc + x, pool.imap_unordered(fetch_letter, letters), []
+    # letters are picked back up after the last journaled index page
+    resume = resume if resume else JournalState()
+    remaining = [
+        (letter, resume.last_page(letter) + 1)
+        for letter in letters
+        if letter not in resume.letters_done
+    ]
+
+    artist_list = [a for letter in letters for a in resume.letter_artists(letter)]
+    artist_list.extend(
+        itertools.chain.from_iterable(
+            pool.imap_unordered(
+                functools.partial(_fetch_letter_from, base_url=base_url), remaining
+            )
+        )
     )
 
     logging.info(">>>fetched all artists! %d total<<<" % len(artist_list))
     return artist_list
 
 
+def _fetch_letter_from(task, base_url):
+    letter, first_page = task
+    return fetch_letter(letter, base_url, first_page=first_page)
+
+
 def fetch_letter(
-    letter, base_url="https://genius.com/artists-index/%s/all?page=%d", max_page=1000
+    letter,
+    base_url="https://genius.com/artists-index/%s/all?page=%d",
+    max_page=1000,
+    window=8,
+    first_page=1,
 ):
+    """
+    walk the index pages for a letter, keeping up to `window` pages
+    in flight ahead of the one being read. pages are consumed in order,
+    and anything still pending once an empty page marks the end of the
+    letter, or a page fails, is cancelled
+    """
+
+    executor = ThreadPoolExecutor(window)
+    pending = collections.deque()
+    next_page = first_page
 
     pages = []
     total = 0
-    for page in range(max_page):
-        logging.debug("letter: %s, page: %d" % (letter, page))
-        new_pages = fetch_letter_page(letter, page + 1, base_url)
+    try:
+        for page in range(first_page - 1, max_page):
+            while next_page <= max_page and len(pending) < window:
+                pending.append(
+                    executor.submit(fetch_letter_page, letter, next_page, base_url)
+                )
+                next_page += 1
+
+            logging.debug("letter: %s, page: %d" % (letter, page))
+            new_pages = pending.popleft().result()
+
+            links = len(new_pages)
+            total = total + links
+            logging.debug(
+                "page %s, got %d new links, %d total" % (letter, links, total)
+            )
 
-        links = len(new_pages)
-        total = total + links
-        logging.debug("page %s, got %d new links, %d total" % (letter, links, total))
+            if links < 1:
+                logging.info("got up to page %d for letter %s" % (page, letter))
+                if journal:
+                    journal.letter_done(letter, page)
+                break
 
-        if links < 1:
-            logging.info("got up to page %d for letter %s" % (page, letter))
-            break
+            if journal:
+                journal.page(letter, page + 1, new_pages)
+            pages.extend(new_pages)
+    finally:
+        # a failed page leaves the rest of the window to be called off
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
 
-        pages = pages + new_pages
+    return pages
+
+
+async def fetch_letter_async(
+    client,
+    letter,
+    base_url="https://genius.com/artists-index/%s/all?page=%d",
+    max_page=1000,
+    window=8,
+    first_page=1,
+):
+
+    pending = collections.deque()
+    next_page = first_page
+
+    pages = []
+    total = 0
+    try:
+        for page in range(first_page - 1, max_page):
+            while next_page <= max_page and len(pending) < window:
+                pending.append(
+                    asyncio.ensure_future(
+                        fetch_letter_page_async(client, letter, next_page, base_url)
+                    )
+                )
+                next_page += 1
+
+            logging.debug("letter: %s, page: %d" % (letter, page))
+            new_pages = await pending.popleft()
+
+            links = len(new_pages)
+            total = total + links
+            logging.debug(
+                "page %s, got %d new links, %d total" % (letter, links, total)
+            )
+
+            if links < 1:
+                logging.info("got up to page %d for letter %s" % (page, letter))
+                if journal:
+                    journal.letter_done(letter, page)
+                break
+
+            if journal:
+                journal.page(letter, page + 1, new_pages)
+            pages.extend(new_pages)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
 
     return pages
 
 
+async def fetch_all_artists_async(
+    client,
+    base_url="https://genius.com/artists-index/%s/all?page=%d",
+    letters=string.ascii_lowercase,
+    resume=None,
+):
+
+    resume = resume if resume else JournalState()
+    letter_pages = await asyncio.gather(
+        *[
+            fetch_letter_async(
+                client, letter, base_url, first_page=resume.last_page(letter) + 1
+            )
+            for letter in letters
+            if letter not in resume.letters_done
+        ]
+    )
+
+    artists = [Artist(**a) for letter in letters for a in resume.letter_artists(letter)]
+    artists.extend(Artist(**artist) for pages in letter_pages for artist in pages)
+
+    logging.info(">>>fetched all artists! %d total<<<" % len(artists))
+    return artists
+
+
 def fetch_letter_page(
     letter, page, base_url="https://genius.com/artists-index/%s/all?page=%d"
 ):
@@ -170,6 +740,20 @@ def fetch_letter_page(
     url = base_url % (letter, page)
     html = fetch_with_retries(url)
 
+    return parse_letter_page(html)
+
+
+async def fetch_letter_page_async(
+    client, letter, page, base_url="https://genius.com/artists-index/%s/all?page=%d"
+):
+
+    url = base_url % (letter, page)
+    html = await fetch_with_retries_async(client, url)
+
+    return parse_letter_page(html)
+
+
+def parse_letter_page(html):
     soup = BeautifulSoup(html, "lxml")
 
     return [
@@ -184,9 +768,10 @@ def fetch_all_artists(
     letters=string.ascii_lowercase,
     processes=-1,
     pool=None,
+    resume=None,
 ):
 
-    artists_data = fetch_all_letters(base_url, letters, processes, pool)
+    artists_data = fetch_all_letters(base_url, letters, processes, pool, resume)
     return [Artist(**artist) for artist in artists_data]
 
 
@@ -205,14 +790,73 @@ def fetch_songs_for_artist(artist):
     return artist
 
 
-def _recrawl_songs(a):
-    object_path = "/%s/%s/%s" % (lyrics_root, a.name[0].lower(), "%s.json" % a.name)
+def artist_key(a):
+    return "%s/%s" % (a.name[0].lower(), "%s.json" % a.name)
+
+
+def list_prefix(prefix):
+    """
+    every object under a prefix of the lyrics bucket, as key -> (size, etag)
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    return {
+        obj["Key"]: (obj["Size"], obj["ETag"])
+        for page in paginator.paginate(Bucket=lyrics_root, Prefix=prefix)
+        for obj in page.get("Contents", [])
+    }
+
+
+def s3_inventory(prefixes, threads=16):
+    """
+    list the lyrics bucket once, one paginated listing per prefix
+    """
+    inventory = {}
+    with ThreadPoolExecutor(threads) as executor:
+        for listing in executor.map(list_prefix, prefixes):
+            inventory.update(listing)
+
+    logging.info("%d objects in %s" % (len(inventory), lyrics_root))
+    return inventory
 
-    if s3.exists(object_path):
-        logging.debug("already have %s" % a.name)
-    else:
-        logging.info("dont have %s, recrawling" % a.name)
-        _get_and_save_songs(a)
+
+def missing_artists(artists):
+    """
+    the artists that don't have an object in the lyrics bucket yet
+    """
+    if shard_settings:
+        return missing_sharded_artists(artists)
+
+    prefixes = sorted({"%s/" % a.name[0].lower() for a in artists})
+    inventory = s3_inventory(prefixes)
+
+    missing = [
+        a for a in artists if artist_key(a) not in inventory or a.missing_songs
+    ]
+    logging.info("missing %d of %d artists" % (len(missing), len(artists)))
+    return missing
+
+
+def missing_sharded_artists(artists):
+    """
+    the artists that aren't in any finished shard's manifest, or that
+    are only there with songs missing
+    """
+    have = set()
+    partial = {}
+    for entry in read_manifest(s3_client, lyrics_root, shard_settings["prefix"]):
+        if entry.get("missing"):
+            partial[entry["url"]] = entry["missing"]
+        else:
+            have.add(entry["url"])
+
+    missing = []
+    for a in artists:
+        if a.url in partial and not a.missing_songs:
+            a.missing_songs = partial[a.url]
+        if a.url not in have or a.missing_songs:
+            missing.append(a)
+    logging.info("missing %d of %d artists" % (len(missing), len(artists)))
+    return missing
 
 
 def _get_and_save_songs(a):
@@ -220,24 +864,297 @@ def _get_and_save_songs(a):
         logging.info("artist id, not present for %s, fetching" % a.name)
         a.get_artist_id()
 
-    a.fetch_songs()  # get songs for the artist
-    logging.debug("fetched %d songs for %s" % (len(a.songs), a.name))
-    json = orjson.dumps(a.to_dict())
+    return _fetch_and_save_songs(a)
+
+
+def _journaled(task, a):
+    """
+    run a crawl task for an artist, recording its progress in the journal
+    """
+    if not journal:
+        return task(a)
+
+    journal.started(a)
+    try:
+        songs = task(a)
+    except Exception as e:
+        journal.failed(a, e)
+        raise
+    if not shard_settings:
+        # sharded artists are completed when their shard is, see _shard_closed
+        journal.completed(a, songs, a.missing_songs)
+    return songs
+
+
+def _get_ids(a):
+    return a.get_artist_id()
+
+
+def _worker_init(
+    q, shared_limiter, shared_cache, shared_journal, shared_shards, threads=(8, 32)
+):
+    global limiter, cache, journal, shard_settings, song_threads, max_song_threads
+
+    worker_init(q)
+    limiter = shared_limiter
+    cache = shared_cache
+    journal = shared_journal
+    shard_settings = shared_shards
+    song_threads, max_song_threads = threads
+
+
+def shard_writer():
+    """
+    this process's shard writer, whose last shard is closed when the process exits
+    """
+    global shards
+    if shards is None:
+        shards = ShardWriter(
+            s3_client, lyrics_root, on_roll=_shard_closed, **shard_settings
+        )
+        mp.util.Finalize(shards, shards.close, exitpriority=10)
+    return shards
+
+
+def _shard_closed(entries):
+    if journal:
+        for entry in entries:
+            artist = {k: entry[k] for k in ["name", "url", "artist_id"]}
+            if entry.get("missing"):
+                journal.write(
+                    "partial",
+                    artist=artist,
+                    songs=entry["songs"],
+                    missing=entry["missing"],
+                )
+            else:
+                journal.write("completed", artist=artist, songs=entry["songs"])
+
 
-    logging.debug("writing %s songs to s3" % a.name)
-    s3_client.put_object(
-        Body=json,
-        Bucket=lyrics_root,
-        Key="%s/%s" % (a.name[0].lower(), "%s.json" % a.name),
+def build_limiter(rate):
+    return RateLimiter(
+        {"genius.com": rate, "api.genius.com": rate}, default_rate=rate
     )
+
+
+def stored_songs(a):
+    """
+    the songs already in an artist's object, or None if there's no object
+    """
+    try:
+        obj = s3_client.get_object(Bucket=lyrics_root, Key=artist_key(a))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return orjson.loads(obj["Body"].read())["songs"]
+
+
+def _fetch_and_save_songs(a, song_executor=None):
+    """
+    fetch an artist's songs and save them. an artist with missing_songs
+    only fetches those: in json mode they're added to its object, and in
+    shard mode they go in a "supplement" record, which song_reader reads
+    as more songs of the artist rather than a repeat of it. songs are
+    fetched on `song_executor` if given, else a pool of the artist's own
+    """
+    if shard_settings:
+        # songs are compressed into the shard record as they arrive
+        head = a.head()
+        if a.missing_songs:
+            head["supplement"] = True
+        record = shard_writer().record(head)
+        a.fetch_songs(record=record, executor=song_executor)
+        logging.debug("writing %s songs to a shard" % a.name)
+        record.missing = a.missing_songs
+        record.close()
+        num_songs = record.songs
+    else:
+        songs = stored_songs(a) if a.missing_songs else []
+        if songs is None:
+            # nothing saved to add the missing songs to, so fetch them all
+            a.missing_songs = None
+            songs = []
+        a.fetch_songs(executor=song_executor)  # get songs for the artist
+        a.songs = songs + a.songs
+        num_songs = len(a.songs)
+        json = orjson.dumps(a.to_dict())
+
+        logging.debug("writing %s songs to s3" % a.name)
+        s3_client.put_object(
+            Body=json,
+            Bucket=lyrics_root,
+            Key=artist_key(a),
+        )
+    logging.debug("fetched %d songs for %s" % (num_songs, a.name))
     logging.debug("done with %s" % a.name)
 
     # free up space?
     a.songs = None
+    return num_songs
 
 
-def _get_ids(a):
-    return a.get_artist_id()
+async def _get_and_save_songs_async(client, executor, a, song_executor=None):
+    if not a.artist_id:
+        logging.info("artist id, not present for %s, fetching" % a.name)
+        await a.get_artist_id_async(client)
+
+    # lyricsgenius and boto3 are blocking, so they get a thread
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(_fetch_and_save_songs, a, song_executor)
+    )
+
+
+async def crawl_async(
+    artists, concurrency=100, task=_get_and_save_songs_async, song_workers=None
+):
+    """
+    crawl songs for each artist from a single process, keeping at
+    most `concurrency` artists in flight at once. every artist's songs
+    are fetched on one shared pool of `song_workers` threads (as many
+    as `concurrency` by default) rather than a pool per artist, so the
+    process runs a bounded number of threads however big the catalogs
+    """
+    song_workers = song_workers if song_workers else concurrency
+    queue = asyncio.Queue(maxsize=2 * concurrency)
+    stats = CrawlStats()
+
+    async def worker(client, executor, song_executor):
+        while True:
+            a = await queue.get()
+            try:
+                if a is None:
+                    return
+                start = time.time()
+                if journal:
+                    journal.started(a)
+                songs = await task(client, executor, a, song_executor)
+                if journal and not shard_settings:
+                    journal.completed(a, songs, a.missing_songs)
+                stats.record(a.name, True, time.time() - start)
+            except Exception as e:
+                logging.error("unable to crawl %s, error: %s" % (a.name, e))
+                if journal:
+                    journal.failed(a, e)
+                stats.record(a.name, False, time.time() - start, repr(e))
+            finally:
+                queue.task_done()
+
+    with ThreadPoolExecutor(concurrency) as executor, ThreadPoolExecutor(
+        song_workers
+    ) as song_executor:
+        async with open_client(concurrency) as client:
+            workers = [
+                asyncio.ensure_future(worker(client, executor, song_executor))
+                for _ in range(concurrency)
+            ]
+            for a in artists:
+                await queue.put(a)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    return stats
+
+
+def read_artists_file(path):
+    logging.info("restoring artist info from disk: %s" % path)
+    with open(path, "rb") as f:
+        artists = [Artist(**a) for a in orjson.loads(f.read())]
+    logging.info("got %d artists" % len(artists))
+    return artists
+
+
+def song_count_estimates(path):
+    """
+    artist url -> the number of songs a previous crawl found, from its journal
+    """
+    state = Journal(path).replay()
+    return {url: songs for url, songs in state.completed.items() if songs}
+
+
+def schedule(artists, estimates):
+    """
+    the biggest catalogs first, when there are song counts to go on
+    """
+    if not estimates:
+        return artists
+    return largest_first(artists, lambda a: estimates.get(a.url))
+
+
+def retry_artists(resume):
+    """
+    the artists the journal has down as failed, and the ones it has down
+    as partial, which only need their missing songs fetched
+    """
+    artists = {url: Artist(**a) for url, a in resume.failed.items()}
+    for url, entry in resume.partial.items():
+        artists[url] = Artist(missing_songs=entry["missing"], **entry["artist"])
+    return list(artists.values())
+
+
+def remaining_artists(artists, resume):
+    """
+    drop every artist the journal already has down as completed. the
+    partial ones stay, set to fetch just their missing songs
+    """
+    remaining = [a for a in artists if a.url not in resume.completed]
+    for a in remaining:
+        if a.url in resume.partial:
+            a.missing_songs = resume.partial[a.url]["missing"]
+    logging.info(
+        "resuming, %d of %d artists left to crawl" % (len(remaining), len(artists))
+    )
+    return remaining
+
+
+async def main_async(options, resume):
+    concurrency = int(options.concurrency)
+
+    if options.retry_failed:
+        artists = retry_artists(resume)
+    elif options.file:
+        artists = read_artists_file(options.file)
+    else:
+        async with open_client(concurrency) as client:
+            if options.letter:
+                logging.info("getting %s artists" % options.letter)
+                artists = await fetch_all_artists_async(
+                    client, letters=[options.letter], resume=resume
+                )
+            else:
+                logging.info("finding all artists")
+                artists = await fetch_all_artists_async(client, resume=resume)
+
+    logging.info("done. got %d" % len(artists))
+
+    if options.out:
+        logging.info("writing artist data to %s" % options.out)
+        with open(options.out, "wb") as f:
+            f.write(orjson.dumps([a.to_dict() for a in artists]))
+
+    if journal and not options.retry_failed:
+        artists = remaining_artists(artists, resume)
+
+    estimates = song_count_estimates(options.costs) if options.costs else {}
+    if not options.no_crawl:
+        artists = cached_artist_ids(artists)
+
+    if options.no_crawl:
+        logging.info("passing! see ya!")
+    elif options.recrawl:
+        logging.info("recrawling all artists, %d in flight" % concurrency)
+        artists = schedule(missing_artists(artists), estimates)
+        stats = await crawl_async(artists, concurrency)
+        stats.log_summary()
+    else:
+        logging.info("getting songs and saving to s3, %d in flight" % concurrency)
+        stats = await crawl_async(schedule(artists, estimates), concurrency)
+        stats.log_summary()
+
+    if shards:
+        shards.close()
+
+    logging.info("done")
 
 
 def get_optparser():
@@ -304,6 +1221,156 @@ def get_optparser():
         help="(optional) don't actually crawl songs",
     )
 
+    parser.add_option(
+        "-a",
+        "--async",
+        action="store_true",
+        dest="use_async",
+        help="(optional) crawl from a single process with asyncio",
+    )
+
+    parser.add_option(
+        "-c",
+        "--concurrency",
+        action="store",
+        dest="concurrency",
+        default=100,
+        help="max number of in-flight requests when crawling with asyncio",
+    )
+
+    parser.add_option(
+        "--chunksize",
+        action="store",
+        dest="chunksize",
+        default=4,
+        help="number of artists handed to a pool worker at a time",
+    )
+
+    parser.add_option(
+        "--queue",
+        action="store",
+        dest="queue",
+        default=4 * mp.cpu_count(),
+        help="max number of chunks queued or running in the pool at once",
+    )
+
+    parser.add_option(
+        "-F",
+        "--format",
+        action="store",
+        dest="format",
+        default="json",
+        help="json: one object per artist, ndjson: compressed, size-rolled shards",
+    )
+
+    parser.add_option(
+        "--compression",
+        action="store",
+        dest="compression",
+        default="gzip",
+        help="compression for ndjson shards, gzip or zstd",
+    )
+
+    parser.add_option(
+        "--shard_size",
+        action="store",
+        dest="shard_size",
+        default=256,
+        help="roll to a new ndjson shard after this many MB",
+    )
+
+    parser.add_option(
+        "--shard_prefix",
+        action="store",
+        dest="shard_prefix",
+        default="shards",
+        help="prefix in the lyrics bucket to write ndjson shards under",
+    )
+
+    parser.add_option(
+        "-T",
+        "--song_threads",
+        action="store",
+        dest="song_threads",
+        default=8,
+        help="number of an artist's songs to fetch lyrics for concurrently",
+    )
+
+    parser.add_option(
+        "--max_song_threads",
+        action="store",
+        dest="max_song_threads",
+        default=32,
+        help="most threads a single big artist's lyrics are fetched with",
+    )
+
+    parser.add_option(
+        "--costs",
+        action="store",
+        dest="costs",
+        default=None,
+        help="(optional) journal of a previous crawl, to crawl the artists "
+        "with the most songs first",
+    )
+
+    parser.add_option(
+        "--chunk_songs",
+        action="store",
+        dest="chunk_songs",
+        default=500,
+        help="with --costs, close a chunk of artists once it has this many songs",
+    )
+
+    parser.add_option(
+        "-R",
+        "--rate",
+        action="store",
+        dest="rate",
+        default=10,
+        help="max requests per second to each genius host, shared by all workers",
+    )
+
+    parser.add_option(
+        "-C",
+        "--cache",
+        action="store",
+        dest="cache",
+        default=None,
+        help="(optional) sqlite file to cache fetched pages and artist ids in",
+    )
+
+    parser.add_option(
+        "--cache_ttl",
+        action="store",
+        dest="cache_ttl",
+        default=7 * 24,
+        help="hours before a cached page is revalidated",
+    )
+
+    parser.add_option(
+        "--cache_size",
+        action="store",
+        dest="cache_size",
+        default=10,
+        help="max size of the page cache, in GB",
+    )
+
+    parser.add_option(
+        "-j",
+        "--journal",
+        action="store",
+        dest="journal",
+        default=None,
+        help="(optional) progress journal to record to and resume from",
+    )
+
+    parser.add_option(
+        "--retry_failed",
+        action="store_true",
+        dest="retry_failed",
+        help="only retry the artists the journal has down as failed",
+    )
+
     return parser
 
 
@@ -313,19 +1380,51 @@ def main():
 
     q_listener, q = logger_init(options.log_level.upper())
 
-    pool = mp.Pool(int(options.pool), worker_init, [q])
+    global limiter, cache, journal, shard_settings, song_threads, max_song_threads
+    limiter = build_limiter(float(options.rate))
+    song_threads = int(options.song_threads)
+    max_song_threads = max(song_threads, int(options.max_song_threads))
+    if options.format == "ndjson":
+        shard_settings = {
+            "prefix": options.shard_prefix,
+            "compression": options.compression,
+            "max_bytes": int(float(options.shard_size) * 2 ** 20),
+        }
+    if options.cache:
+        cache = ResponseCache(
+            options.cache,
+            ttl=float(options.cache_ttl) * 3600,
+            max_bytes=int(float(options.cache_size) * 2 ** 30),
+        )
+
+    resume = JournalState()
+    if options.journal:
+        journal = Journal(options.journal)
+        resume = journal.replay()
+    elif options.retry_failed:
+        opt_parser.error("--retry_failed needs a --journal to read failures from")
+
+    if options.use_async:
+        asyncio.run(main_async(options, resume))
+        q_listener.stop()
+        return
+
+    pool = mp.Pool(
+        int(options.pool),
+        _worker_init,
+        [q, limiter, cache, journal, shard_settings, (song_threads, max_song_threads)],
+    )
 
-    if options.file:
-        logging.info("restoring artist info from disk: %s" % options.file)
-        with open(options.file, "rb") as f:
-            artists = [Artist(**a) for a in orjson.loads(f.read())]
-        logging.info("got %d artists" % len(artists))
+    if options.retry_failed:
+        artists = retry_artists(resume)
+    elif options.file:
+        artists = read_artists_file(options.file)
     elif options.letter:
         logging.info("getting %s artists" % options.letter)
-        artists = [Artist(**a) for a in fetch_letter(options.letter)]
+        artists = fetch_all_artists(letters=[options.letter], pool=pool, resume=resume)
     else:
         logging.info("finding all artists")
-        artists = fetch_all_artists(pool=pool)
+        artists = fetch_all_artists(pool=pool, resume=resume)
 
     logging.info("done. got %d" % len(artists))
 
@@ -334,14 +1433,30 @@ def main():
         with open(options.out, "wb") as f:
             f.write(orjson.dumps([a.to_dict() for a in artists]))
 
+    if journal and not options.retry_failed:
+        artists = remaining_artists(artists, resume)
+
     if options.no_crawl:
         logging.info("passing! see ya!")
-    elif options.recrawl:
-        logging.info("recrawling all artists")
-        pool.imap_unordered(_recrawl_songs, artists)
     else:
+        if options.recrawl:
+            logging.info("recrawling all artists")
+            artists = missing_artists(artists)
+
+        estimates = song_count_estimates(options.costs) if options.costs else {}
+        artists = cached_artist_ids(artists)
+
         logging.info("getting songs and saving to s3")
-        pool.imap_unordered(_get_and_save_songs, artists)
+        stats = run_tasks(
+            pool,
+            functools.partial(_journaled, _get_and_save_songs),
+            schedule(artists, estimates),
+            chunksize=int(options.chunksize),
+            max_pending=int(options.queue),
+            cost=lambda a: estimates.get(a.url),
+            max_cost=int(options.chunk_songs),
+        )
+        stats.log_summary()
 
     logging.info("done")
 
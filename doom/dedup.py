@@ -0,0 +1,301 @@
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+"""
+bounded-memory deduplication of songs and lines across the corpus.
+
+everything is reduced to 64-bit blake2b hashes. recently seen hashes
+live in a dict; past a limit they're sorted and spilled to a run on
+disk that is memory-mapped and searched with searchsorted, so memory
+stays flat however large the catalog gets. songs are matched either
+exactly or, with minhash, when enough of their lines agree: a shared
+band only makes a song a candidate, and it's dropped once its signature
+agrees with the earlier song's on at least `threshold` of its rows
+"""
+
+modes = ["lines", "exact", "minhash"]
+
+# multiply-add hash permutations for minhash, fixed so that every
+# worker (and every run) computes the same signatures
+_rng = np.random.RandomState(0x6E6E)
+_mul = _rng.randint(0, 2 ** 62, size=256, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_add = _rng.randint(0, 2 ** 62, size=256, dtype=np.uint64)
+
+
+def hash64(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def hashes64(items):
+    """
+    the 64-bit hashes of a list of strings, as a uint64 array
+    """
+    return np.frombuffer(b"".join(hash64(x) for x in items), dtype="<u8")
+
+
+def minhash(hashes, num_perm=64):
+    """
+    the minhash signature of a set of (already hashed) shingles
+    """
+    permuted = hashes[:, None] * _mul[None, :num_perm] + _add[None, :num_perm]
+    return permuted.min(axis=0)
+
+
+def band_keys(signature, bands=16):
+    """
+    one hash per band of a signature, salted with the band number,
+    so two songs collide on a key when one of their bands is equal
+    """
+    rows = signature.reshape(bands, -1)
+    return hashes64([bytes([b]) + row.tobytes() for b, row in enumerate(rows)])
+
+
+def song_record(lines, mode="exact", num_perm=64, bands=16):
+    """
+    what the deduplicator needs to know about a song, computed in
+    the workers: (song keys, lines, line hashes, minhash signature)
+    """
+    hashes = hashes64(lines)
+    keys = signature = None
+    if mode == "minhash" and len(hashes):
+        signature = minhash(np.unique(hashes), num_perm)
+        keys = band_keys(signature, bands)
+    elif mode == "exact":
+        keys = hashes64(["\n".join(lines)])
+    return keys, lines, hashes, signature
+
+
+class RecordFile:
+    """
+    fixed-size records appended to a file on disk and read back by
+    number, so they take no memory however many there are
+    """
+
+    def __init__(self, path, dtype=np.int64, width=1):
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.record_bytes = self.dtype.itemsize * width
+        self.f = open(path, "w+b")
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, values):
+        values = np.asarray(values, dtype=self.dtype).reshape(-1, self.width)
+        self.f.write(values.tobytes())
+        self.size += len(values)
+
+    def read(self, i):
+        self.f.flush()
+        data = os.pread(self.f.fileno(), self.record_bytes, i * self.record_bytes)
+        return np.frombuffer(data, dtype=self.dtype)
+
+    def close(self):
+        self.f.close()
+
+
+class HashIndex:
+    """
+    the position each distinct 64-bit hash was first seen at, with at
+    most `max_in_memory` hashes held in memory and the rest in sorted
+    runs under `directory` (a temporary one unless given)
+    """
+
+    def __init__(self, directory=None, max_in_memory=2 ** 22):
+        self.temporary = directory is None
+        self.directory = directory if directory else tempfile.mkdtemp(prefix="dedup-")
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_in_memory = max_in_memory
+        self.recent = {}
+        self.runs = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add_many(self, hashes):
+        """
+        look up and add a batch of hashes, returning the position of each
+        one's first occurrence and a mask of which ones are new
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.full(len(hashes), -1, dtype=np.int64)
+
+        for keys, positions in self.runs:
+            i = np.minimum(np.searchsorted(keys, hashes), len(keys) - 1)
+            hit = (found < 0) & (keys[i] == hashes)
+            found[hit] = positions[i[hit]]
+
+        new = np.zeros(len(hashes), dtype=bool)
+        for i in np.flatnonzero(found < 0):
+            h = int(hashes[i])
+            position = self.recent.get(h)
+            if position is None:
+                position = self.recent[h] = self.size
+                self.size += 1
+                new[i] = True
+            found[i] = position
+
+        if len(self.recent) >= self.max_in_memory:
+            self._spill()
+
+        return found, new
+
+    def _spill(self):
+        n = len(self.recent)
+        keys = np.fromiter(self.recent.keys(), dtype=np.uint64, count=n)
+        positions = np.fromiter(self.recent.values(), dtype=np.int64, count=n)
+        order = np.argsort(keys)
+
+        path = os.path.join(self.directory, "run-%05d" % len(self.runs))
+        np.save(path + ".keys.npy", keys[order])
+        np.save(path + ".positions.npy", positions[order])
+        self.runs.append(
+            (
+                np.load(path + ".keys.npy", mmap_mode="r"),
+                np.load(path + ".positions.npy", mmap_mode="r"),
+            )
+        )
+        self.recent = {}
+        logging.debug("spilled %d hashes to %s" % (n, path))
+
+    def close(self):
+        self.runs = []
+        self.recent = {}
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Deduplicator:
+    """
+    drops songs that were already seen (exactly, or as near-duplicates
+    with minhash) and lines that were already seen. every line kept gets
+    the next position, and each later copy of it is logged, so how many
+    times each kept line occurred can be recovered with counts()
+
+    with minhash, the signature of every kept song is kept on disk, and
+    each band key points at the kept song it was first seen with, so a
+    song sharing a band with earlier ones is only dropped if its
+    estimated jaccard similarity to one of them reaches `threshold`
+    """
+
+    def __init__(
+        self, mode="exact", directory=None, max_in_memory=2 ** 22, threshold=0.8
+    ):
+        if mode not in modes:
+            raise ValueError("unknown dedup mode: %s" % mode)
+
+        self.mode = mode
+        self.directory = directory if directory else tempfile.mkdtemp(prefix="dedup-")
+        self.temporary = directory is None
+        self.lines = HashIndex(os.path.join(self.directory, "lines"), max_in_memory)
+        self.songs = None
+        if mode != "lines":
+            self.songs = HashIndex(os.path.join(self.directory, "songs"), max_in_memory)
+
+        self.threshold = threshold
+        self.signatures = None
+        self.key_songs = None
+
+        self.repeats_path = os.path.join(self.directory, "repeats.bin")
+        self.repeats = open(self.repeats_path, "wb")
+        self.songs_seen = 0
+        self.songs_dropped = 0
+        self.lines_seen = 0
+
+    def _similar_song(self, positions, new, signature):
+        """
+        the kept song that shares a band with this one and whose signature
+        agrees with its on at least `threshold` of the rows, or None. new
+        band keys point at that song or, if there's none, at this one,
+        which is kept
+        """
+        if self.signatures is None:
+            num_perm = len(signature)
+            self.signatures = RecordFile(
+                os.path.join(self.directory, "signatures.bin"), np.uint64, num_perm
+            )
+            self.key_songs = RecordFile(os.path.join(self.directory, "key_songs.bin"))
+
+        similar = None
+        candidates = {int(self.key_songs.read(p)[0]) for p in positions[~new]}
+        for song in sorted(candidates):
+            agree = np.mean(self.signatures.read(song) == signature)
+            if agree >= self.threshold:
+                similar = song
+                break
+
+        song = similar
+        if song is None:
+            song = len(self.signatures)
+            self.signatures.append(signature)
+        self.key_songs.append(np.full(np.count_nonzero(new), song))
+        return similar
+
+    def filter(self, record):
+        """
+        the lines of a song_record that haven't been seen before
+        """
+        keys, lines, hashes, signature = record
+        new = self.keep(keys, hashes, signature)
+        return [line for line, n in zip(lines, new) if n]
+
+    def keep(self, keys, hashes, signature=None):
+        """
+        a mask of the lines of a song, given by their hashes, that
+        haven't been seen before: none of them if the song itself has
+        """
+        self.songs_seen += 1
+
+        if self.songs is not None and keys is not None:
+            positions, new = self.songs.add_many(keys)
+            if signature is None:
+                duplicate = not new.all()
+            else:
+                duplicate = self._similar_song(positions, new, signature) is not None
+            if duplicate:
+                self.songs_dropped += 1
+                return np.zeros(len(hashes), dtype=bool)
+
+        self.lines_seen += len(hashes)
+        positions, new = self.lines.add_many(hashes)
+        self.repeats.write(positions[~new].tobytes())
+        return new
+
+    def counts(self, chunk_size=2 ** 24):
+        """
+        how many times each kept line occurred, by position
+        """
+        self.repeats.flush()
+        counts = np.ones(len(self.lines), dtype=np.uint32)
+        if os.path.getsize(self.repeats_path):
+            repeats = np.memmap(self.repeats_path, dtype=np.int64, mode="r")
+            for start in range(0, len(repeats), chunk_size):
+                chunk = repeats[start : start + chunk_size]
+                counts += np.bincount(chunk, minlength=len(counts)).astype(np.uint32)
+        return counts
+
+    def log_summary(self):
+        logging.info(
+            "dedup: dropped %d of %d songs, kept %d distinct of %d lines"
+            % (self.songs_dropped, self.songs_seen, len(self.lines), self.lines_seen)
+        )
+
+    def close(self):
+        self.repeats.close()
+        self.lines.close()
+        if self.songs is not None:
+            self.songs.close()
+        if self.signatures is not None:
+            self.signatures.close()
+            self.key_songs.close()
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,139 @@
+import os
+import time
+import orjson
+import logging
+
+"""
+an append-only journal of crawl progress.
+
+every event is a single json line written with one O_APPEND write,
+so pool workers can share the file without coordinating. replaying
+the journal gives back which artists are done, which failed, which
+are done but for some songs (partial), which were in flight when the
+crawl died, and how far each letter of the artist index got
+"""
+
+
+def artist_record(a):
+    return {"name": a.name, "url": a.url, "artist_id": a.artist_id}
+
+
+class JournalState:
+    def __init__(self):
+        self.completed = {}
+        self.failed = {}
+        self.partial = {}
+        self.in_flight = {}
+        self.pages = {}
+        self.letters_done = set()
+
+    def last_page(self, letter):
+        return max(self.pages.get(letter, {0: None}))
+
+    def letter_artists(self, letter):
+        """
+        every artist found on the journaled index pages of a letter, in page order
+        """
+        pages = self.pages.get(letter, {})
+        return [artist for page in sorted(pages) for artist in pages[page]]
+
+    def apply(self, record):
+        event = record["event"]
+        if event == "page":
+            self.pages.setdefault(record["letter"], {})[record["page"]] = record[
+                "artists"
+            ]
+        elif event == "letter_done":
+            self.letters_done.add(record["letter"])
+        else:
+            artist = record["artist"]
+            url = artist["url"]
+            self.in_flight.pop(url, None)
+            if event == "started":
+                self.in_flight[url] = artist
+            elif event == "completed":
+                self.failed.pop(url, None)
+                self.partial.pop(url, None)
+                self.completed[url] = record.get("songs")
+            elif event == "partial":
+                self.failed.pop(url, None)
+                self.completed.pop(url, None)
+                self.partial[url] = {"artist": artist, "missing": record["missing"]}
+            elif event == "failed":
+                self.failed[url] = artist
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_fd"] = None
+        state["_pid"] = None
+        return state
+
+    @property
+    def fd(self):
+        if self._fd is None or self._pid != os.getpid():
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            self._fd = os.open(self.path, flags, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def write(self, event, **fields):
+        fields["event"] = event
+        fields["t"] = time.time()
+        os.write(self.fd, orjson.dumps(fields) + b"\n")
+
+    def page(self, letter, page, artists):
+        self.write("page", letter=letter, page=page, artists=artists)
+
+    def letter_done(self, letter, page):
+        self.write("letter_done", letter=letter, page=page)
+
+    def started(self, a):
+        self.write("started", artist=artist_record(a))
+
+    def completed(self, a, songs=None, missing=None):
+        """
+        an artist is done, or with songs still `missing` ({"id", "url"}
+        of each), partial, so a later run can fetch just those
+        """
+        if missing:
+            self.write("partial", artist=artist_record(a), songs=songs, missing=missing)
+        else:
+            self.write("completed", artist=artist_record(a), songs=songs)
+
+    def failed(self, a, error):
+        self.write("failed", artist=artist_record(a), error=str(error))
+
+    def replay(self):
+        state = JournalState()
+        if not os.path.exists(self.path):
+            return state
+
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # a write cut short when the crawl was killed
+                    logging.warning("skipping partial journal entry")
+                    continue
+                state.apply(record)
+
+        logging.info(
+            "journal: %d completed, %d partial, %d failed, %d in flight, "
+            "%d letters done"
+            % (
+                len(state.completed),
+                len(state.partial),
+                len(state.failed),
+                len(state.in_flight),
+                len(state.letters_done),
+            )
+        )
+        return state
@@ -0,0 +1,137 @@
+import os
+import orjson
+import logging
+
+import numpy as np
+
+"""
+tokenized sequences stored as a ragged array on disk: a directory
+holding every sequence's tokens back to back in tokens.bin, where
+each sequence starts in offsets.bin (int64, one more entry than
+there are sequences), and a small meta.json header. a deduplicated
+corpus also has counts.bin (uint32), how many times each sequence
+occurred.
+
+sequences are appended as they're produced and read back through
+numpy.memmap, so nothing has to be parsed or fully loaded before
+training starts and processes reading the same file share pages
+"""
+
+tokens_file = "tokens.bin"
+offsets_file = "offsets.bin"
+meta_file = "meta.json"
+counts_file = "counts.bin"
+
+
+def token_dtype(vocab_size):
+    return "uint16" if vocab_size <= 2 ** 16 else "int32"
+
+
+class RaggedWriter:
+    def __init__(self, path, dtype="int32"):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.tokens = open(os.path.join(path, tokens_file), "wb")
+        self.offsets = open(os.path.join(path, offsets_file), "wb")
+        self.sequences = 0
+        self.total = 0
+        self.offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.tokens.close()
+        self.offsets.close()
+
+    def append_batch(self, ids, offsets):
+        """
+        append a batch of sequences given as flat ids plus offsets,
+        sequence i being ids[offsets[i]:offsets[i + 1]]
+        """
+        ids = np.asarray(ids)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        self.tokens.write(ids[offsets[0] : offsets[-1]].astype(self.dtype).tobytes())
+        self.offsets.write((offsets[1:] - offsets[0] + self.total).tobytes())
+
+        self.sequences += len(offsets) - 1
+        self.total += int(offsets[-1] - offsets[0])
+
+    def append(self, seq):
+        self.append_batch(seq, [0, len(seq)])
+
+    def close(self, **meta):
+        """
+        finish the file, recording `meta` (e.g. max_seq_len, total_words)
+        in its header
+        """
+        self.tokens.close()
+        self.offsets.close()
+
+        meta.update(dtype=self.dtype.name, sequences=self.sequences, tokens=self.total)
+        with open(os.path.join(self.path, meta_file), "wb") as f:
+            f.write(orjson.dumps(meta))
+
+        logging.info(
+            "wrote %d sequences, %d tokens to %s"
+            % (self.sequences, self.total, self.path)
+        )
+
+
+def _memmap(path, dtype):
+    if os.path.getsize(path) == 0:
+        # numpy can't map an empty file
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class RaggedSequences:
+    """
+    read-only view of a ragged file. indexing gives a sequence
+    as an array backed by the mapped file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, meta_file), "rb") as f:
+            self.meta = orjson.loads(f.read())
+
+        self.tokens = _memmap(os.path.join(path, tokens_file), self.meta["dtype"])
+        self.offsets = _memmap(os.path.join(path, offsets_file), np.int64)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["meta"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def counts(self):
+        """
+        occurrences of each sequence, or None if it wasn't deduplicated
+        """
+        path = os.path.join(self.path, counts_file)
+        return _memmap(path, np.uint32) if os.path.exists(path) else None
+
+
+def write_counts(path, counts):
+    with open(os.path.join(path, counts_file), "wb") as f:
+        f.write(np.asarray(counts, dtype=np.uint32).tobytes())
+
+
+def is_ragged(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, meta_file))
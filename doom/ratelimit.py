@@ -0,0 +1,127 @@
+import time
+import random
+import asyncio
+import logging
+import email.utils
+import multiprocessing as mp
+
+from urllib.parse import urlparse
+
+"""
+rate limiting and backoff shared by every crawler worker.
+
+bucket state lives in shared memory, so a limiter built in the parent
+and handed to the pool initializer is shared by all worker processes
+(and by every coroutine / thread within them)
+"""
+
+# statuses worth retrying; everything else is treated as a hard failure
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class TokenBucket:
+    """
+    a token bucket whose tokens may go negative: each caller takes a
+    token immediately and is told how long to wait for it, so callers
+    queue up fairly instead of polling
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst else rate)
+        self._lock = mp.Lock()
+        self._tokens = mp.Value("d", self.burst, lock=False)
+        self._stamp = mp.Value("d", time.time(), lock=False)
+        self._paused_until = mp.Value("d", 0.0, lock=False)
+
+    def reserve(self):
+        """
+        take a token, returning the number of seconds to wait before using it
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._stamp.value
+            tokens = min(self.burst, self._tokens.value + elapsed * self.rate) - 1
+            self._tokens.value = tokens
+            self._stamp.value = now
+
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            return max(wait, self._paused_until.value - now)
+
+    def pause(self, seconds):
+        """
+        hold back every caller for the next `seconds`
+        """
+        with self._lock:
+            self._paused_until.value = max(
+                self._paused_until.value, time.time() + seconds
+            )
+
+
+class RateLimiter:
+    """
+    per-host token buckets. hosts have to be known up front so their
+    buckets can be placed in shared memory before the pool forks
+    """
+
+    def __init__(self, rates, default_rate=5, burst=None):
+        self.default_rate = default_rate
+        self.burst = burst
+        self.buckets = {host: TokenBucket(rate, burst) for host, rate in rates.items()}
+
+    def bucket(self, url):
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            logging.debug("no shared bucket for %s, limiting locally" % host)
+            self.buckets[host] = TokenBucket(self.default_rate, self.burst)
+        return self.buckets[host]
+
+    def acquire(self, url):
+        wait = self.bucket(url).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        wait = self.bucket(url).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, url, seconds):
+        logging.info("backing off %s for %0.1fs" % (urlparse(url).netloc, seconds))
+        self.bucket(url).pause(seconds)
+
+
+def backoff_delay(attempt, base=0.5, cap=60.0):
+    """
+    "full jitter" exponential backoff: uniform in [0, min(cap, base * 2^attempt)]
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(headers):
+    """
+    seconds to wait according to a Retry-After header, if there is one.
+    handles both the delta-seconds and http-date forms
+    """
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(status, headers, attempt):
+    """
+    how long to wait before retrying a response with the given status
+    """
+    delay = retry_after(headers) if status == 429 or status == 503 else None
+    return delay if delay is not None else backoff_delay(attempt)
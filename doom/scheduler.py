@@ -0,0 +1,181 @@
+import time
+import logging
+import threading
+from array import array
+
+from .utils import chunks
+
+"""
+dispatching crawl work to a process pool: a bounded number of
+chunks in flight, every result and exception collected, and a
+timing summary at the end. with a cost estimate per item, the
+most expensive work goes out first, in smaller chunks
+"""
+
+
+class CrawlStats:
+    def __init__(self, slowest=10):
+        self.start = time.time()
+        self.timings = array("d")
+        self.failures = []
+        self.slowest = []
+        self.keep_slowest = slowest
+
+    @property
+    def completed(self):
+        return len(self.timings)
+
+    @property
+    def succeeded(self):
+        return self.completed - len(self.failures)
+
+    def record(self, key, ok, elapsed, error=None):
+        self.timings.append(elapsed)
+        if not ok:
+            self.failures.append((key, error))
+
+        self.slowest.append((elapsed, key))
+        if len(self.slowest) > 4 * self.keep_slowest:
+            self.slowest = sorted(self.slowest, reverse=True)[: self.keep_slowest]
+
+    def percentile(self, q):
+        if not self.timings:
+            return 0.0
+        ordered = sorted(self.timings)
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+    def progress(self):
+        elapsed = time.time() - self.start
+        return "%d done (%d failed) in %0.0fs, %0.2f/s" % (
+            self.completed,
+            len(self.failures),
+            elapsed,
+            self.completed / elapsed if elapsed > 0 else 0.0,
+        )
+
+    def log_summary(self):
+        logging.info("crawl finished: %s" % self.progress())
+        if self.timings:
+            logging.info(
+                "per-artist seconds: mean %0.1f, p50 %0.1f, p95 %0.1f, max %0.1f"
+                % (
+                    sum(self.timings) / len(self.timings),
+                    self.percentile(50),
+                    self.percentile(95),
+                    max(self.timings),
+                )
+            )
+        for elapsed, key in sorted(self.slowest, reverse=True)[: self.keep_slowest]:
+            logging.info("slow: %s took %0.1fs" % (key, elapsed))
+        for key, error in self.failures:
+            logging.error("failed: %s, error: %s" % (key, error))
+
+
+def run_timed(task, key, item):
+    start = time.time()
+    try:
+        task(item)
+        return (key, True, time.time() - start, None)
+    except Exception as e:
+        logging.error("unable to crawl %s, error: %s" % (key, e))
+        return (key, False, time.time() - start, repr(e))
+
+
+def largest_first(items, cost):
+    """
+    items ordered by estimated cost, largest first. items without an
+    estimate (a cost of None) are taken to be typical, and slot in at
+    the median of the known costs
+    """
+    costs = [cost(item) for item in items]
+    known = sorted(c for c in costs if c is not None)
+    typical = known[len(known) // 2] if known else 0
+
+    order = sorted(
+        range(len(items)), key=lambda i: -(typical if costs[i] is None else costs[i])
+    )
+    logging.info(
+        "scheduling largest first, %d of %d with estimates, typical cost %s"
+        % (len(known), len(items), typical)
+    )
+    return [items[i] for i in order]
+
+
+def cost_chunks(items, cost, size, max_cost):
+    """
+    like chunks, except a chunk is also closed once the cost of its items
+    reaches `max_cost`, so expensive items go out alone or in small groups
+    """
+    chunk = []
+    total = 0
+    for item in items:
+        chunk.append(item)
+        total += cost(item) or 0
+        if len(chunk) >= size or total >= max_cost:
+            yield chunk
+            chunk = []
+            total = 0
+    if chunk:
+        yield chunk
+
+
+def _run_chunk(task, chunk):
+    return [run_timed(task, key, item) for key, item in chunk]
+
+
+def run_tasks(
+    pool,
+    task,
+    items,
+    key=lambda a: a.name,
+    chunksize=4,
+    max_pending=16,
+    log_every=1000,
+    cost=None,
+    max_cost=None,
+):
+    """
+    run `task` over `items` on the pool, `chunksize` items per dispatch with
+    at most `max_pending` chunks queued or running at once, and block until
+    every one has finished. given a `cost` estimate per item, chunks are
+    also capped at `max_cost`
+    """
+    slots = threading.BoundedSemaphore(max_pending)
+    stats = CrawlStats()
+
+    def on_done(results):
+        for result in results:
+            stats.record(*result)
+            if stats.completed % log_every == 0:
+                logging.info("progress: %s" % stats.progress())
+        slots.release()
+
+    def on_error(keys):
+        def callback(e):
+            # the chunk itself never ran (e.g. it couldn't be pickled)
+            for k in keys:
+                stats.record(k, False, 0.0, repr(e))
+            slots.release()
+
+        return callback
+
+    keyed = ((key(item), item) for item in items)
+    if cost and max_cost:
+        batches = cost_chunks(keyed, lambda ki: cost(ki[1]), chunksize, max_cost)
+    else:
+        batches = chunks(keyed, chunksize)
+
+    for chunk in batches:
+        slots.acquire()
+        pool.apply_async(
+            _run_chunk,
+            (task, chunk),
+            callback=on_done,
+            error_callback=on_error([k for k, _ in chunk]),
+        )
+
+    # every slot back means every chunk has reported in
+    for _ in range(max_pending):
+        slots.acquire()
+
+    return stats
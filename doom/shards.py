@@ -0,0 +1,290 @@
+import io
+import os
+import gzip
+import uuid
+import zlib
+import socket
+import orjson
+import logging
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+writing artists to s3 as compressed, size-rolled ndjson shards.
+
+every artist is one json line compressed as its own gzip member (or
+zstd frame), so a shard is still a valid .gz / .zst file read start
+to finish, while the manifest's offset and length for an artist are
+enough to fetch and decompress just that artist with a range get
+"""
+
+extensions = {"gzip": "gz", "zstd": "zst"}
+
+
+def compressor(compression="gzip"):
+    if compression == "gzip":
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd shards need the zstandard package")
+        return zstandard.ZstdCompressor().compressobj()
+    else:
+        raise ValueError("unknown compression: %s" % compression)
+
+
+def compress_member(data, compression="gzip"):
+    """
+    compress `data` as a complete member / frame of its own
+    """
+    c = compressor(compression)
+    return c.compress(data) + c.flush()
+
+
+def decompress(data, compression="gzip"):
+    if compression == "gzip":
+        return zlib.decompress(data, 31)
+    elif compression == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    else:
+        raise ValueError("unknown compression: %s" % compression)
+
+
+def decompress_stream(fileobj, compression="gzip"):
+    """
+    a binary file decompressing every member / frame of a shard as
+    it's read from `fileobj`, so it can be read a line at a time
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    elif compression == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True
+        )
+        return io.BufferedReader(reader)
+    else:
+        raise ValueError("unknown compression: %s" % compression)
+
+
+class MultipartUpload:
+    """
+    an s3 multipart upload that is fed bytes and sends a part
+    whenever `part_size` of them have piled up
+    """
+
+    def __init__(self, client, bucket, key, part_size=8 * 2 ** 20):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, 5 * 2 ** 20)  # the s3 minimum
+        self.parts = []
+        self.buffer = bytearray()
+        self.upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)[
+            "UploadId"
+        ]
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.part_size:
+            self._send()
+
+    def _send(self):
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.buffer = bytearray()
+
+    def complete(self):
+        if self.buffer:
+            self._send()  # the last part is allowed to be small
+
+        if not self.parts:
+            self.abort()
+            return
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        logging.debug("uploaded %s in %d parts" % (self.key, len(self.parts)))
+
+    def abort(self):
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
+
+class ArtistRecord:
+    """
+    one artist streamed into a shard: the artist's fields are written
+    up front, songs are compressed as they are added, and nothing
+    reaches the shard until the record is closed
+    """
+
+    def __init__(self, writer, head):
+        self.writer = writer
+        self.head = head
+        self.songs = 0
+        # {"id", "url"} of the artist's songs that couldn't be fetched
+        self.missing = None
+        self.compressor = compressor(writer.compression)
+        self.chunks = []
+        self._write(orjson.dumps(head)[:-1] + b',"songs":[')
+
+    def _write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.chunks.append(compressed)
+
+    def add(self, song):
+        self._write((b"," if self.songs else b"") + orjson.dumps(song))
+        self.songs += 1
+
+    def close(self):
+        self._write(b"]}\n")
+        self.chunks.append(self.compressor.flush())
+        self.writer.commit(self)
+        self.chunks = None
+
+
+class ShardWriter:
+    """
+    appends artist records to `<prefix>/<name>-<n>.ndjson.<ext>`, rolling
+    to a new shard once one passes `max_bytes`. each finished shard gets
+    a manifest at `<prefix>/manifest/<name>-<n>.ndjson` listing where in
+    it every artist starts. artists are only durable once their shard is
+    closed, which is when `on_roll` is called with their manifest entries
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket,
+        prefix="shards",
+        compression="gzip",
+        max_bytes=256 * 2 ** 20,
+        part_size=8 * 2 ** 20,
+        on_roll=None,
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.on_roll = on_roll
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.part_size = part_size
+        self.name = "%s-%d-%s" % (
+            socket.gethostname(),
+            os.getpid(),
+            uuid.uuid4().hex[:8],
+        )
+        self.shards = 0
+        self.upload = None
+        self.lock = threading.Lock()
+
+    def record(self, head):
+        return ArtistRecord(self, head)
+
+    def write(self, head, songs):
+        record = self.record(head)
+        for song in songs:
+            record.add(song)
+        record.close()
+        return record
+
+    def _open(self):
+        self.shards += 1
+        self.shard_name = "%s-%05d" % (self.name, self.shards)
+        key = "%s/%s.ndjson.%s" % (
+            self.prefix,
+            self.shard_name,
+            extensions[self.compression],
+        )
+        self.upload = MultipartUpload(self.client, self.bucket, key, self.part_size)
+        self.offset = 0
+        self.entries = []
+        logging.info("opened shard %s" % key)
+
+    def commit(self, record):
+        with self.lock:
+            if self.upload is None:
+                self._open()
+
+            start = self.offset
+            for chunk in record.chunks:
+                self.upload.write(chunk)
+                self.offset += len(chunk)
+
+            entry = dict(record.head)
+            entry.update(
+                {
+                    "shard": self.upload.key,
+                    "offset": start,
+                    "length": self.offset - start,
+                    "songs": record.songs,
+                }
+            )
+            if record.missing:
+                entry["missing"] = record.missing
+            self.entries.append(entry)
+
+            if self.offset >= self.max_bytes:
+                self._roll()
+
+    def _roll(self):
+        self.upload.complete()
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key="%s/manifest/%s.ndjson" % (self.prefix, self.shard_name),
+            Body=b"".join(orjson.dumps(e) + b"\n" for e in self.entries),
+        )
+        logging.info(
+            "closed shard %s, %d artists, %d bytes"
+            % (self.upload.key, len(self.entries), self.offset)
+        )
+        self.upload = None
+
+        if self.on_roll:
+            self.on_roll(self.entries)
+
+    def close(self):
+        with self.lock:
+            if self.upload is not None:
+                self._roll()
+
+
+def read_manifest(client, bucket, prefix="shards"):
+    """
+    every manifest entry under a shard prefix
+    """
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix="%s/manifest/" % prefix):
+        for obj in page.get("Contents", []):
+            body = client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read()
+            for line in body.splitlines():
+                yield orjson.loads(line)
+
+
+def read_artist(client, bucket, entry, compression="gzip"):
+    """
+    fetch a single artist from its shard with a range get
+    """
+    end = entry["offset"] + entry["length"] - 1
+    body = client.get_object(
+        Bucket=bucket,
+        Key=entry["shard"],
+        Range="bytes=%d-%d" % (entry["offset"], end),
+    )["Body"].read()
+    return orjson.loads(decompress(body, compression))
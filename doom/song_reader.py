@@ -1,3 +1,5 @@
+import os
+import glob
 import logging
 import gzip
 import orjson
@@ -6,49 +8,133 @@ import itertools
 import pickle
 import cld3
 import re
+import hashlib
+import collections
+
+from collections import namedtuple
 
 import numpy as np
 import keras.utils as ku
 import multiprocessing as mp
 
 from tqdm import tqdm
+from numpy.lib.stride_tricks import as_strided
 from optparse import OptionParser
 from keras.preprocessing.text import Tokenizer
-from keras.preprocessing.sequence import pad_sequences
 from sklearn.feature_extraction.text import HashingVectorizer
 
-from .utils import logger_init, worker_init
+from .utils import chunks, imap_bounded, logger_init, worker_init
+from .ragged import RaggedSequences, RaggedWriter, is_ragged, token_dtype
+from .ragged import write_counts
+from .dedup import Deduplicator, hash64, song_record
+from .cache import LanguageCache
+from .stats import SequenceStats, batch_summary
+from .vocab import Vocabulary, count_words, encode_file_batch
 
 """
 various utilities for reading a unified artists & song
 data for subsequent modeling
 """
 
+# set per process from the command line, see _worker_init
+language_cache = None
+
+# what a crawler "supplement" record (the songs a retry fetched for an
+# artist saved with some missing) is keyed by in place of its artist_id,
+# so that it isn't taken for a repeat of the artist. identical copies of
+# a supplement still are
+Supplement = namedtuple("Supplement", ["artist_id", "digest"])
+
 
 def read_file(path):
     """
     a generator for processing line-delimited json
     one line at a time
     """
+    for line in read_raw_lines(path):
+        yield orjson.loads(line)
+
+
+def read_raw_lines(path):
+    """
+    the undecoded lines of a line-delimited json file
+    """
     logging.info("opening %s" % path)
     with gzip.open(path, "rb") as f:
         for line in f:
-            yield orjson.loads(line)
+            if line.strip():
+                yield line
+
+
+def input_paths(path):
+    """
+    the files making up a corpus: a single file, a directory
+    of gzipped shards, or a glob matching them. the .index.gz
+    files written alongside a block-compressed corpus are skipped
+    """
+    if os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "*.gz"))
+    else:
+        paths = glob.glob(path) or [path]
+    return sorted(p for p in paths if not p.endswith(".index.gz"))
+
+
+def detect_language(lyrics, max_chars=2000):
+    """
+    (language, is_reliable) for some lyrics. detection runs on the
+    first `max_chars` characters, falling back to the full text only
+    when that prediction isn't reliable
+    """
+    prediction = cld3.get_language(lyrics[:max_chars])
+    if not prediction.is_reliable and len(lyrics) > max_chars:
+        prediction = cld3.get_language(lyrics)
+    return prediction.language, prediction.is_reliable
 
 
-def song_to_lines(song, min_lines=20, acceptable_languages=["en"]):
+def song_languages(songs, min_lines=20):
+    """
+    (language, is_reliable) by index for every song long enough to be
+    used. predictions come from the language cache when it has them;
+    the rest are detected and written back in one batch
+    """
+    eligible = {
+        i: song["lyrics"]
+        for i, song in enumerate(songs)
+        if song.get("lyrics") and len(song["lyrics"].split("\n")) >= min_lines
+    }
+    keys = {i: LanguageCache.key(lyrics) for i, lyrics in eligible.items()}
+    cached = language_cache.get_many(set(keys.values())) if language_cache else {}
+
+    languages = {}
+    detected = []
+    for i, lyrics in eligible.items():
+        if keys[i] in cached:
+            languages[i] = cached[keys[i]]
+        else:
+            languages[i] = detect_language(lyrics)
+            detected.append((keys[i],) + languages[i])
+
+    if language_cache and detected:
+        language_cache.put_many(detected)
+
+    return languages
+
+
+def song_to_lines(song, min_lines=20, acceptable_languages=["en"], language=None):
     """
     takes a song and returns an array where
     each line is an element
+
+    `language` is a (language, is_reliable) prediction made
+    beforehand; without one it's detected here
     """
     if "lyrics" in song and song["lyrics"]:
         lines = song["lyrics"].lower().split("\n")
         if len(lines) >= min_lines:
-            lang_prediction = cld3.get_language(song["lyrics"])
-            if (
-                lang_prediction.is_reliable
-                and lang_prediction.language in acceptable_languages
-            ):
+            language, is_reliable = (
+                language if language else detect_language(song["lyrics"])
+            )
+            if is_reliable and language in acceptable_languages:
                 return lines
             else:
                 return []
@@ -58,9 +144,9 @@ def song_to_lines(song, min_lines=20, acceptable_languages=["en"]):
         return []
 
 
-def artist_to_lines(artist, min_songs=10):
+def artist_to_songs(artist, min_songs=10):
     """
-    turns an artist into a list of song lines
+    the lines of each of an artist's usable songs
     todo: make this a parallel process?
           thinking no for now since most artists
           have a small number of songs
@@ -68,13 +154,25 @@ def artist_to_lines(artist, min_songs=10):
     logging.debug("reading songs for %s (%s)" % (artist["name"], artist["artist_id"]))
     if "songs" in artist and artist["songs"]:
         if len(artist["songs"]) >= min_songs:
-            return itertools.chain.from_iterable(map(song_to_lines, artist["songs"]))
+            languages = song_languages(artist["songs"])
+            songs = (
+                song_to_lines(song, language=languages.get(i))
+                for i, song in enumerate(artist["songs"])
+            )
+            return [lines for lines in songs if lines]
         else:
             return []
     else:
         return []
 
 
+def artist_to_lines(artist, min_songs=10):
+    """
+    turns an artist into a list of song lines
+    """
+    return itertools.chain.from_iterable(artist_to_songs(artist, min_songs))
+
+
 def unique_artist_filter(artists):
     seen = set()
     for artist in artists:
@@ -83,17 +181,281 @@ def unique_artist_filter(artists):
             yield artist
 
 
-def artist_file_to_lines(path, pool):
+def artist_shard(artist_id, shards):
+    """
+    which of `shards` shards an artist belongs to, the same on every
+    machine and in every run
+    """
+    digest = hashlib.blake2b(str(artist_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards
+
+
+# where the crawler puts artist_id: right after the name and url when an
+# artist is streamed into a shard, or as the last field of to_dict
+_leading_artist_id = re.compile(
+    rb'^\{"name":(?:null|"(?:[^"\\]|\\.)*"),"url":(?:null|"(?:[^"\\]|\\.)*"),'
+    rb'"artist_id":(null|-?\d+|"\d+")[,}]'
+)
+_trailing_artist_id = re.compile(rb',"artist_id":(null|-?\d+|"\d+")\}\s*$')
+
+
+def raw_artist_shard(raw, shards):
+    """
+    artist_shard for a raw artist line, reading the artist_id off the
+    line without parsing the rest of it (its songs) where it can
+    """
+    match = _leading_artist_id.match(raw) or _trailing_artist_id.search(raw)
+    if match is None:
+        return artist_shard(orjson.loads(raw)["artist_id"], shards)
+    value = match.group(1)
+    artist_id = None if value == b"null" else value.strip(b'"').decode("ascii")
+    return artist_shard(artist_id, shards)
+
+
+def parse_shard(shard):
+    """
+    "i/N" as (i, N), with shards numbered from 0
+    """
+    i, n = (int(x) for x in shard.split("/"))
+    if not 0 <= i < n:
+        raise ValueError("shard %d is out of range for %d shards" % (i, n))
+    return i, n
+
+
+def shard_path(path, shard):
+    """
+    lyrics.json.gz as lyrics-00001-of-00004.json.gz for shard (1, 4)
+    """
+    directory, base = os.path.split(path.rstrip("/"))
+    name, dot, ext = base.partition(".")
+    name = "%s-%05d-of-%05d" % ((name,) + shard)
+    return os.path.join(directory, name + dot + ext)
+
+
+def source_lines(source):
+    """
+    the raw artist lines of a worker task: a batch of them already
+    read by the parent, or the path of a shard to read here
+    """
+    return read_raw_lines(source) if isinstance(source, str) else source
+
+
+def artist_sources(path, batch_size=64):
+    """
+    what each worker task reads. a sharded corpus is read one shard per
+    task. a single file is decompressed in the parent but handed out in
+    batches of `batch_size` raw lines, so the json parsing happens in
+    the pool
+    """
+    paths = input_paths(path)
+    if len(paths) > 1:
+        logging.info("reading %d shards" % len(paths))
+        return paths
+    return chunks(read_raw_lines(paths[0]), batch_size)
+
+
+def raw_artists_to_lines(source, dedup=None, shard=None):
+    """
+    parses raw artist json and turns each artist into its songs'
+    lines. runs in the workers, so only (artist_id, songs) pairs
+    come back to the parent. when deduplicating, each song is a
+    song_record with its hashes already computed. with a (i, N)
+    `shard`, only the artists in shard i are kept
+    """
+    parsed = []
+    for raw in source_lines(source):
+        if shard and raw_artist_shard(raw, shard[1]) != shard[0]:
+            continue
+        artist = orjson.loads(raw)
+        if artist.get("supplement"):
+            # the artist's other songs, and so its min_songs, are elsewhere
+            key = Supplement(artist["artist_id"], hash64(raw))
+            songs = artist_to_songs(artist, min_songs=1)
+        else:
+            key = artist["artist_id"]
+            songs = artist_to_songs(artist)
+        if dedup:
+            songs = [song_record(lines, dedup) for lines in songs]
+        parsed.append((key, songs))
+    return parsed
+
+
+def encode_in_batches(encode, lines, batch_size=10000):
+    """
+    encode(lines), a batch at a time, as one (ids, offsets) pair
+    """
+    ids = [np.zeros(0, dtype=np.int64)]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total = 0
+    for batch in chunks(lines, batch_size):
+        batch_ids, batch_offsets = encode(batch)
+        ids.append(batch_ids)
+        offsets.append(np.asarray(batch_offsets[1:], dtype=np.int64) + total)
+        total += int(batch_offsets[-1])
+    return np.concatenate(ids), np.concatenate(offsets)
+
+
+def encode_artists(source, encode, dedup=None, shard=None):
+    """
+    raw_artists_to_lines and the encoding of every line in one worker
+    task, so the lines never go back and forth between processes.
+    returns (artists, ids, offsets, summary), with artists a list of
+    (artist_id, songs). a song is its number of lines or, when
+    deduplicating, its song_record with the number of lines in
+    place of the lines themselves. without dedup the batch_summary
+    is made here too; with it, only the parent knows which lines
+    are kept, so it's None
+    """
+    artists = []
+    lines = []
+    for artist_id, songs in raw_artists_to_lines(source, dedup, shard):
+        if dedup:
+            lines.extend(line for _, song, _, _ in songs for line in song)
+            songs = [(keys, len(song), h, sig) for keys, song, h, sig in songs]
+        else:
+            lines.extend(line for song in songs for line in song)
+            songs = [len(song) for song in songs]
+        artists.append((artist_id, songs))
+
+    ids, offsets = encode_in_batches(encode, lines)
+    summary = None if dedup else batch_summary(ids, offsets)
+    return artists, ids, offsets, summary
+
+
+def artist_word_counts(source):
+    """
+    the word counts of each artist's lines, as (artist_id, counts) pairs,
+    counted in the worker that parsed them
+    """
+    return [
+        (artist_id, count_words(line for song in songs for line in song))
+        for artist_id, songs in raw_artists_to_lines(source)
+    ]
+
+
+def unique_artist_lines(parsed_batches, deduplicator=None, stats=None):
+    """
+    the lines of every artist, skipping any artist_id already seen
+    and, with a deduplicator, any song or line already seen. the
+    artists and songs read are counted in `stats`, if given
+    """
+    seen = set()
+    for parsed in parsed_batches:
+        for artist_id, songs in parsed:
+            if artist_id not in seen:
+                seen.add(artist_id)
+                if stats:
+                    stats.artists += not isinstance(artist_id, Supplement)
+                    stats.songs += len(songs)
+                for song in songs:
+                    yield from deduplicator.filter(song) if deduplicator else song
+
+
+def unique_artist_sequences(encoded_batches, deduplicator=None, stats=None):
+    """
+    unique_artist_lines for batches from encode_artists: each batch's
+    (ids, offsets, summary) less the artists already seen and the
+    songs and lines the deduplicator drops. which ones those are is
+    decided here, in file order, so it's the same from run to run.
+    a batch that loses lines is summarized again here
+    """
+    seen = set()
+    for artists, ids, offsets, summary in encoded_batches:
+        keep = np.zeros(len(offsets) - 1, dtype=bool)
+        start = 0
+        for artist_id, songs in artists:
+            new = artist_id not in seen
+            seen.add(artist_id)
+            if new and stats:
+                stats.artists += not isinstance(artist_id, Supplement)
+                stats.songs += len(songs)
+
+            for song in songs:
+                n = song[1] if deduplicator else song
+                if new and deduplicator:
+                    keep[start : start + n] = deduplicator.keep(
+                        song[0], song[2], song[3]
+                    )
+                elif new:
+                    keep[start : start + n] = True
+                start += n
+
+        if not keep.all():
+            lengths = np.diff(offsets)
+            ids = ids[np.repeat(keep, lengths)]
+            offsets = np.concatenate([[0], np.cumsum(lengths[keep])])
+            summary = None
+        if len(offsets) > 1:
+            if summary is None:
+                summary = batch_summary(ids, offsets)
+            yield ids, offsets, summary
+
+
+def artist_file_to_lines(
+    path, pool, batch_size=64, deduplicator=None, stats=None, shard=None, in_flight=8
+):
     """
     turns a collection of artist data into a list of song
     lines.
+
+    the workers parse the artists (see artist_sources), with at most
+    `in_flight` tasks handed to them ahead of the lines being used.
+    batches come back in file order, so which duplicate of an artist,
+    song or line wins is the same from run to run
+    """
+    dedup = deduplicator.mode if deduplicator else None
+    parsed = imap_bounded(
+        pool,
+        functools.partial(raw_artists_to_lines, dedup=dedup, shard=shard),
+        artist_sources(path, batch_size),
+        in_flight,
+    )
+    return unique_artist_lines(tqdm(parsed), deduplicator, stats)
+
+
+def artist_file_to_sequences(
+    path,
+    pool,
+    encode,
+    batch_size=64,
+    deduplicator=None,
+    stats=None,
+    shard=None,
+    in_flight=8,
+):
     """
+    artist_file_to_lines, encoded: each worker task parses and encodes
+    a batch of artists, and the parent drops repeats from the encoded
+    lines, yielding (ids, offsets, summary) batches to write out
+    """
+    dedup = deduplicator.mode if deduplicator else None
+    encoded = imap_bounded(
+        pool,
+        functools.partial(encode_artists, encode=encode, dedup=dedup, shard=shard),
+        artist_sources(path, batch_size),
+        in_flight,
+    )
+    return unique_artist_sequences(encoded, deduplicator, stats)
 
-    return itertools.chain.from_iterable(
-        tqdm(
-            pool.imap_unordered(artist_to_lines, unique_artist_filter(read_file(path)))
-        )
+
+def build_artist_vocabulary(
+    path, pool, min_count=1, top_k=None, batch_size=64, in_flight=8
+):
+    """
+    a Vocabulary of every artist's lines, counted in the same worker
+    tasks that parse them. an artist_id seen twice is only counted once
+    """
+    counts = collections.Counter()
+    seen = set()
+    batches = imap_bounded(
+        pool, artist_word_counts, artist_sources(path, batch_size), in_flight
     )
+    for artists in tqdm(batches):
+        for artist_id, artist_counts in artists:
+            if artist_id not in seen:
+                seen.add(artist_id)
+                counts.update(artist_counts)
+    return Vocabulary.from_counts(counts, min_count, top_k)
 
 
 def read_songs(path):
@@ -110,37 +472,159 @@ def write_songs(song_data, path):
     pickle.dump(song_data, gzip.open(path, "wb"))
 
 
-def dataset_preparation(corpus, tokenizer=Tokenizer()):
+def dataset_preparation(corpus, tokenizer=Tokenizer(), sparse_labels=False):
     """
     corpus are the lines in a song
 
     builds dataset necessary for next word prediction tasks,
     including fitting the tokenizer and creating necessary
     statistics: max sequence length and total word count
+
+    this materializes every prefix of every line, so it's only meant
+    for small corpora (e.g. a single artist). see dataset_batches for
+    something that scales to the full corpus
     """
     tokenizer.fit_on_texts(corpus)
     total_words = len(tokenizer.word_index) + 1
 
-    input_sequences = []
-    for line in tqdm(corpus):
-        token_list = tokenizer.texts_to_sequences([line])[0]
-
-        for i in range(1, len(token_list)):
-            n_gram_sequence = token_list[: i + 1]
-            input_sequences.append(n_gram_sequence)
-
-    max_sequence_len = max([len(x) for x in input_sequences])
+    token_lists = [
+        np.asarray(t, dtype=np.int32)
+        for t in tokenizer.texts_to_sequences(tqdm(corpus))
+        if len(t) > 1
+    ]
+    max_sequence_len = max(len(t) for t in token_lists)
 
-    input_sequences = np.array(
-        pad_sequences(input_sequences, maxlen=max_sequence_len, padding="pre")
+    input_sequences = np.concatenate(
+        [prefix_windows(t, max_sequence_len) for t in token_lists]
     )
 
     predictors, label = input_sequences[:, :-1], input_sequences[:, -1]
-    label = ku.to_categorical(label, num_classes=total_words)
+    if not sparse_labels:
+        label = ku.to_categorical(label, num_classes=total_words)
 
     return predictors, label, max_sequence_len, total_words, tokenizer
 
 
+def prefix_windows(seq, maxlen):
+    """
+    every prefix seq[: i + 1] of a sequence (i >= 1), padded and
+    truncated at the front to `maxlen` like pad_sequences does, as
+    the rows of a read-only strided view over a single padded copy
+    """
+    seq = np.asarray(seq)
+    if len(seq) < 2:
+        return np.zeros((0, maxlen), dtype=seq.dtype)
+
+    padded = np.concatenate([np.zeros(maxlen - 1, dtype=seq.dtype), seq])
+    stride = padded.strides[0]
+    return as_strided(
+        padded[1:],
+        shape=(len(seq) - 1, maxlen),
+        strides=(stride, stride),
+        writeable=False,
+    )
+
+
+def count_samples(seqs):
+    """
+    the number of (prefix, next word) samples in a set of sequences
+    """
+    return int(sum(max(len(seq) - 1, 0) for seq in seqs))
+
+
+def sample_batches(
+    seqs,
+    max_context,
+    batch_size=128,
+    shuffle=True,
+    seed=None,
+    shuffle_buffer=2 ** 17,
+    repeat=False,
+):
+    """
+    yields (predictors, labels) batches of next word samples, computed
+    on the fly from the base sequences rather than materialized up front.
+
+    predictors are the `max_context` tokens before each label, zero
+    padded at the front; labels are integer word ids, ready for a
+    sparse categorical loss. when shuffling, sequences are visited in a
+    random order and their samples mixed in a buffer of `shuffle_buffer`
+    rows, so memory use doesn't grow with the corpus
+    """
+    rng = np.random.RandomState(seed)
+    maxlen = max_context + 1
+
+    while True:
+        order = rng.permutation(len(seqs)) if shuffle else range(len(seqs))
+
+        pending = []
+        pending_rows = 0
+        for i in order:
+            windows = prefix_windows(seqs[i], maxlen)
+            if len(windows):
+                pending.append(windows)
+                pending_rows += len(windows)
+
+            if pending_rows >= shuffle_buffer:
+                windows = np.concatenate(pending)
+                if shuffle:
+                    rng.shuffle(windows)
+
+                full = len(windows) - len(windows) % batch_size
+                for start in range(0, full, batch_size):
+                    batch = windows[start : start + batch_size]
+                    yield batch[:, :-1], batch[:, -1]
+
+                pending = [windows[full:]]
+                pending_rows = len(pending[0])
+
+        if pending_rows:
+            windows = np.concatenate(pending)
+            if shuffle:
+                rng.shuffle(windows)
+            for start in range(0, len(windows), batch_size):
+                batch = windows[start : start + batch_size]
+                yield batch[:, :-1], batch[:, -1]
+
+        if not repeat:
+            return
+
+
+def dataset_batches(
+    corpus, tokenizer=None, batch_size=128, max_context=None, shuffle=True, seed=None
+):
+    """
+    the streaming counterpart of dataset_preparation: fits the
+    tokenizer and encodes each line once, then returns a repeating
+    generator of shuffled (predictors, integer labels) batches, how
+    many batches make an epoch, the context length and total word count
+
+    without a tokenizer, the corpus is counted into a Vocabulary,
+    which gives the same ids as a fitted Tokenizer
+    """
+    if tokenizer is None:
+        tokenizer = Vocabulary.from_counts(count_words(corpus))
+        total_words = tokenizer.total_words
+    else:
+        tokenizer.fit_on_texts(corpus)
+        total_words = len(tokenizer.word_index) + 1
+
+    seqs = [
+        np.asarray(t, dtype=np.int32)
+        for t in tokenizer.texts_to_sequences(tqdm(corpus))
+        if len(t) > 1
+    ]
+    longest = max(len(t) for t in seqs)
+    max_context = min(max_context, longest - 1) if max_context else longest - 1
+
+    steps = -(-count_samples(seqs) // batch_size)
+    batches = sample_batches(
+        seqs, max_context, batch_size, shuffle=shuffle, seed=seed, repeat=True
+    )
+
+    return batches, steps, max_context, total_words, tokenizer
+
+
 def basic_splitter(line):
     return re.split(r"\s+", line)
 
@@ -160,6 +644,29 @@ class hash_to_sequence_er:
         tokens = self.splitter(line)
         return self.tokenizer.transform(tokens).nonzero()[1].tolist()  # columns
 
+    def batch(self, lines):
+        """
+        hashes a batch of lines with a single transform call, returning
+        a flat array of token ids and an array of offsets: line i is
+        ids[offsets[i]:offsets[i + 1]], exactly what __call__ gives for it
+
+        every token is its own row of the hashed matrix and rows are
+        hashed independently, so the nonzero columns of a line's rows
+        don't depend on what else is in the batch
+        """
+        tokens = []
+        token_offsets = [0]
+        for line in lines:
+            tokens.extend(self.splitter(line))
+            token_offsets.append(len(tokens))
+
+        if not tokens:
+            return np.zeros(0, dtype=np.int64), np.zeros(len(token_offsets), np.int64)
+
+        rows, ids = self.tokenizer.transform(tokens).nonzero()
+        offsets = np.searchsorted(rows, token_offsets)
+        return ids, offsets
+
 
 def hash_to_sequence(
     line,
@@ -172,6 +679,13 @@ def hash_to_sequence(
     return tokenizer.transform(tokens).nonzero()[1].tolist()  # columns
 
 
+def split_batch(ids, offsets):
+    """
+    a batch of (ids, offsets) back into one list of ids per line
+    """
+    return [ids[offsets[i] : offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
+
+
 def document_statistics(token_sequence):
     def accum_stats(stats, tokens):
 
@@ -191,37 +705,284 @@ def line_to_features(
     tokenizer=HashingVectorizer(
         n_features=2 ** 16, decode_error="ignore", strip_accents="unicode"
     ),
+    sparse_labels=False,
 ):
     token_list = hash_to_sequence(line, splitter, tokenizer)
 
-    if token_list:
-        input_sequences = [token_list[: i + 1] for i in range(1, len(token_list))]
-        for seq in np.array(
-            pad_sequences(input_sequences, maxlen=max_sequence_length, padding="pre")
-        ):
+    for seq in prefix_windows(np.asarray(token_list, np.int32), max_sequence_len):
+        if sparse_labels:
+            yield (seq[:-1], seq[-1])
+        else:
             yield (seq[:-1], ku.to_categorical(seq[-1], num_classes=total_words))
 
 
-def get_padded_seqs(seqs, max_seq_len, total_words):
+def get_padded_seqs(seqs, max_seq_len, total_words, sparse_labels=False):
 
     print("max seq len: %s, total words: %s" % (max_seq_len, total_words))
     for seq in seqs:
-        if seq:
-            input_sequences = [seq[: i + 1] for i in range(1, len(seq))]
-            for padded in np.array(
-                pad_sequences(input_sequences, maxlen=max_seq_len, padding="pre")
-            ):
+        for padded in prefix_windows(np.asarray(seq, np.int32), max_seq_len):
+            if sparse_labels:
+                yield (padded[:-1], padded[-1])
+            else:
                 yield (
                     padded[:-1],
                     ku.to_categorical(padded[-1], num_classes=total_words),
                 )
 
 
+def get_padded_batches(seqs, max_seq_len, batch_size=512, repeat=False):
+    """
+    the samples of get_padded_seqs, in order, as whole batches:
+    (predictors, labels) with predictors an int32 array of
+    batch_size x (max_seq_len - 1) and labels the integer word ids.
+
+    each sequence's padded prefixes are a strided view copied into
+    the batch in one slice, so there's no per-sample allocation and
+    no one-hot vectors; use a sparse categorical loss
+    """
+    while True:
+        predictors = np.empty((batch_size, max_seq_len - 1), dtype=np.int32)
+        labels = np.empty(batch_size, dtype=np.int32)
+        filled = 0
+
+        for seq in seqs:
+            windows = prefix_windows(np.asarray(seq, np.int32), max_seq_len)
+            while len(windows):
+                n = min(batch_size - filled, len(windows))
+                predictors[filled : filled + n] = windows[:n, :-1]
+                labels[filled : filled + n] = windows[:n, -1]
+                filled += n
+                windows = windows[n:]
+
+                if filled == batch_size:
+                    yield predictors, labels
+                    predictors = np.empty((batch_size, max_seq_len - 1), np.int32)
+                    labels = np.empty(batch_size, dtype=np.int32)
+                    filled = 0
+
+        if filled:
+            yield predictors[:filled], labels[:filled]
+
+        if not repeat:
+            return
+
+
+def padded_batches_dataset(seqs, max_seq_len, batch_size=512):
+    """
+    get_padded_batches wrapped up as a tf.data.Dataset, for feeding
+    Keras fit with prefetching
+    """
+    import tensorflow as tf
+
+    # output_types/output_shapes rather than output_signature, which
+    # needs a newer tensorflow than the pinned numpy allows
+    return tf.data.Dataset.from_generator(
+        lambda: get_padded_batches(seqs, max_seq_len, batch_size),
+        output_types=(tf.int32, tf.int32),
+        output_shapes=(tf.TensorShape([None, max_seq_len - 1]), tf.TensorShape([None])),
+    ).prefetch(tf.data.experimental.AUTOTUNE)
+
+
 def get_padded_seqs_from_file(filename):
+    if is_ragged(filename):
+        seqs = RaggedSequences(filename)
+        return get_padded_seqs(seqs, seqs.max_seq_len, seqs.total_words)
+
     with gzip.open(filename) as f:
         return get_padded_seqs(**orjson.loads(f.read()))
 
 
+def get_padded_batches_from_file(filename, batch_size=512):
+    """
+    batches from a file written by main, along with its total word count
+    """
+    if is_ragged(filename):
+        seqs = RaggedSequences(filename)
+        max_seq_len, total_words = seqs.max_seq_len, seqs.total_words
+    else:
+        with gzip.open(filename) as f:
+            data = orjson.loads(f.read())
+        seqs, max_seq_len, total_words = (
+            data["seqs"],
+            data["max_seq_len"],
+            data["total_words"],
+        )
+
+    return get_padded_batches(seqs, max_seq_len, batch_size), total_words
+
+
+def sequence_meta(stats, total_words=None, max_len_percentile=None):
+    """
+    the max_seq_len and total_words a training run needs. max_seq_len is
+    the longest line, or the length at `max_len_percentile` so a few very
+    long lines don't set it; total_words is the largest token id unless
+    it's known (e.g. a vocabulary's)
+    """
+    if max_len_percentile:
+        max_seq_len = stats.percentile(float(max_len_percentile))
+    else:
+        max_seq_len = stats.max_len
+    total_words = total_words if total_words else stats.max_token
+
+    logging.info("got %d total words, max seq len is %d" % (total_words, max_seq_len))
+    return {"max_seq_len": max_seq_len, "total_words": total_words}
+
+
+def write_ragged(
+    batches,
+    path,
+    dtype,
+    stats,
+    total_words=None,
+    max_len_percentile=None,
+    deduplicator=None,
+):
+    """
+    stream encoded batches, with their summaries, straight into a
+    ragged file, merging the summaries into `stats` as we go
+    """
+    with RaggedWriter(path, dtype) as writer:
+        for ids, offsets, summary in tqdm(batches):
+            writer.append_batch(ids, offsets)
+            stats.add(summary)
+
+        writer.close(**sequence_meta(stats, total_words, max_len_percentile))
+
+    if deduplicator:
+        write_counts(path, deduplicator.counts())
+
+
+def write_json(
+    batches, path, stats, total_words=None, max_len_percentile=None, deduplicator=None
+):
+    """
+    stream encoded batches into a single gzipped json document of the
+    form get_padded_seqs_from_file reads, one sequence at a time
+    """
+    with gzip.open(path, "wb") as f:
+        f.write(b'{"seqs":[')
+        first = True
+        for ids, offsets, summary in tqdm(batches):
+            for seq in split_batch(ids, offsets):
+                f.write(orjson.dumps(seq) if first else b"," + orjson.dumps(seq))
+                first = False
+            stats.add(summary)
+
+        meta = sequence_meta(stats, total_words, max_len_percentile)
+        if deduplicator:
+            meta["counts"] = deduplicator.counts().tolist()
+        f.write(b"]," + orjson.dumps(meta)[1:])
+
+    logging.info("wrote %d lines to %s" % (stats.lines, path))
+
+
+def stats_path(path, format="json"):
+    if format == "ragged":
+        return os.path.join(path, "stats.json.gz")
+    return path + ".stats.json.gz"
+
+
+def merge_ragged(paths, output, max_len_percentile=None, chunk_size=2 ** 20):
+    """
+    concatenate the ragged outputs of a sharded run, with their
+    counts, and recompute the metadata from their merged stats
+    """
+    parts = [RaggedSequences(path) for path in paths]
+    stats = SequenceStats()
+    for path in paths:
+        stats.merge(SequenceStats.load(stats_path(path, "ragged")))
+
+    with RaggedWriter(output, parts[0].dtype) as writer:
+        for part in parts:
+            for start in range(0, len(part), chunk_size):
+                offsets = part.offsets[start : start + chunk_size + 1]
+                writer.append_batch(part.tokens, offsets)
+
+        total_words = max(part.total_words for part in parts)
+        writer.close(**sequence_meta(stats, total_words, max_len_percentile))
+
+    counts = [part.counts() for part in parts]
+    if all(c is not None for c in counts):
+        write_counts(output, np.concatenate(counts))
+
+    stats.save(stats_path(output, "ragged"))
+    return stats
+
+
+def copy_json_seqs(path, out, separator=b"", chunk_size=2 ** 20):
+    """
+    copy the "seqs" of a file write_json wrote into `out` as they are,
+    without parsing them, writing `separator` first if there are any.
+    the sequences are flat lists of ints, so the array ends at the first
+    "]]" (or right away, if it's empty). returns whether anything was
+    copied and the rest of the document, the metadata and counts
+    """
+    prefix = b'{"seqs":['
+    copied = False
+    with gzip.open(path, "rb") as f:
+        if f.read(len(prefix)) != prefix:
+            raise ValueError("%s wasn't written by write_json" % path)
+
+        buffer = b""
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+            if not copied and buffer.startswith(b"]"):
+                end = 0
+            else:
+                end = buffer.find(b"]]")
+                end = end + 1 if end >= 0 else -1
+
+            # everything but the last byte, which could be half of a "]]"
+            data = buffer[:end] if end >= 0 else buffer[:-1]
+            if data:
+                out.write(data if copied else separator + data)
+                copied = True
+
+            if end >= 0:
+                rest = buffer[end + 1 :] + f.read()
+                # rest is the ',"max_seq_len":...}' after the array
+                return copied, orjson.loads(b"{" + rest[1:])
+            if not chunk:
+                raise ValueError("%s ends before its sequences do" % path)
+            buffer = buffer[-1:]
+
+
+def merge_json(paths, output, max_len_percentile=None):
+    """
+    the json counterpart of merge_ragged. the sequences are streamed
+    from each part into the output, so only the metadata and counts
+    are held in memory
+    """
+    counts = []
+    total_words = 0
+    stats = SequenceStats()
+    with gzip.open(output, "wb") as f:
+        f.write(b'{"seqs":[')
+        any_seqs = False
+        for path in paths:
+            copied, part = copy_json_seqs(path, f, b"," if any_seqs else b"")
+            any_seqs = any_seqs or copied
+            counts.append(part.get("counts"))
+            total_words = max(total_words, part["total_words"])
+            stats.merge(SequenceStats.load(stats_path(path)))
+
+        meta = sequence_meta(stats, total_words, max_len_percentile)
+        if all(c is not None for c in counts):
+            meta["counts"] = list(itertools.chain.from_iterable(counts))
+        f.write(b"]," + orjson.dumps(meta)[1:])
+
+    stats.save(stats_path(output))
+    return stats
+
+
+def _worker_init(q, cache_path):
+    global language_cache
+
+    worker_init(q)
+    language_cache = LanguageCache(cache_path) if cache_path else None
+
+
 def get_optparser():
     parser = OptionParser(
         usage="gather line-delimited gzipped json data and gather lyric lines"
@@ -245,6 +1006,15 @@ def get_optparser():
         help="location to store pickled lyric lines",
     )
 
+    parser.add_option(
+        "-f",
+        "--format",
+        action="store",
+        dest="format",
+        default="json",
+        help="json: one gzipped json document, ragged: a memory-mappable directory",
+    )
+
     parser.add_option(
         "-L",
         "--log_level",
@@ -263,6 +1033,102 @@ def get_optparser():
         help="size of pool of workers for parallel execution",
     )
 
+    parser.add_option(
+        "-b",
+        "--batch_size",
+        action="store",
+        dest="batch_size",
+        default=64,
+        help="number of artists parsed and encoded per worker task",
+    )
+
+    parser.add_option(
+        "--language_cache",
+        action="store",
+        dest="language_cache",
+        default=None,
+        help="(optional) sqlite file caching language predictions between runs",
+    )
+
+    parser.add_option(
+        "-d",
+        "--dedup",
+        action="store",
+        dest="dedup",
+        default=None,
+        help="(optional) drop repeated lines and songs: lines, exact or minhash",
+    )
+
+    parser.add_option(
+        "--dedup_dir",
+        action="store",
+        dest="dedup_dir",
+        default=None,
+        help="(optional) where to spill dedup hashes, a temporary directory if unset",
+    )
+
+    parser.add_option(
+        "--dedup_threshold",
+        action="store",
+        dest="dedup_threshold",
+        default=0.8,
+        help="estimated jaccard similarity at which minhash drops a song",
+    )
+
+    parser.add_option(
+        "-v",
+        "--vocab",
+        action="store",
+        dest="vocab",
+        default=None,
+        help="(optional) encode with an exact vocabulary saved here instead of "
+        "hashing, building it first if the file doesn't exist",
+    )
+
+    parser.add_option(
+        "--min_count",
+        action="store",
+        dest="min_count",
+        default=1,
+        help="drop words seen fewer times than this when building --vocab",
+    )
+
+    parser.add_option(
+        "--top_k",
+        action="store",
+        dest="top_k",
+        default=None,
+        help="(optional) keep only this many of the most frequent words in --vocab",
+    )
+
+    parser.add_option(
+        "--max_len_percentile",
+        action="store",
+        dest="max_len_percentile",
+        default=None,
+        help="(optional) set max_seq_len to this percentile of line lengths "
+        "rather than the longest line",
+    )
+
+    parser.add_option(
+        "-s",
+        "--shard",
+        action="store",
+        dest="shard",
+        default=None,
+        help="(optional) i/N: only process the artists in shard i of N, writing "
+        "to a per-shard --output. needs an existing --vocab if using one, and "
+        "can't be combined with --dedup, which would only see one shard",
+    )
+
+    parser.add_option(
+        "-m",
+        "--merge",
+        action="store_true",
+        dest="merge",
+        help="merge the per-shard outputs given as arguments into --output",
+    )
+
     return parser
 
 
@@ -272,7 +1138,29 @@ def main():
 
     q_listener, q = logger_init(options.log_level.upper())
 
-    pool = mp.Pool(int(options.pool), worker_init, [q])
+    if options.merge:
+        logging.info("merging %d shards into %s" % (len(args), options.output))
+        merge = merge_ragged if options.format == "ragged" else merge_json
+        merge(args, options.output, options.max_len_percentile).log_summary()
+        return
+
+    shard = None
+    output = options.output
+    if options.shard:
+        try:
+            shard = parse_shard(options.shard)
+        except ValueError as e:
+            opt_parser.error("bad --shard %s: %s" % (options.shard, e))
+        if options.vocab and not os.path.exists(options.vocab):
+            opt_parser.error("--shard needs a --vocab built beforehand")
+        if options.dedup:
+            # songs and lines repeated across shards would all be kept, so
+            # the merged output wouldn't match a single run's
+            opt_parser.error("--dedup can't be combined with --shard")
+        output = shard_path(options.output, shard)
+        logging.info("processing shard %d of %d into %s" % (shard + (output,)))
+
+    pool = mp.Pool(int(options.pool), _worker_init, [q, options.language_cache])
 
     logging.info("reading songs from %s" % options.input)
 
@@ -281,24 +1169,80 @@ def main():
     tokenizer = HashingVectorizer(
         n_features=2 ** 16, decode_error="ignore", strip_accents="unicode"
     )
-    seqs = list(
-        pool.imap_unordered(
-            hash_to_sequence_er(splitter, tokenizer), artist_file_to_lines(path, pool)
+    hasher = hash_to_sequence_er(splitter, tokenizer)
+    batch_size = int(options.batch_size)
+    # tasks handed to the pool ahead of their results being used
+    in_flight = 2 * int(options.pool)
+
+    encode = hasher.batch
+    dtype = token_dtype(tokenizer.n_features)
+    vocab_size = None
+    if options.vocab:
+        if not os.path.exists(options.vocab):
+            logging.info("building vocabulary from %s" % path)
+            vocab = build_artist_vocabulary(
+                path,
+                pool,
+                int(options.min_count),
+                int(options.top_k) if options.top_k else None,
+                batch_size,
+                in_flight,
+            )
+            vocab.save(options.vocab)
+        else:
+            vocab = Vocabulary.load(options.vocab)
+
+        encode = functools.partial(encode_file_batch, options.vocab)
+        vocab_size = vocab.total_words
+        dtype = token_dtype(vocab_size)
+
+    deduplicator = None
+    if options.dedup:
+        deduplicator = Deduplicator(
+            options.dedup,
+            options.dedup_dir,
+            threshold=float(options.dedup_threshold),
         )
-    )
 
-    logging.info("done, got %d, computing aggregate stats" % len(seqs))
-
-    max_seq_len, total_words = document_statistics(seqs)
+    stats = SequenceStats()
+    batches = artist_file_to_sequences(
+        path,
+        pool,
+        encode,
+        batch_size,
+        deduplicator=deduplicator,
+        stats=stats,
+        shard=shard,
+        in_flight=in_flight,
+    )
 
-    logging.info("got %d total words, longest seq is %d" % (total_words, max_seq_len))
+    if options.format == "ragged":
+        write_ragged(
+            batches,
+            output,
+            dtype,
+            stats,
+            vocab_size,
+            options.max_len_percentile,
+            deduplicator,
+        )
+    else:
+        write_json(
+            batches,
+            output,
+            stats,
+            vocab_size,
+            options.max_len_percentile,
+            deduplicator,
+        )
+    stats.save(stats_path(output, options.format))
 
-    output = {"seqs": seqs, "max_seq_len": max_seq_len, "total_words": total_words}
+    stats.log_summary()
+    if deduplicator:
+        deduplicator.log_summary()
+        deduplicator.close()
 
-    with gzip.open(options.output, "wb") as f:
-        logging.info("writing %d lines to %s" % (len(output), options.output))
-        f.write(orjson.dumps(output))
-        logging.info("done")
+    logging.info("done")
 
 
 if __name__ == "__main__":
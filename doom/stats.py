@@ -0,0 +1,137 @@
+import gzip
+import orjson
+import logging
+
+import numpy as np
+
+"""
+corpus statistics gathered while sequences are encoded: every batch is
+summarized (which tokens it used and how often, a histogram of its line
+lengths) by the worker that encoded it, or by the parent when dedup
+decides which of its lines are kept, and the summaries are merged in
+the parent, so nothing needs a second pass over the sequences
+"""
+
+
+def batch_summary(ids, offsets):
+    """
+    the part of SequenceStats that comes from one encoded batch
+    """
+    tokens, token_counts = np.unique(ids, return_counts=True)
+    return tokens, token_counts, np.bincount(np.diff(offsets))
+
+
+def _add(counts, index, values):
+    """
+    counts[index] += values, growing counts to fit
+    """
+    if len(index) and index[-1] >= len(counts):
+        grow = np.zeros(index[-1] + 1 - len(counts), dtype=np.int64)
+        counts = np.concatenate([counts, grow])
+    counts[index] += values
+    return counts
+
+
+class SequenceStats:
+    def __init__(self):
+        self.artists = 0
+        self.songs = 0
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        self.token_counts = np.zeros(0, dtype=np.int64)
+
+    @property
+    def lines(self):
+        return int(self.length_counts.sum())
+
+    @property
+    def tokens(self):
+        return int(self.token_counts.sum())
+
+    @property
+    def max_len(self):
+        nonzero = np.flatnonzero(self.length_counts)
+        return int(nonzero[-1]) if len(nonzero) else 0
+
+    @property
+    def max_token(self):
+        nonzero = np.flatnonzero(self.token_counts)
+        return int(nonzero[-1]) if len(nonzero) else 0
+
+    def add(self, summary):
+        tokens, token_counts, length_counts = summary
+        self.token_counts = _add(self.token_counts, tokens, token_counts)
+        self.length_counts = _add(
+            self.length_counts, np.arange(len(length_counts)), length_counts
+        )
+
+    def merge(self, other):
+        self.artists += other.artists
+        self.songs += other.songs
+        self.token_counts = _add(
+            self.token_counts, np.arange(len(other.token_counts)), other.token_counts
+        )
+        self.length_counts = _add(
+            self.length_counts, np.arange(len(other.length_counts)), other.length_counts
+        )
+        return self
+
+    def percentile(self, q):
+        """
+        the line length that `q` percent of lines are no longer than
+        """
+        if not self.lines:
+            return 0
+        cumulative = np.cumsum(self.length_counts)
+        return int(np.searchsorted(cumulative, q / 100.0 * cumulative[-1]))
+
+    def to_dict(self):
+        return {
+            "artists": self.artists,
+            "songs": self.songs,
+            "lines": self.lines,
+            "tokens": self.tokens,
+            "max_len": self.max_len,
+            "max_token": self.max_token,
+            "percentiles": {q: self.percentile(q) for q in (50, 90, 95, 99, 99.9)},
+            "length_counts": self.length_counts.tolist(),
+            "token_counts": self.token_counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        stats.artists = d["artists"]
+        stats.songs = d["songs"]
+        stats.length_counts = np.asarray(d["length_counts"], dtype=np.int64)
+        stats.token_counts = np.asarray(d["token_counts"], dtype=np.int64)
+        return stats
+
+    def save(self, path):
+        with gzip.open(path, "wb") as f:
+            f.write(orjson.dumps(self.to_dict(), option=orjson.OPT_NON_STR_KEYS))
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rb") as f:
+            return cls.from_dict(orjson.loads(f.read()))
+
+    def log_summary(self):
+        logging.info(
+            "%d artists, %d songs, %d lines, %d tokens, %d distinct"
+            % (
+                self.artists,
+                self.songs,
+                self.lines,
+                self.tokens,
+                np.count_nonzero(self.token_counts),
+            )
+        )
+        logging.info(
+            "line lengths: p50 %d, p95 %d, p99 %d, max %d"
+            % (
+                self.percentile(50),
+                self.percentile(95),
+                self.percentile(99),
+                self.max_len,
+            )
+        )
@@ -1,14 +1,16 @@
 import sys
 import logging
+import collections
+import itertools
 import multiprocessing as mp
 from logging.handlers import QueueHandler, QueueListener
 
 
-def logger_init(level="DEBUG"):
+def logger_init(level="DEBUG", stream=sys.stdout):
     # https://stackoverflow.com/questions/641420/how-should-i-log-while-using-multiprocessing-in-python
     q = mp.Queue()
     # this is the handler for all log records
-    handler = logging.StreamHandler(stream=sys.stdout)
+    handler = logging.StreamHandler(stream=stream)
     handler.setFormatter(
         logging.Formatter("%(levelname)s: %(asctime)s - %(process)s - %(message)s")
     )
@@ -31,3 +33,30 @@ def worker_init(q):
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
     logger.addHandler(qh)
+
+
+def chunks(iterable, size):
+    """
+    lists of up to `size` consecutive items
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_bounded(pool, func, iterable, in_flight):
+    """
+    pool.imap, in order, but with at most `in_flight` tasks handed to the
+    pool ahead of the results being used, so neither the inputs read nor
+    the results waiting pile up in the parent
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
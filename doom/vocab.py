@@ -0,0 +1,154 @@
+import gzip
+import orjson
+import logging
+import functools
+import collections
+
+import numpy as np
+
+"""
+an exact word vocabulary built in one streaming pass over the corpus.
+
+workers count words as they parse artists (see song_reader's
+build_artist_vocabulary), the parent merges the counts and prunes
+them by minimum count and/or to the most frequent words,
+and the result is saved as a small gzipped json file. words are split
+the way keras' Tokenizer splits them (lowercased, its default filters
+replaced by spaces), so ids match a Tokenizer fit on the same corpus
+"""
+
+default_filters = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+def translation(filters=default_filters):
+    return str.maketrans({c: " " for c in filters})
+
+
+_default_translation = translation()
+
+
+def split_words(line, table=_default_translation, lower=True):
+    if lower:
+        line = line.lower()
+    return [w for w in line.translate(table).split(" ") if w]
+
+
+def count_words(lines, filters=default_filters, lower=True):
+    """
+    word counts for a batch of lines, run in the workers
+    """
+    table = translation(filters)
+    counts = collections.Counter()
+    for line in lines:
+        counts.update(split_words(line, table, lower))
+    return counts
+
+
+class Vocabulary:
+    """
+    words by id, most frequent first. id 0 is padding and, with an
+    `oov_token`, id 1 stands in for every word outside the vocabulary
+    (otherwise those are dropped, as the Tokenizer does)
+    """
+
+    def __init__(
+        self, words, counts, filters=default_filters, lower=True, oov_token=None
+    ):
+        self.words = list(words)
+        self.counts = list(counts)
+        self.filters = filters
+        self.lower = lower
+        self.oov_token = oov_token
+
+        self.table = translation(filters)
+        first = 2 if oov_token else 1
+        self.index = {w: i + first for i, w in enumerate(self.words)}
+        self.oov_id = 1 if oov_token else None
+
+    @classmethod
+    def from_counts(cls, counts, min_count=1, top_k=None, **kwargs):
+        """
+        the words of a Counter seen at least `min_count` times, cut down
+        to the `top_k` most frequent. ties keep first-seen order
+        """
+        kept = [(w, c) for w, c in counts.items() if c >= min_count]
+        kept.sort(key=lambda wc: wc[1], reverse=True)
+        if top_k:
+            kept = kept[:top_k]
+
+        logging.info(
+            "kept %d of %d distinct words (min count %d, top k %s)"
+            % (len(kept), len(counts), min_count, top_k)
+        )
+        return cls([w for w, _ in kept], [c for _, c in kept], **kwargs)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rb") as f:
+            return cls(**orjson.loads(f.read()))
+
+    def save(self, path):
+        with gzip.open(path, "wb") as f:
+            f.write(
+                orjson.dumps(
+                    {
+                        "words": self.words,
+                        "counts": self.counts,
+                        "filters": self.filters,
+                        "lower": self.lower,
+                        "oov_token": self.oov_token,
+                    }
+                )
+            )
+        logging.info("wrote %d words to %s" % (len(self.words), path))
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def total_words(self):
+        """
+        the number of ids, padding and oov included
+        """
+        return len(self.index) + (2 if self.oov_token else 1)
+
+    @property
+    def word_index(self):
+        index = dict(self.index)
+        if self.oov_token:
+            index[self.oov_token] = self.oov_id
+        return index
+
+    def __call__(self, line):
+        get = self.index.get
+        ids = (get(w, self.oov_id) for w in split_words(line, self.table, self.lower))
+        return [i for i in ids if i is not None]
+
+    def texts_to_sequences(self, texts):
+        return [self(text) for text in texts]
+
+    def encode_batch(self, lines):
+        """
+        encodes a batch of lines as a flat array of word ids and an array
+        of offsets, line i being ids[offsets[i]:offsets[i + 1]], the same
+        layout hash_to_sequence_er.batch produces
+        """
+        ids = []
+        offsets = [0]
+        for line in lines:
+            ids.extend(self(line))
+            offsets.append(len(ids))
+        return np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64)
+
+
+@functools.lru_cache(maxsize=4)
+def cached_vocabulary(path):
+    return Vocabulary.load(path)
+
+
+def encode_file_batch(path, lines):
+    """
+    encode_batch with the vocabulary saved at `path`, which each
+    worker loads once rather than having it pickled with every batch
+    """
+    return cached_vocabulary(path).encode_batch(lines)
@@ -8,6 +8,7 @@ required_libraries = [
     "matplotlib",
     "pandas",
     "requests",
+    "aiohttp",
     "lxml",
     "seaborn",
     "scikit-learn",
@@ -40,4 +41,5 @@ setup(
     packages=["doom"],
     zip_safe=False,
     install_requires=required_libraries,
+    extras_require={"test": ["pytest", "moto"]},
 )
@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# run from anywhere, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubServer:
+    """
+    a local http server answering each request with the next of a script
+    of (status, headers, body) responses, then 200s, recording when it
+    was hit and for what
+    """
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.hits = []
+        self.paths = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits.append(time.time())
+                stub.paths.append(self.path)
+                status, headers, body = (
+                    stub.script.pop(0) if stub.script else (200, {}, "ok")
+                )
+                body = body.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host = "127.0.0.1:%d" % self.server.server_address[1]
+        self.url = "http://%s/page" % self.host
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(*script):
+        server = StubServer(script)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    """
+    placeholder credentials for the clients built when the crawler and
+    combiner are imported; nothing here talks to genius or s3
+    """
+    for name, value in [
+        ("GENIUS_ACCESS_TOKEN", "test"),
+        ("AWS_ACCESS_KEY_ID", "test"),
+        ("AWS_SECRET_ACCESS_KEY", "test"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+    ]:
+        if name not in os.environ:
+            monkeypatch.setenv(name, value)
+
+
+@pytest.fixture
+def crawler(credentials, monkeypatch):
+    """
+    doom.crawler, skipping the test if the crawl dependencies aren't installed
+    """
+    crawler = pytest.importorskip("doom.crawler")
+    monkeypatch.setattr(crawler, "cache", None)
+    monkeypatch.setattr(crawler, "limiter", None)
+    return crawler
@@ -0,0 +1,121 @@
+import asyncio
+import orjson
+import pytest
+
+from doom.cache import ResponseCache
+
+page = (
+    b"<html>\n<head><title>MF DOOM</title></head>\n"
+    + b"x" * 5000
+    + b'\n<meta content="{&quot;api_path&quot;:&quot;/songs/5&quot;}">\n'
+    + b'<div data="{&quot;api_path&quot;:&quot;/artists/12345&quot;,'
+    + b'&quot;name&quot;:&quot;MF DOOM&quot;}">\n'
+    + b'<a data="api_path /artists/999">\n'
+    + b"y" * 5000
+)
+
+
+def scan(crawler, data, size):
+    scanner = crawler.ArtistIdScanner()
+    for start in range(0, len(data), size):
+        artist_id = scanner.feed(data[start : start + size])
+        if artist_id:
+            return artist_id
+    return scanner.finish()
+
+
+def test_scanner_finds_the_first_id_whatever_the_chunks(crawler):
+    for size in list(range(1, 40)) + [1000, len(page)]:
+        assert scan(crawler, page, size) == "12345"
+
+
+def test_scanner_id_at_the_very_end(crawler):
+    data = b'<x>\n"api_path":"/artists/42'
+    for size in (1, 3, len(data)):
+        assert scan(crawler, data, size) == "42"
+
+
+def test_scanner_matches_within_a_line(crawler):
+    data = b'"api_path":"/songs/1"\n"/artists/7"\n'
+    for size in (1, 5, len(data)):
+        assert scan(crawler, data, size) is None
+
+
+def test_scanner_holds_on_to_little(crawler):
+    scanner = crawler.ArtistIdScanner()
+    for _ in range(1000):
+        assert scanner.feed(b"z" * 1024) is None
+        assert len(scanner.buffer) < len(b"api_path")
+    scanner.feed(b'"api_path":"/songs/1", ' + b"z" * 1024)
+    assert scanner.buffer.startswith(b"api_path")
+
+
+def search_response(url, artist_id):
+    hits = [
+        {"result": {"url": "https://genius.com/artists/Other", "id": 1}},
+        {"result": {"url": url, "id": artist_id}},
+    ]
+    return orjson.dumps({"response": {"sections": [{"hits": hits}]}}).decode()
+
+
+def test_artist_id_from_search(crawler):
+    url = "https://genius.com/artists/Mf-doom"
+    assert crawler.artist_id_from_search(search_response(url, 123), url) == "123"
+    assert crawler.artist_id_from_search(search_response(url, 123), "other") is None
+    assert crawler.artist_id_from_search(None, url) is None
+
+
+def test_stream_artist_id(crawler, stub):
+    server = stub((429, {"Retry-After": "0"}, ""), (200, {}, page.decode()))
+    assert crawler.stream_artist_id(server.url, chunk_size=64) == "12345"
+    assert len(server.hits) == 2
+
+    missing = stub((404, {}, ""))
+    assert crawler.stream_artist_id(missing.url) is None
+
+
+def test_stream_artist_id_async(crawler, stub):
+    server = stub((503, {}, ""), (200, {}, page.decode()))
+
+    async def fetch():
+        async with crawler.open_client(4) as client:
+            return await crawler.stream_artist_id_async(client, server.url, 64)
+
+    assert asyncio.run(fetch()) == "12345"
+    assert len(server.hits) == 2
+
+
+def test_get_artist_id(crawler, stub, monkeypatch, tmp_path):
+    server = stub(
+        (200, {}, search_response("https://genius.com/artists/Other", 1)),
+        (200, {}, page.decode()),
+    )
+    search = "http://%s/search?q=%%s" % server.host
+    monkeypatch.setattr(crawler, "artist_search_url", search)
+    monkeypatch.setattr(crawler, "cache", ResponseCache(str(tmp_path / "cache.db")))
+
+    # the search doesn't have it, so the page is scanned
+    a = crawler.Artist("MF DOOM", server.url).get_artist_id()
+    assert a.artist_id == "12345"
+    assert server.paths == ["/search?q=MF%20DOOM", "/page"]
+
+    # and now the cache does
+    again = crawler.cached_artist_ids([crawler.Artist("MF DOOM", server.url)])
+    assert again[0].artist_id == "12345"
+    assert crawler.Artist("MF DOOM", server.url).get_artist_id().artist_id == "12345"
+    assert len(server.hits) == 2
+
+
+def test_get_artist_id_from_search(crawler, stub, monkeypatch):
+    server = stub()
+    url = "https://genius.com/artists/Mf-doom"
+    server.script.append((200, {}, search_response(url, 123)))
+    monkeypatch.setattr(crawler, "artist_search_url", server.url + "?q=%s")
+
+    assert crawler.Artist("MF DOOM", url).get_artist_id().artist_id == "123"
+    assert len(server.hits) == 1
+
+    # nothing in the search, and nothing on the page either
+    server.script.append((200, {}, search_response(url, 123)))
+    with pytest.raises(ValueError):
+        crawler.Artist("Nobody", server.url).get_artist_id()
@@ -0,0 +1,112 @@
+import os
+import pickle
+import multiprocessing as mp
+
+from concurrent.futures import ThreadPoolExecutor
+
+from doom.cache import LanguageCache, ResponseCache, validators
+
+
+def test_store_and_lookup(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    assert cache.lookup("https://genius.com/a") is None
+
+    headers = {"ETag": '"abc"', "Last-Modified": "Sat, 17 Oct 2026 00:00:00 GMT"}
+    cache.store("https://genius.com/a", "<html>ü</html>", headers)
+    cached = cache.lookup("https://genius.com/a")
+    assert cached.body == "<html>ü</html>"
+    assert cached.fresh
+    assert validators(cached) == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Sat, 17 Oct 2026 00:00:00 GMT",
+    }
+    assert validators(None) == {}
+
+
+def test_stale_until_revalidated(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), ttl=0)
+    cache.store("https://genius.com/a", "page", {})
+    assert not cache.lookup("https://genius.com/a").fresh
+
+    cache.ttl = 60
+    cache.conn.execute("update responses set fetched = 0")
+    assert not cache.lookup("https://genius.com/a").fresh
+    cache.revalidated("https://genius.com/a")
+    assert cache.lookup("https://genius.com/a").fresh
+
+
+def test_bodies_stored_once(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    cache.store("https://genius.com/a", "same", {})
+    cache.store("https://genius.com/b", "same", {})
+    (bodies,) = cache.conn.execute("select count(*) from bodies").fetchone()
+    assert bodies == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=10, check_every=1)
+    cache.store("https://genius.com/old", "x" * 6, {})
+    cache.conn.execute("update responses set accessed = 0")
+    cache.store("https://genius.com/new", "y" * 6, {})
+
+    assert cache.lookup("https://genius.com/old") is None
+    assert cache.lookup("https://genius.com/new").body == "y" * 6
+    (bodies,) = cache.conn.execute("select count(*) from bodies").fetchone()
+    assert bodies == 1
+
+
+def test_artist_ids(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    urls = ["https://genius.com/artists/%d" % i for i in range(1200)]
+    for i, url in enumerate(urls[::2]):
+        cache.set_artist_id(url, str(i))
+
+    assert cache.artist_id(urls[0]) == "0"
+    assert cache.artist_id(urls[1]) is None
+    found = cache.artist_ids(urls)
+    assert len(found) == 600
+    assert found[urls[1198]] == "599"
+
+
+def test_threads_share_a_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+
+    def fetch(i):
+        url = "https://genius.com/%d" % i
+        cache.store(url, "page %d" % i, {})
+        return cache.lookup(url).body
+
+    with ThreadPoolExecutor(8) as executor:
+        bodies = list(executor.map(fetch, range(64)))
+    assert bodies == ["page %d" % i for i in range(64)]
+
+
+def _child_lookup(cache, url, queue):
+    cache.store(url + "/child", "from %d" % os.getpid(), {})
+    queue.put(cache.lookup(url).body)
+
+
+def test_cache_survives_pickling_and_fork(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"))
+    cache.store("https://genius.com/a", "page", {})
+
+    copy = pickle.loads(pickle.dumps(cache))
+    assert copy.lookup("https://genius.com/a").body == "page"
+
+    queue = mp.Queue()
+    url = "https://genius.com/a"
+    child = mp.Process(target=_child_lookup, args=(cache, url, queue))
+    child.start()
+    assert queue.get(timeout=30) == "page"
+    child.join()
+    assert cache.lookup("https://genius.com/a/child").body.startswith("from ")
+
+
+def test_language_cache(tmp_path):
+    cache = LanguageCache(str(tmp_path / "languages.db"))
+    keys = [LanguageCache.key(text) for text in ["hello there", "hola amigo"]]
+    assert keys[0] == LanguageCache.key("hello there")
+    assert cache.get_many(keys) == {}
+
+    cache.put_many([(keys[0], "en", True), (keys[1], "es", False)])
+    assert cache.get_many(keys + [1]) == {keys[0]: ("en", True), keys[1]: ("es", False)}
@@ -0,0 +1,142 @@
+import os
+import gzip
+import orjson
+import pytest
+
+from doom.corpus import CorpusIndex
+from doom.shards import compress_member
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def combiner(credentials, monkeypatch):
+    from doom import combiner
+
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=combiner.lyrics_root)
+        monkeypatch.setattr(combiner, "s3_client", client)
+        yield combiner
+
+
+def artist(name, artist_id):
+    return {"name": name, "artist_id": artist_id, "songs": [{"title": name}]}
+
+
+def put(combiner, key, *artists):
+    if key.endswith(".json"):
+        (a,) = artists
+        body = orjson.dumps(a)
+    else:
+        body = b"".join(compress_member(orjson.dumps(a) + b"\n") for a in artists)
+    combiner.s3_client.put_object(Bucket=combiner.lyrics_root, Key=key, Body=body)
+
+
+def read_gzip(path):
+    with gzip.open(path, "rb") as f:
+        return [orjson.loads(line) for line in f]
+
+
+def test_safe_letter(combiner):
+    assert combiner.artist_letter({"name": "MF DOOM"}) == "m"
+    assert combiner.artist_letter({"name": "2Pac"}) == "2"
+    assert combiner.artist_letter({"name": "$uicideboy$"}) == "_"
+    assert combiner.artist_letter({"name": "/"}) == "_"
+    assert combiner.artist_letter({"name": ""}) == "_"
+    assert combiner.key_letter("m/MF DOOM.json") == "m"
+    assert combiner.key_letter("../x.json") == "_"
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_combine_by_letter(combiner, tmp_path, ordered):
+    put(combiner, "m/MF DOOM.json", artist("MF DOOM", 1))
+    put(combiner, "m/Madvillain.json", artist("Madvillain", 2))
+    put(combiner, "$/$uicideboy$.json", artist("$uicideboy$", 3))
+    put(
+        combiner,
+        "shards/host-1-00001.ndjson.gz",
+        artist("Nas", 4),
+        artist("Mos Def", 5),
+    )
+
+    keys = [key for key, _, _, _ in combiner.list_bucket()]
+    outputs = combiner.Outputs(str(tmp_path), by_letter=True, block_size=64)
+    combiner.combine(keys, outputs, threads=2, in_flight=2, ordered=ordered)
+    outputs.close()
+
+    assert sorted(os.listdir(tmp_path)) == [
+        "_.json.gz",
+        "_.json.gz.index.gz",
+        "m.json.gz",
+        "m.json.gz.index.gz",
+        "n.json.gz",
+        "n.json.gz.index.gz",
+    ]
+    m = read_gzip(tmp_path / "m.json.gz")
+    assert sorted(a["name"] for a in m) == ["MF DOOM", "Madvillain", "Mos Def"]
+    assert [a["name"] for a in read_gzip(tmp_path / "_.json.gz")] == ["$uicideboy$"]
+
+    index = CorpusIndex(str(tmp_path / "m.json.gz"))
+    assert [a["artist_id"] for a in index.read_artists(names=["mos def"])] == [5]
+
+
+def test_combine_incremental(combiner, tmp_path):
+    out = str(tmp_path / "out")
+    manifest_path = str(tmp_path / "manifest.json")
+    put(combiner, "m/MF DOOM.json", artist("MF DOOM", 1))
+    put(combiner, "m/Madvillain.json", artist("Madvillain", 2))
+    put(combiner, "n/Nas.json", artist("Nas", 3))
+    put(combiner, "r/RZA.json", artist("RZA", 4))
+
+    combiner.combine_incremental(out, manifest_path, threads=2)
+    first = sorted(os.listdir(out))
+    assert len(first) == 6
+    n_file = [f for f in first if f.startswith("n.") and f.endswith(".json.gz")][0]
+    with open(os.path.join(out, n_file), "rb") as f:
+        n_bytes = f.read()
+
+    # left behind by hand, and by a run that died before saving its manifest
+    unrelated = os.path.join(out, "all_lyrics.json.gz")
+    leftover = os.path.join(out, "m.123.json.gz")
+    for path in (unrelated, leftover, leftover + ".index.gz"):
+        with open(path, "wb") as f:
+            f.write(b"")
+
+    put(combiner, "m/MF DOOM.json", dict(artist("MF DOOM", 1), songs=[]))
+    combiner.s3_client.delete_object(Bucket=combiner.lyrics_root, Key="r/RZA.json")
+    put(combiner, "m/Metal Fingers.json", artist("Metal Fingers", 5))
+    combiner.combine_incremental(out, manifest_path, threads=2)
+
+    manifest = combiner.load_manifest(manifest_path)
+    assert sorted(manifest) == [
+        "m/MF DOOM.json",
+        "m/Madvillain.json",
+        "m/Metal Fingers.json",
+        "n/Nas.json",
+    ]
+
+    files = sorted(f for f in os.listdir(out) if not f.endswith(".index.gz"))
+    m_file = manifest["m/MF DOOM.json"]["file"]
+    assert files == sorted(["all_lyrics.json.gz", m_file, n_file])
+    assert not os.path.exists(leftover + ".index.gz")
+    # untouched letters aren't rewritten
+    with open(os.path.join(out, n_file), "rb") as f:
+        assert f.read() == n_bytes
+
+    m = read_gzip(os.path.join(out, m_file))
+    assert sorted(a["name"] for a in m) == ["MF DOOM", "Madvillain", "Metal Fingers"]
+    assert [a for a in m if a["name"] == "MF DOOM"][0]["songs"] == []
+
+    index = CorpusIndex(os.path.join(out, m_file))
+    assert [a["name"] for a in index.read_artists(ids=[2, 5])] == [
+        "Madvillain",
+        "Metal Fingers",
+    ]
+
+    # nothing changed, nothing rewritten
+    combiner.combine_incremental(out, manifest_path, threads=2)
+    assert combiner.load_manifest(manifest_path) == manifest
@@ -0,0 +1,66 @@
+import gzip
+import orjson
+import pytest
+
+from doom.corpus import BlockWriter, CorpusIndex, read_artists, read_index
+from doom.shards import zstandard
+
+
+def write_corpus(path, artists, block_size=200, **kwargs):
+    writer = BlockWriter(path, block_size=block_size, **kwargs)
+    for i, artist in enumerate(artists):
+        line = orjson.dumps(artist)
+        # the caller may or may not have the artist parsed already
+        writer.write(line, artist if i % 2 else None)
+    writer.close()
+
+
+def artists(n):
+    return [
+        {"artist_id": i, "name": "Artist %d" % i, "songs": ["la " * i]}
+        for i in range(n)
+    ]
+
+
+def test_blocks_index_every_artist(tmp_path):
+    path = str(tmp_path / "corpus.json.gz")
+    written = artists(40)
+    write_corpus(path, written)
+
+    entries = read_index(path)
+    assert [e["artist_id"] for e in entries] == list(range(40))
+    assert len({e["offset"] for e in entries}) > 1
+
+    # still a plain gzip file, read start to finish
+    with gzip.open(path, "rb") as f:
+        assert [orjson.loads(line) for line in f] == written
+
+
+def test_read_artists(tmp_path):
+    path = str(tmp_path / "corpus.json.gz")
+    written = artists(40)
+    write_corpus(path, written)
+
+    found = read_artists(path, ids=[33, 2], names=["artist 17", "nobody"])
+    assert found == [written[2], written[17], written[33]]
+    assert read_artists(path, ids=[41]) == []
+
+
+def test_supplement_lines_are_found_with_their_artist(tmp_path):
+    path = str(tmp_path / "corpus.json.gz")
+    written = artists(5)
+    written.append({"artist_id": 3, "name": "Artist 3", "songs": ["more"]})
+    write_corpus(path, written, block_size=10)
+
+    index = CorpusIndex(path)
+    assert len(index) == 6
+    assert list(index.read_artists(ids=[3])) == [written[3], written[5]]
+    assert list(index.read_artists(names=["ARTIST 3"])) == [written[3], written[5]]
+
+
+@pytest.mark.skipif(zstandard is None, reason="needs zstandard")
+def test_zstd(tmp_path):
+    path = str(tmp_path / "corpus.json.zst")
+    written = artists(10)
+    write_corpus(path, written)
+    assert read_artists(path, ids=[7]) == [written[7]]
@@ -0,0 +1,122 @@
+import os
+import hashlib
+
+import numpy as np
+import pytest
+
+from doom.dedup import (
+    Deduplicator,
+    HashIndex,
+    band_keys,
+    hash64,
+    hashes64,
+    minhash,
+    song_record,
+)
+
+
+def test_hashes():
+    expected = hashlib.blake2b(b"feel the flow", digest_size=8).digest()
+    assert hash64("feel the flow") == hash64(b"feel the flow") == expected
+
+    hashes = hashes64(["a", "b", "a"])
+    assert hashes.dtype == np.dtype("<u8")
+    assert hashes[0] == hashes[2] != hashes[1]
+    assert hashes[1] == int.from_bytes(hash64("b"), "little")
+    assert len(hashes64([])) == 0
+
+
+def test_minhash_is_deterministic_and_order_free():
+    shingles = np.unique(hashes64(["line %d" % i for i in range(20)]))
+    signature = minhash(shingles)
+    assert len(signature) == 64
+    assert (minhash(shingles[::-1]) == signature).all()
+    assert len(band_keys(signature, 16)) == 16
+
+
+@pytest.mark.parametrize("max_in_memory", [3, 2 ** 22])
+def test_hash_index(tmp_path, max_in_memory):
+    index = HashIndex(str(tmp_path / "index"), max_in_memory)
+    positions, new = index.add_many([10, 11, 12, 10])
+    assert positions.tolist() == [0, 1, 2, 0]
+    assert new.tolist() == [True, True, True, False]
+
+    positions, new = index.add_many([12, 13, 11, 14, 13])
+    assert positions.tolist() == [2, 3, 1, 4, 3]
+    assert new.tolist() == [False, True, False, True, False]
+    assert len(index) == 5
+    assert bool(index.runs) == (max_in_memory == 3)
+
+    positions, new = index.add_many(np.arange(10, 20, dtype=np.uint64))
+    assert positions.tolist() == list(range(5)) + list(range(5, 10))
+    assert new.tolist() == [False] * 5 + [True] * 5
+    index.close()
+
+
+def test_hash_index_temporary_directory_removed():
+    index = HashIndex(max_in_memory=1)
+    index.add_many([1, 2, 3])
+    directory = index.directory
+    assert os.listdir(directory)
+    index.close()
+    assert not os.path.exists(directory)
+
+
+def songs():
+    verse = ["line %d" % i for i in range(20)]
+    return [
+        verse,
+        list(verse),  # a repeat
+        verse[:19] + ["a different last line"],  # a near repeat
+        ["line 0", "something new", "something new"],
+    ]
+
+
+def kept(mode, **kwargs):
+    dedup = Deduplicator(mode, max_in_memory=4, **kwargs)
+    lines = [dedup.filter(song_record(song, mode)) for song in songs()]
+    counts = dedup.counts().tolist()
+    dropped = dedup.songs_dropped
+    dedup.close()
+    return lines, counts, dropped
+
+
+def test_dedup_lines():
+    lines, counts, dropped = kept("lines")
+    assert dropped == 0
+    assert lines[0] == songs()[0]
+    assert lines[1] == []
+    assert lines[2] == ["a different last line"]
+    assert lines[3] == ["something new"]
+    assert counts[0] == 4  # line 0 is in every song
+    assert counts[1:19] == [3] * 18
+    assert counts[19:] == [2, 1, 2]
+
+
+def test_dedup_exact():
+    lines, counts, dropped = kept("exact")
+    assert dropped == 1
+    assert lines[1] == []
+    assert lines[2] == ["a different last line"]
+    # the dropped repeat counts for nothing
+    assert counts[1:19] == [2] * 18
+
+
+def test_dedup_minhash():
+    lines, counts, dropped = kept("minhash")
+    assert dropped == 2
+    assert lines[1] == lines[2] == []
+    assert lines[3] == ["something new"]
+    assert counts[0] == 2
+
+
+def test_dedup_minhash_threshold():
+    # at a threshold of 1 only identical line sets are dropped
+    lines, counts, dropped = kept("minhash", threshold=1.0)
+    assert dropped == 1
+    assert lines[2] == ["a different last line"]
+
+
+def test_dedup_unknown_mode():
+    with pytest.raises(ValueError):
+        Deduplicator("fuzzy")
@@ -0,0 +1,159 @@
+import orjson
+import pytest
+
+from doom.shards import ShardWriter, read_artist, read_manifest
+
+
+class FakeGenius:
+    """
+    pages of an artist's songs, as the genius api lists them
+    """
+
+    skip_non_songs = True
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.sorts = set()
+
+    def artist_songs(self, artist_id, per_page=50, page=1, sort="title"):
+        self.sorts.add(sort)
+        return {
+            "songs": self.pages[page - 1],
+            "next_page": page + 1 if page < len(self.pages) else None,
+        }
+
+    def _result_is_lyrics(self, info):
+        return "(Tracklist)" not in info["title"]
+
+
+def info(song_id, title, artist_id=1):
+    return {
+        "id": song_id,
+        "title": title,
+        "url": "https://genius.com/songs/%d" % song_id,
+        "primary_artist": {"id": artist_id},
+    }
+
+
+@pytest.fixture
+def songs(crawler, monkeypatch):
+    """
+    an artist whose api listing has songs 1 to 6 worth keeping, and a
+    fetch_song that fails for whichever ids are in `failing`
+    """
+    pages = [
+        [info(1, "Doomsday"), info(2, "Rhymes Like Dimes"), info(90, "Feat", 2)],
+        [info(3, "Operation: Greenbacks"), info(91, "Doomsday")],
+        [info(4, "Go with the Flow"), info(92, "Album (Tracklist)")],
+        [info(5, "Hey!"), info(6, "Gas Drawls")],
+    ]
+    genius = FakeGenius(pages)
+    monkeypatch.setattr(crawler, "genius", genius)
+
+    failing = set()
+    fetched = []
+
+    def fetch_song(info, attempts=5):
+        fetched.append(info["id"])
+        if info["id"] in failing:
+            raise ValueError("no lyrics for %d" % info["id"])
+        return {"id": info["id"], "lyrics": "lyrics %d" % info["id"]}
+
+    monkeypatch.setattr(crawler, "fetch_song", fetch_song)
+    return genius, failing, fetched
+
+
+def test_song_listing(crawler, songs):
+    genius, _, _ = songs
+    a = crawler.Artist("MF DOOM", "u", artist_id="1")
+    assert [i["id"] for i in a.song_listing()] == [1, 2, 3, 4, 5, 6]
+    assert genius.sorts == {"popularity"}
+
+
+def test_fetch_songs_keeps_order_and_records_missing(crawler, songs):
+    _, failing, _ = songs
+    failing.update({2, 5})
+    a = crawler.Artist("MF DOOM", "u", artist_id=1).fetch_songs(threads=3)
+
+    assert [s["id"] for s in a.songs] == [1, 3, 4, 6]
+    assert sorted(m["id"] for m in a.missing_songs) == [2, 5]
+    assert {m["url"] for m in a.missing_songs} == {
+        "https://genius.com/songs/2",
+        "https://genius.com/songs/5",
+    }
+
+
+def test_fetch_songs_only_fetches_missing(crawler, songs):
+    _, _, fetched = songs
+    missing = [{"id": 2, "url": "https://genius.com/songs/2"}]
+    a = crawler.Artist("MF DOOM", "u", artist_id=1, missing_songs=missing)
+    a.fetch_songs()
+
+    assert fetched == [2]
+    assert a.songs == [{"id": 2, "lyrics": "lyrics 2"}]
+    assert a.missing_songs == []
+
+
+@pytest.fixture
+def s3(crawler, monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=crawler.lyrics_root)
+        monkeypatch.setattr(crawler, "s3_client", client)
+        monkeypatch.setattr(crawler, "shard_settings", None)
+        monkeypatch.setattr(crawler, "shards", None)
+        yield client
+
+
+def stored(crawler, a):
+    key = crawler.artist_key(a)
+    body = crawler.s3_client.get_object(Bucket=crawler.lyrics_root, Key=key)["Body"]
+    return orjson.loads(body.read())
+
+
+def test_retry_adds_missing_songs_to_the_stored_artist(crawler, songs, s3):
+    _, failing, fetched = songs
+    failing.add(4)
+    a = crawler.Artist("MF DOOM", "u", artist_id=1)
+    assert crawler._fetch_and_save_songs(a) == 5
+    assert a.missing_songs == [{"id": 4, "url": "https://genius.com/songs/4"}]
+
+    failing.clear()
+    del fetched[:]
+    retry = crawler.Artist("MF DOOM", "u", artist_id=1, missing_songs=a.missing_songs)
+    assert crawler._fetch_and_save_songs(retry) == 6
+    assert fetched == [4]
+    assert [s["id"] for s in stored(crawler, retry)["songs"]] == [1, 2, 3, 5, 6, 4]
+
+
+def test_retry_without_a_stored_artist_fetches_everything(crawler, songs, s3):
+    missing = [{"id": 4, "url": "https://genius.com/songs/4"}]
+    a = crawler.Artist("MF DOOM", "u", artist_id=1, missing_songs=missing)
+    assert crawler._fetch_and_save_songs(a) == 6
+    assert len(stored(crawler, a)["songs"]) == 6
+
+
+def test_retry_writes_a_supplement_to_a_shard(crawler, songs, s3, monkeypatch):
+    _, failing, _ = songs
+    monkeypatch.setattr(crawler, "shards", ShardWriter(s3, crawler.lyrics_root))
+    monkeypatch.setattr(crawler, "shard_settings", {"prefix": "shards"})
+
+    failing.add(4)
+    a = crawler.Artist("MF DOOM", "u", artist_id=1)
+    crawler._fetch_and_save_songs(a)
+    failing.clear()
+    crawler._fetch_and_save_songs(
+        crawler.Artist("MF DOOM", "u", artist_id=1, missing_songs=a.missing_songs)
+    )
+    crawler.shards.close()
+
+    first, supplement = read_manifest(s3, crawler.lyrics_root)
+    assert first["missing"] == [{"id": 4, "url": "https://genius.com/songs/4"}]
+    assert "missing" not in supplement
+    artist = read_artist(s3, crawler.lyrics_root, supplement)
+    assert artist["supplement"] is True
+    assert artist["songs"] == [{"id": 4, "lyrics": "lyrics 4"}]
@@ -0,0 +1,99 @@
+import orjson
+import pytest
+
+from doom.shards import ShardWriter
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+# moto 5 folded the per-service mocks into one
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+
+@pytest.fixture
+def s3(crawler, monkeypatch):
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=crawler.lyrics_root)
+        monkeypatch.setattr(crawler, "s3_client", client)
+        monkeypatch.setattr(crawler, "shard_settings", None)
+        yield client
+
+
+def put_artist(s3, crawler, a, songs=()):
+    body = orjson.dumps({"name": a.name, "url": a.url, "songs": list(songs)})
+    s3.put_object(Bucket=crawler.lyrics_root, Key=crawler.artist_key(a), Body=body)
+
+
+def artist(crawler, name, **kwargs):
+    return crawler.Artist(name, "https://genius.com/artists/%s" % name, **kwargs)
+
+
+def test_list_prefix(crawler, s3):
+    doom = artist(crawler, "MF DOOM")
+    put_artist(s3, crawler, doom)
+    put_artist(s3, crawler, artist(crawler, "Madvillain"))
+    put_artist(s3, crawler, artist(crawler, "Nas"))
+
+    listing = crawler.list_prefix("m/")
+    assert sorted(listing) == ["m/MF DOOM.json", "m/Madvillain.json"]
+    size, etag = listing["m/MF DOOM.json"]
+    assert size == s3.head_object(Bucket=crawler.lyrics_root, Key="m/MF DOOM.json")[
+        "ContentLength"
+    ]
+    assert etag
+
+
+def test_s3_inventory_pages_through_every_prefix(crawler, s3):
+    for i in range(1005):
+        s3.put_object(Bucket=crawler.lyrics_root, Key="a/%04d.json" % i, Body=b"{}")
+    s3.put_object(Bucket=crawler.lyrics_root, Key="b/b.json", Body=b"{}")
+    s3.put_object(Bucket=crawler.lyrics_root, Key="c/c.json", Body=b"{}")
+
+    inventory = crawler.s3_inventory(["a/", "b/"], threads=2)
+    assert len(inventory) == 1006
+    assert "b/b.json" in inventory
+    assert "c/c.json" not in inventory
+
+
+def test_missing_artists(crawler, s3):
+    doom = artist(crawler, "MF DOOM")
+    nas = artist(crawler, "Nas")
+    madvillain = artist(crawler, "Madvillain", missing_songs=[{"id": 1, "url": "u"}])
+    put_artist(s3, crawler, doom)
+    put_artist(s3, crawler, madvillain)
+
+    missing = crawler.missing_artists([doom, nas, madvillain])
+    assert [a.name for a in missing] == ["Nas", "Madvillain"]
+
+
+def test_missing_sharded_artists(crawler, s3, monkeypatch):
+    monkeypatch.setattr(crawler, "shard_settings", {"prefix": "shards"})
+    doom = artist(crawler, "MF DOOM")
+    nas = artist(crawler, "Nas")
+    madvillain = artist(crawler, "Madvillain")
+    gone = [{"id": 7, "url": "https://genius.com/accordion"}]
+
+    writer = ShardWriter(s3, crawler.lyrics_root, prefix="shards")
+    writer.write({"name": doom.name, "url": doom.url}, [{"id": 1}])
+    record = writer.record({"name": madvillain.name, "url": madvillain.url})
+    record.add({"id": 2})
+    record.missing = gone
+    record.close()
+    writer.close()
+    # artists in a shard that's still being written haven't made it yet
+    ShardWriter(s3, crawler.lyrics_root, prefix="shards").write(
+        {"name": nas.name, "url": nas.url}, []
+    )
+
+    missing = crawler.missing_artists([doom, nas, madvillain])
+    assert [a.name for a in missing] == ["Nas", "Madvillain"]
+    assert madvillain.missing_songs == gone
+
+
+def test_stored_songs(crawler, s3):
+    doom = artist(crawler, "MF DOOM")
+    assert crawler.stored_songs(doom) is None
+
+    put_artist(s3, crawler, doom, [{"id": 1}, {"id": 2}])
+    assert crawler.stored_songs(doom) == [{"id": 1}, {"id": 2}]
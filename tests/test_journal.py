@@ -0,0 +1,96 @@
+import multiprocessing as mp
+
+from collections import namedtuple
+
+from doom.journal import Journal
+
+Artist = namedtuple("Artist", ["name", "url", "artist_id"])
+
+doom = Artist("MF DOOM", "https://genius.com/artists/Mf-doom", "123")
+nas = Artist("Nas", "https://genius.com/artists/Nas", "456")
+rza = Artist("RZA", "https://genius.com/artists/Rza", None)
+
+
+def test_replay_empty(tmp_path):
+    state = Journal(str(tmp_path / "journal.ndjson")).replay()
+    assert state.completed == {} and state.failed == {} and state.in_flight == {}
+    assert state.last_page("a") == 0
+
+
+def test_replay_artists(tmp_path):
+    journal = Journal(str(tmp_path / "journal.ndjson"))
+    for a in [doom, nas, rza]:
+        journal.started(a)
+    journal.completed(doom, songs=10)
+    journal.failed(nas, "429")
+
+    state = journal.replay()
+    assert state.completed == {doom.url: 10}
+    assert list(state.failed) == [nas.url]
+    assert state.failed[nas.url]["name"] == "Nas"
+    assert list(state.in_flight) == [rza.url]
+
+
+def test_replay_partial(tmp_path):
+    journal = Journal(str(tmp_path / "journal.ndjson"))
+    missing = [{"id": 1, "url": "https://genius.com/song"}]
+    journal.failed(doom, "timeout")
+    journal.completed(doom, songs=9, missing=missing)
+
+    state = journal.replay()
+    assert doom.url not in state.failed and doom.url not in state.completed
+    assert state.partial[doom.url]["missing"] == missing
+    assert state.partial[doom.url]["artist"]["artist_id"] == "123"
+
+    # a later retry fetching the rest finishes the artist
+    journal.started(doom)
+    journal.completed(doom, songs=1)
+    state = journal.replay()
+    assert state.partial == {}
+    assert state.completed == {doom.url: 1}
+
+
+def test_replay_pages(tmp_path):
+    journal = Journal(str(tmp_path / "journal.ndjson"))
+    journal.page("a", 2, [{"name": "a2"}])
+    journal.page("a", 1, [{"name": "a1"}])
+    journal.page("b", 1, [{"name": "b1"}])
+    journal.letter_done("b", 1)
+
+    state = journal.replay()
+    assert state.last_page("a") == 2
+    assert state.letter_artists("a") == [{"name": "a1"}, {"name": "a2"}]
+    assert state.letters_done == {"b"}
+
+
+def test_replay_skips_torn_write(tmp_path):
+    path = str(tmp_path / "journal.ndjson")
+    journal = Journal(path)
+    journal.completed(doom)
+    with open(path, "ab") as f:
+        f.write(b'{"event": "completed", "artist": {"na')
+
+    state = Journal(path).replay()
+    assert list(state.completed) == [doom.url]
+
+
+def _write_events(journal, start):
+    for i in range(start, start + 200):
+        journal.completed(Artist("a%d" % i, "https://genius.com/%d" % i, None))
+
+
+def test_processes_share_a_journal(tmp_path):
+    journal = Journal(str(tmp_path / "journal.ndjson"))
+    journal.started(doom)
+    workers = [
+        mp.Process(target=_write_events, args=(journal, start))
+        for start in range(0, 800, 200)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    state = journal.replay()
+    assert len(state.completed) == 800
+    assert list(state.in_flight) == [doom.url]
@@ -0,0 +1,55 @@
+import numpy as np
+
+from doom.ragged import (
+    RaggedSequences,
+    RaggedWriter,
+    is_ragged,
+    token_dtype,
+    write_counts,
+)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "seqs")
+    with RaggedWriter(path, "uint16") as writer:
+        writer.append([1, 2, 3])
+        # a batch given as a slice of a bigger buffer
+        writer.append_batch([9, 9, 4, 5, 6, 7, 9], [2, 4, 4, 6])
+        writer.append([8])
+        writer.close(max_seq_len=3)
+
+    assert is_ragged(path)
+    seqs = RaggedSequences(path)
+    assert len(seqs) == 5
+    assert [s.tolist() for s in seqs] == [[1, 2, 3], [4, 5], [], [6, 7], [8]]
+    assert seqs.lengths().tolist() == [3, 2, 0, 2, 1]
+    assert seqs[3].dtype == np.uint16
+    assert seqs.max_seq_len == 3
+    assert seqs.meta["sequences"] == 5 and seqs.meta["tokens"] == 8
+    assert seqs.counts() is None
+
+
+def test_empty(tmp_path):
+    path = str(tmp_path / "seqs")
+    RaggedWriter(path).close()
+
+    seqs = RaggedSequences(path)
+    assert len(seqs) == 0
+    assert list(seqs) == []
+
+
+def test_counts(tmp_path):
+    path = str(tmp_path / "seqs")
+    writer = RaggedWriter(path)
+    writer.append([1])
+    writer.append([2])
+    writer.close()
+    write_counts(path, [3, 1])
+
+    assert RaggedSequences(path).counts().tolist() == [3, 1]
+
+
+def test_token_dtype():
+    assert token_dtype(2 ** 16) == "uint16"
+    assert token_dtype(2 ** 16 + 1) == "int32"
+    assert not is_ragged("/nonexistent")
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import email.utils
+import multiprocessing as mp
+
+from doom.ratelimit import (
+    RateLimiter,
+    TokenBucket,
+    backoff_delay,
+    retry_after,
+    retry_delay,
+)
+
+
+def test_backoff_delay_bounds():
+    for attempt in range(12):
+        for _ in range(50):
+            delay = backoff_delay(attempt)
+            assert 0 <= delay <= min(60.0, 0.5 * 2 ** attempt)
+    assert max(backoff_delay(3, base=1, cap=2) for _ in range(50)) <= 2
+
+
+def test_retry_after_seconds():
+    assert retry_after({"Retry-After": "3"}) == 3.0
+    assert retry_after({"Retry-After": "-1"}) == 0.0
+    assert retry_after({"Retry-After": "soon"}) is None
+    assert retry_after({}) is None
+    assert retry_after(None) is None
+
+
+def test_retry_after_http_date():
+    when = email.utils.formatdate(time.time() + 10, usegmt=True)
+    assert 8 <= retry_after({"Retry-After": when}) <= 10.5
+
+    past = email.utils.formatdate(time.time() - 100, usegmt=True)
+    assert retry_after({"Retry-After": past}) == 0.0
+
+
+def test_retry_delay_honors_retry_after_only_when_throttled():
+    headers = {"Retry-After": "30"}
+    assert retry_delay(429, headers, 0) == 30.0
+    assert retry_delay(503, headers, 0) == 30.0
+    assert retry_delay(500, headers, 0) <= 0.5
+    assert retry_delay(429, None, 1) <= 1.0
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # callers queue up behind each other rather than all waiting one interval
+    assert 0.05 < bucket.reserve() <= 0.1
+    assert 0.15 < bucket.reserve() <= 0.2
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(100)
+    bucket.pause(5)
+    assert 4.9 < bucket.reserve() <= 5
+    # a shorter pause doesn't cut a longer one short
+    bucket.pause(1)
+    assert bucket.reserve() > 4.9
+
+
+def _reserve(bucket, times):
+    for _ in range(times):
+        bucket.reserve()
+
+
+def test_token_bucket_shared_across_processes():
+    bucket = TokenBucket(1, burst=3)
+    worker = mp.Process(target=_reserve, args=(bucket, 3))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+    assert bucket.reserve() > 0.9
+
+
+def test_rate_limiter_buckets_by_host():
+    limiter = RateLimiter({"genius.com": 2}, default_rate=7)
+    bucket = limiter.bucket("https://genius.com/artists/MF-doom")
+    assert bucket is limiter.bucket("https://genius.com/songs/1")
+    assert bucket.rate == 2
+
+    other = limiter.bucket("https://api.genius.com/songs/1")
+    assert other is not bucket
+    assert other.rate == 7
+    assert other is limiter.bucket("https://api.genius.com/artists/2")
+
+
+def test_rate_limiter_paces_acquire():
+    limiter = RateLimiter({"genius.com": 20}, burst=1)
+    start = time.time()
+    for _ in range(5):
+        limiter.acquire("https://genius.com/")
+    assert time.time() - start >= 0.19
+
+
+def test_fetch_retries_429_after_retry_after(crawler, stub, monkeypatch):
+    server = stub((429, {"Retry-After": "1"}, "slow down"))
+    monkeypatch.setattr(crawler, "limiter", RateLimiter({server.host: 100}))
+
+    assert crawler.fetch_with_retries(server.url) == "ok"
+    assert len(server.hits) == 2
+    assert server.hits[1] - server.hits[0] >= 0.9
+    # the 429 held back every caller sharing the limiter
+    paused = crawler.limiter.bucket(server.url)._paused_until.value
+    assert paused >= server.hits[0] + 0.9
+
+
+def test_fetch_backs_off_without_retry_after(crawler, stub, monkeypatch):
+    server = stub((429, {}, ""), (503, {}, ""), (502, {}, ""))
+    monkeypatch.setattr(crawler, "limiter", RateLimiter({server.host: 100}))
+
+    assert crawler.fetch_with_retries(server.url) == "ok"
+    assert len(server.hits) == 4
+
+
+def test_fetch_gives_up(crawler, stub, monkeypatch):
+    server = stub(*[(429, {"Retry-After": "0"}, "")] * 3)
+    monkeypatch.setattr(crawler, "limiter", RateLimiter({server.host: 100}))
+    assert crawler.fetch_with_retries(server.url, attempts=2) is None
+    assert len(server.hits) == 3
+
+    missing = stub((404, {}, "not found"))
+    assert crawler.fetch_with_retries(missing.url) is None
+    assert len(missing.hits) == 1
+
+
+def test_with_retries_429(crawler, stub, monkeypatch):
+    server = stub((429, {"Retry-After": "0"}, ""), (500, {}, ""))
+    monkeypatch.setattr(crawler, "limiter", RateLimiter({server.host: 100}))
+
+    def fetch():
+        response = crawler.session.get(server.url)
+        response.raise_for_status()
+        return response.text
+
+    assert crawler.with_retries(server.url, fetch) == "ok"
+    assert len(server.hits) == 3
+
+
+def test_fetch_async_retries_429(crawler, stub, monkeypatch):
+    server = stub((429, {"Retry-After": "1"}, ""), (503, {"Retry-After": "0"}, ""))
+    monkeypatch.setattr(crawler, "limiter", RateLimiter({server.host: 100}))
+
+    async def fetch():
+        async with crawler.open_client(4) as client:
+            return await crawler.fetch_with_retries_async(client, server.url)
+
+    assert asyncio.run(fetch()) == "ok"
+    assert len(server.hits) == 3
+    assert server.hits[1] - server.hits[0] >= 0.9
@@ -0,0 +1,120 @@
+import multiprocessing as mp
+
+import pytest
+
+from doom.scheduler import CrawlStats, cost_chunks, largest_first, run_tasks
+from doom.utils import chunks, imap_bounded
+
+
+def crawl(item):
+    if item % 7 == 0:
+        raise ValueError("no lyrics for %d" % item)
+
+
+def square(x):
+    return x * x
+
+
+def crawl_costly(item):
+    if item > 100:
+        raise ValueError("too big: %d" % item)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with mp.Pool(2) as pool:
+        yield pool
+
+
+def test_chunks():
+    assert list(chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunks([], 3)) == []
+
+
+def test_imap_bounded_keeps_order(pool):
+    assert list(imap_bounded(pool, square, range(20), 3)) == [x * x for x in range(20)]
+
+
+def test_run_tasks_collects_every_result(pool):
+    stats = run_tasks(pool, crawl, list(range(50)), key=str, chunksize=3, max_pending=2)
+    assert stats.completed == 50
+    assert sorted(int(key) for key, _ in stats.failures) == list(range(0, 50, 7))
+    assert "no lyrics for 14" in dict(stats.failures)["14"]
+    assert stats.succeeded == 50 - 8
+
+
+def test_run_tasks_records_unpicklable_chunks(pool):
+    stats = run_tasks(pool, crawl, [1, 2, lambda: None], key=str, chunksize=1)
+    assert stats.completed == 3
+    assert len(stats.failures) == 1
+
+
+def test_crawl_stats():
+    stats = CrawlStats(slowest=2)
+    for i in range(20):
+        stats.record("a%d" % i, i != 3, float(i), None if i != 3 else "boom")
+
+    assert stats.completed == 20 and stats.succeeded == 19
+    assert stats.failures == [("a3", "boom")]
+    assert stats.percentile(50) == 10.0
+    assert stats.percentile(100) == 19.0
+    assert sorted(stats.slowest, reverse=True)[:2] == [(19.0, "a19"), (18.0, "a18")]
+    assert CrawlStats().percentile(95) == 0.0
+
+
+def test_largest_first():
+    costs = {"a": 5, "b": None, "c": 50, "d": 1, "e": None, "f": 20}
+    # unknown costs slot in at the median of the known ones, 20
+    assert largest_first(list(costs), costs.get) == ["c", "b", "e", "f", "a", "d"]
+
+    assert largest_first(["x", "y"], lambda item: None) == ["x", "y"]
+
+
+def test_cost_chunks():
+    items = [500, 1, 2, 3, 4, 5, 90, 20, None]
+    chunked = list(cost_chunks(items, lambda c: c, size=4, max_cost=100))
+    assert chunked == [[500], [1, 2, 3, 4], [5, 90, 20], [None]]
+    assert list(cost_chunks([], lambda c: c, 4, 100)) == []
+
+
+def test_run_tasks_by_cost(pool):
+    items = [1, 200, 3, 4, 150, 6]
+    stats = run_tasks(
+        pool,
+        crawl_costly,
+        largest_first(items, lambda item: item),
+        key=str,
+        chunksize=3,
+        cost=lambda item: item,
+        max_cost=100,
+    )
+    assert stats.completed == 6
+    assert sorted(key for key, _ in stats.failures) == ["150", "200"]
+
+
+def test_schedule_from_journal(crawler, tmp_path):
+    journal = crawler.Journal(str(tmp_path / "journal.ndjson"))
+    small, mid, big, new = [
+        crawler.Artist(name, "https://genius.com/artists/%s" % name)
+        for name in ["small", "mid", "big", "new"]
+    ]
+    journal.completed(small, songs=3)
+    journal.completed(mid, songs=30)
+    journal.completed(big, songs=300)
+    journal.completed(new)
+
+    estimates = crawler.song_count_estimates(journal.path)
+    assert estimates == {small.url: 3, mid.url: 30, big.url: 300}
+    # new is taken to be typical, and ties keep their order
+    order = crawler.schedule([small, new, mid, big], estimates)
+    assert order == [big, new, mid, small]
+    assert crawler.schedule([small, new], {}) == [small, new]
+
+
+def test_song_threads_for(crawler, monkeypatch):
+    monkeypatch.setattr(crawler, "song_threads", 8)
+    monkeypatch.setattr(crawler, "max_song_threads", 32)
+    monkeypatch.setattr(crawler, "songs_per_thread", 25)
+    assert crawler.song_threads_for(10) == 8
+    assert crawler.song_threads_for(501) == 21
+    assert crawler.song_threads_for(5000) == 32
@@ -0,0 +1,146 @@
+import io
+import orjson
+import pytest
+
+from doom.shards import (
+    ShardWriter,
+    compress_member,
+    decompress,
+    decompress_stream,
+    read_artist,
+    read_manifest,
+    zstandard,
+)
+
+compressions = [
+    "gzip",
+    pytest.param(
+        "zstd",
+        marks=pytest.mark.skipif(zstandard is None, reason="needs zstandard"),
+    ),
+]
+
+
+class FakeS3:
+    """
+    just enough of an s3 client for a shard writer, kept in a dict
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = "upload-%d" % len(self.uploads)
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": "etag-%d" % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        self.objects[(Bucket, Key)] = b"".join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key, Range=None):
+        body = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range[len("bytes=") :].split("-")
+            body = body[int(start) : int(end) + 1]
+        return {"Body": io.BytesIO(body)}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        keys = [k for b, k in self.objects if b == Bucket and k.startswith(Prefix)]
+        yield {"Contents": [{"Key": k} for k in sorted(keys)]}
+
+
+def artists(n):
+    return [
+        (
+            {"name": "artist %d" % i, "url": "https://genius.com/%d" % i},
+            [{"id": i * 100 + j, "lyrics": "line %d\n" % j * 50} for j in range(i % 4)],
+        )
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("compression", compressions)
+def test_members_read_back_one_by_one_or_as_a_stream(compression):
+    lines = [orjson.dumps({"i": i}) + b"\n" for i in range(5)]
+    members = [compress_member(line, compression) for line in lines]
+    data = b"".join(members)
+
+    assert decompress(members[3], compression) == lines[3]
+    assert decompress_stream(io.BytesIO(data), compression).readlines() == lines
+
+
+@pytest.mark.parametrize("compression", compressions)
+def test_shard_writer_round_trip(compression):
+    s3 = FakeS3()
+    rolled = []
+    writer = ShardWriter(
+        s3,
+        "bucket",
+        prefix="shards",
+        compression=compression,
+        max_bytes=2000,
+        on_roll=rolled.append,
+    )
+    written = artists(30)
+    for head, songs in written:
+        writer.write(head, songs)
+    writer.close()
+
+    assert writer.shards > 1
+    assert len(rolled) == writer.shards
+    entries = list(read_manifest(s3, "bucket", "shards"))
+    assert sorted(e["url"] for e in entries) == sorted(h["url"] for h, _ in written)
+    assert [e for batch in rolled for e in batch] == entries
+
+    for (head, songs), entry in zip(written, entries):
+        assert entry["songs"] == len(songs)
+        artist = read_artist(s3, "bucket", entry, compression)
+        assert artist == dict(head, songs=songs)
+
+    # every shard is still a whole compressed ndjson file
+    shard = s3.objects[("bucket", entries[0]["shard"])]
+    lines = decompress_stream(io.BytesIO(shard), compression).readlines()
+    assert len(lines) == sum(e["shard"] == entries[0]["shard"] for e in entries)
+
+
+def test_record_streams_songs_and_records_missing():
+    s3 = FakeS3()
+    writer = ShardWriter(s3, "bucket")
+    record = writer.record({"name": "MF DOOM", "url": "u", "supplement": True})
+    for i in range(3):
+        record.add({"id": i})
+    record.missing = [{"id": 3, "url": "https://genius.com/3"}]
+    # nothing reaches the shard before the record is closed
+    assert writer.upload is None
+    record.close()
+    writer.close()
+
+    (entry,) = read_manifest(s3, "bucket")
+    assert entry["songs"] == 3
+    assert entry["missing"] == [{"id": 3, "url": "https://genius.com/3"}]
+    artist = read_artist(s3, "bucket", entry)
+    assert artist["supplement"] is True
+    assert artist["songs"] == [{"id": 0}, {"id": 1}, {"id": 2}]
+
+
+def test_close_without_records_writes_nothing():
+    s3 = FakeS3()
+    writer = ShardWriter(s3, "bucket")
+    writer.close()
+    assert s3.objects == {} and s3.uploads == {}
@@ -0,0 +1,373 @@
+import gzip
+import orjson
+import hashlib
+import itertools
+
+import numpy as np
+import pytest
+
+from doom.cache import LanguageCache
+from doom.dedup import Deduplicator
+from doom.ragged import RaggedSequences, RaggedWriter, write_counts
+from doom.stats import SequenceStats, batch_summary
+from doom.vocab import Vocabulary, count_words
+
+song_reader = pytest.importorskip("doom.song_reader")
+
+
+@pytest.fixture
+def english(tmp_path, monkeypatch):
+    """
+    a language cache that has every song made by `artist` down as
+    english, so no detection runs
+    """
+    cache = LanguageCache(str(tmp_path / "languages.db"))
+    monkeypatch.setattr(song_reader, "language_cache", cache)
+    return cache
+
+
+def artist(english, artist_id, songs=10, lines=20, **fields):
+    songs = [
+        "\n".join("line %d of %s/%d" % (i, artist_id, s) for i in range(lines))
+        for s in range(songs)
+    ]
+    english.put_many([(LanguageCache.key(lyrics), "en", True) for lyrics in songs])
+    head = {"name": "artist %s" % artist_id, "url": "u", "artist_id": artist_id}
+    return dict(head, **fields, songs=[{"lyrics": lyrics} for lyrics in songs])
+
+
+def test_artist_shard_is_stable():
+    digest = hashlib.blake2b(b"123", digest_size=8).digest()
+    assert song_reader.artist_shard(123, 7) == int.from_bytes(digest, "little") % 7
+    assert song_reader.artist_shard("123", 7) == song_reader.artist_shard(123, 7)
+
+    counts = np.bincount([song_reader.artist_shard(i, 4) for i in range(4000)])
+    assert counts.min() > 900
+
+
+@pytest.mark.parametrize(
+    "artist",
+    [
+        # streamed into a crawler shard: name, url, artist_id, then songs
+        {"name": "MF DOOM", "url": "u", "artist_id": 42, "songs": []},
+        {"name": 'say "hi" \\', "url": "u", "artist_id": "42", "songs": []},
+        {"name": None, "url": None, "artist_id": None, "songs": []},
+        # Artist.to_dict: artist_id last
+        {"name": "MF DOOM", "url": "u", "songs": [{"artist_id": 1}], "artist_id": 42},
+        {"name": "MF DOOM", "url": "u", "songs": [], "artist_id": -3},
+        # anywhere else, parsed
+        {"artist_id": 42, "name": "MF DOOM", "songs": []},
+    ],
+)
+def test_raw_artist_shard(artist):
+    raw = orjson.dumps(artist)
+    for shards in (2, 5, 16):
+        expected = song_reader.artist_shard(artist["artist_id"], shards)
+        assert song_reader.raw_artist_shard(raw, shards) == expected
+
+
+def test_parse_shard_and_shard_path():
+    assert song_reader.parse_shard("1/4") == (1, 4)
+    with pytest.raises(ValueError):
+        song_reader.parse_shard("4/4")
+    assert (
+        song_reader.shard_path("data/lyrics.json.gz", (1, 4))
+        == "data/lyrics-00001-of-00004.json.gz"
+    )
+    assert song_reader.shard_path("out/", (0, 2)) == "out-00000-of-00002"
+
+
+def test_shards_split_artists(english):
+    raw = [orjson.dumps(artist(english, i, songs=1)) for i in range(50)]
+    kept = [
+        [a for a, _ in song_reader.raw_artists_to_lines(raw, shard=(i, 3))]
+        for i in range(3)
+    ]
+    assert sorted(itertools.chain(*kept)) == list(range(50))
+    assert all(kept)
+
+
+def test_encode_artists_summarizes_unless_deduplicating(english):
+    vocab = Vocabulary.from_counts(count_words(["line of"]))
+    raw = [orjson.dumps(artist(english, i)) for i in range(3)]
+
+    artists, ids, offsets, summary = song_reader.encode_artists(raw, vocab.encode_batch)
+    assert [a for a, _ in artists] == [0, 1, 2]
+    assert artists[0][1] == [20] * 10
+    assert len(offsets) == 3 * 10 * 20 + 1
+    for expected, got in zip(batch_summary(ids, offsets), summary):
+        assert (expected == got).all()
+
+    artists, _, _, summary = song_reader.encode_artists(
+        raw, vocab.encode_batch, dedup="exact"
+    )
+    assert summary is None
+    assert artists[0][1][0][1] == 20
+
+
+def test_unique_artist_sequences_resummarizes_what_it_drops(english):
+    vocab = Vocabulary.from_counts(count_words(["line of %d" % i for i in range(20)]))
+    raw = [orjson.dumps(artist(english, i)) for i in (0, 1, 0)]
+    batch = song_reader.encode_artists(raw, vocab.encode_batch)
+
+    stats = SequenceStats()
+    batches = song_reader.unique_artist_sequences([batch], stats=stats)
+    ((ids, offsets, summary),) = batches
+    assert stats.artists == 2 and stats.songs == 20
+    assert len(offsets) == 2 * 10 * 20 + 1
+    for expected, got in zip(batch_summary(ids, offsets), summary):
+        assert (expected == got).all()
+
+    # songs repeated across artists are dropped with a deduplicator
+    raw = [orjson.dumps(artist(english, i)) for i in (0, 1)]
+    raw.append(orjson.dumps(dict(artist(english, 0), artist_id=2)))
+    batch = song_reader.encode_artists(raw, vocab.encode_batch, dedup="exact")
+    dedup = Deduplicator("exact")
+    ((ids, offsets, summary),) = song_reader.unique_artist_sequences([batch], dedup)
+    dedup.close()
+    assert len(offsets) == 2 * 10 * 20 + 1
+
+
+def test_supplements_add_to_their_artist(english):
+    full = artist(english, 7)
+    supplement = artist(english, 7, songs=2, lines=25, supplement=True)
+    raw = [orjson.dumps(a) for a in (full, supplement, supplement, full)]
+
+    parsed = song_reader.raw_artists_to_lines(raw)
+    keys = [key for key, _ in parsed]
+    assert keys[0] == keys[3] == 7
+    assert isinstance(keys[1], song_reader.Supplement) and keys[1] == keys[2]
+    # a supplement isn't held to an artist's min_songs
+    assert len(parsed[1][1]) == 2
+
+    stats = SequenceStats()
+    lines = list(song_reader.unique_artist_lines([parsed], stats=stats))
+    assert (stats.artists, stats.songs) == (1, 12)
+    assert len(lines) == 10 * 20 + 2 * 25
+
+
+def write_part(path, seqs, counts=None, total_words=9):
+    stats = SequenceStats()
+    stats.artists = 1
+    batches = []
+    if seqs:
+        offsets = np.cumsum([0] + [len(s) for s in seqs])
+        ids = np.concatenate([np.asarray(s, dtype=np.int64) for s in seqs])
+        batches.append((ids, offsets, batch_summary(ids, offsets)))
+
+    class Counts:
+        def counts(self):
+            return np.asarray(counts)
+
+    dedup = None if counts is None else Counts()
+    song_reader.write_json(batches, path, stats, total_words, deduplicator=dedup)
+    stats.save(song_reader.stats_path(path))
+
+
+def read_json(path):
+    with gzip.open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 2 ** 20])
+def test_merge_json(tmp_path, monkeypatch, chunk_size):
+    copy = song_reader.copy_json_seqs
+
+    def small_chunks(path, out, separator=b""):
+        return copy(path, out, separator, chunk_size)
+
+    monkeypatch.setattr(song_reader, "copy_json_seqs", small_chunks)
+    parts = [
+        ([[1, 2, 3], [4]], [2, 1]),
+        ([], []),
+        ([[5, 6], [7, 8, 9, 9, 9]], [1, 1]),
+    ]
+    paths = []
+    for i, (seqs, counts) in enumerate(parts):
+        paths.append(str(tmp_path / ("part-%d.json.gz" % i)))
+        write_part(paths[-1], seqs, counts)
+
+    output = str(tmp_path / "merged.json.gz")
+    stats = song_reader.merge_json(paths, output)
+
+    merged = read_json(output)
+    assert merged["seqs"] == [[1, 2, 3], [4], [5, 6], [7, 8, 9, 9, 9]]
+    assert merged["counts"] == [2, 1, 1, 1]
+    assert merged["max_seq_len"] == 5 and merged["total_words"] == 9
+    assert stats.artists == 3 and stats.lines == 4
+    assert SequenceStats.load(song_reader.stats_path(output)).lines == 4
+
+
+def test_merge_json_without_counts_or_seqs(tmp_path):
+    paths = [str(tmp_path / "a.json.gz"), str(tmp_path / "b.json.gz")]
+    write_part(paths[0], [])
+    write_part(paths[1], [[1]], total_words=3)
+
+    output = str(tmp_path / "merged.json.gz")
+    song_reader.merge_json(paths, output)
+    merged = read_json(output)
+    assert merged["seqs"] == [[1]]
+    assert "counts" not in merged
+
+    with gzip.open(paths[0], "wb") as f:
+        f.write(b'{"seqs":[[1,2],[3')
+    with pytest.raises(ValueError):
+        song_reader.merge_json(paths, output)
+
+
+def test_merge_ragged(tmp_path):
+    paths = []
+    for i, seqs in enumerate([[[1, 2, 3], [4]], [[5, 6]]]):
+        path = str(tmp_path / ("part-%d" % i))
+        stats = SequenceStats()
+        with RaggedWriter(path, "uint16") as writer:
+            for seq in seqs:
+                writer.append(seq)
+                stats.add(batch_summary(np.asarray(seq), np.array([0, len(seq)])))
+            writer.close(total_words=7)
+        write_counts(path, [i + 1] * len(seqs))
+        stats.save(song_reader.stats_path(path, "ragged"))
+        paths.append(path)
+
+    output = str(tmp_path / "merged")
+    song_reader.merge_ragged(paths, output, chunk_size=1)
+
+    merged = RaggedSequences(output)
+    assert [s.tolist() for s in merged] == [[1, 2, 3], [4], [5, 6]]
+    assert merged.counts().tolist() == [1, 1, 2]
+    assert merged.max_seq_len == 3 and merged.total_words == 7
+
+
+def test_hash_batch_matches_per_line_hashing():
+    hasher = song_reader.hash_to_sequence_er()
+    lines = ["all caps when you spell the man name", "", "  ", "café déjà vu", "x"]
+    ids, offsets = hasher.batch(lines)
+
+    assert len(offsets) == len(lines) + 1
+    for i, line in enumerate(lines):
+        assert ids[offsets[i] : offsets[i + 1]].tolist() == hasher(line)
+        assert hasher(line) == song_reader.hash_to_sequence(line)
+    assert song_reader.split_batch(ids, offsets) == [hasher(line) for line in lines]
+
+    ids, offsets = hasher.batch([])
+    assert len(ids) == 0 and offsets.tolist() == [0]
+
+
+def padded_prefixes(seqs, maxlen):
+    """
+    every (prefix, next word) sample, padded the slow way
+    """
+    rows = []
+    for seq in seqs:
+        for i in range(1, len(seq)):
+            prefix = list(seq[max(0, i + 1 - maxlen) : i + 1])
+            rows.append([0] * (maxlen - len(prefix)) + prefix)
+    return rows
+
+
+seqs = [[1, 2, 3, 4, 5, 6], [7], [], [8, 9], list(range(10, 30))]
+
+
+def test_prefix_windows():
+    for maxlen in (2, 4, 30):
+        for seq in seqs:
+            windows = song_reader.prefix_windows(seq, maxlen)
+            assert windows.shape == (max(len(seq) - 1, 0), maxlen)
+            assert windows.tolist() == padded_prefixes([seq], maxlen)
+    assert song_reader.count_samples(seqs) == 5 + 1 + 19
+
+
+def test_sample_batches_covers_every_sample():
+    expected = padded_prefixes(seqs, 5)
+    batches = list(song_reader.sample_batches(seqs, 4, batch_size=4, shuffle=False))
+    assert [len(labels) for _, labels in batches] == [4] * 6 + [1]
+    rows = [p.tolist() + [l] for ps, ls in batches for p, l in zip(ps, ls.tolist())]
+    assert rows == expected
+
+    for shuffle_buffer in (1, 7, 2 ** 17):
+        batches = song_reader.sample_batches(
+            seqs, 4, batch_size=4, seed=3, shuffle_buffer=shuffle_buffer
+        )
+        rows = [p.tolist() + [l] for ps, ls in batches for p, l in zip(ps, ls.tolist())]
+        assert sorted(rows) == sorted(expected)
+
+
+def test_sample_batches_repeat():
+    batches = song_reader.sample_batches(seqs, 4, batch_size=10, seed=0, repeat=True)
+    sizes = [len(labels) for _, labels in itertools.islice(batches, 9)]
+    assert sum(sizes) == 3 * song_reader.count_samples(seqs)
+
+
+def test_padded_batches_match_padded_seqs():
+    samples = list(song_reader.get_padded_seqs(seqs, 5, 30, sparse_labels=True))
+    for batch_size in (1, 4, 512):
+        batches = list(song_reader.get_padded_batches(seqs, 5, batch_size))
+        assert all(len(labels) <= batch_size for _, labels in batches)
+        predictors = np.concatenate([p for p, _ in batches])
+        labels = np.concatenate([l for _, l in batches])
+        assert predictors.dtype == labels.dtype == np.int32
+        assert predictors.tolist() == [p.tolist() for p, _ in samples]
+        assert labels.tolist() == [l for _, l in samples]
+
+    dense = next(song_reader.get_padded_seqs(seqs, 5, 30))
+    assert dense[1].shape == (30,) and dense[1][2] == 1
+
+    batches = song_reader.get_padded_batches(seqs, 5, 10, repeat=True)
+    sizes = [len(labels) for _, labels in itertools.islice(batches, 6)]
+    assert sizes == [10, 10, 5] * 2
+
+
+def test_detect_language_falls_back_to_the_full_text(monkeypatch):
+    calls = []
+
+    class Prediction:
+        def __init__(self, text):
+            self.language = "en" if "yeah" in text else "fr"
+            self.is_reliable = "yeah" in text
+
+    class cld3:
+        def get_language(text):
+            calls.append(len(text))
+            return Prediction(text)
+
+    monkeypatch.setattr(song_reader, "cld3", cld3)
+    assert song_reader.detect_language("yeah " * 1000) == ("en", True)
+    assert calls == [2000]
+
+    del calls[:]
+    assert song_reader.detect_language("la " * 1000 + "yeah") == ("en", True)
+    assert calls == [2000, 3004]
+
+
+def test_song_languages_detects_only_what_isnt_cached(english, monkeypatch):
+    detected = []
+
+    def detect_language(lyrics):
+        detected.append(lyrics)
+        return ("fr", False)
+
+    monkeypatch.setattr(song_reader, "detect_language", detect_language)
+    songs = artist(english, 1, songs=3)["songs"]
+    songs.append({"lyrics": "\n".join(["nouvelle chanson"] * 20)})
+    songs.append({"lyrics": "too\nshort"})
+    songs.append({"lyrics": None})
+
+    languages = song_reader.song_languages(songs)
+    assert languages == {
+        0: ("en", True),
+        1: ("en", True),
+        2: ("en", True),
+        3: ("fr", False),
+    }
+    assert detected == [songs[3]["lyrics"]]
+
+    # written back, so the next read of the artist detects nothing
+    assert song_reader.song_languages(songs) == languages
+    assert len(detected) == 1
+
+    # and a song that isn't reliably english is dropped
+    lines = [
+        song_reader.song_to_lines(song, language=languages.get(i))
+        for i, song in enumerate(songs)
+    ]
+    assert [len(l) for l in lines] == [20, 20, 20, 0, 0, 0]
@@ -0,0 +1,61 @@
+import numpy as np
+
+from doom.stats import SequenceStats, batch_summary
+
+
+def stats_of(ids, offsets, artists=0, songs=0):
+    stats = SequenceStats()
+    stats.artists = artists
+    stats.songs = songs
+    stats.add(batch_summary(np.asarray(ids), np.asarray(offsets)))
+    return stats
+
+
+def test_batch_summary():
+    tokens, counts, lengths = batch_summary(
+        np.array([3, 1, 3, 7]), np.array([0, 2, 2, 4])
+    )
+    assert tokens.tolist() == [1, 3, 7]
+    assert counts.tolist() == [1, 2, 1]
+    assert lengths.tolist() == [1, 0, 2]
+
+
+def test_add_and_merge():
+    a = stats_of([1, 2, 2], [0, 1, 3], artists=1, songs=2)
+    b = stats_of([9, 9, 9, 9, 1], [0, 4, 5], artists=2, songs=3)
+    a.merge(b)
+
+    assert (a.artists, a.songs, a.lines, a.tokens) == (3, 5, 4, 8)
+    assert a.max_len == 4
+    assert a.max_token == 9
+    assert a.token_counts.tolist() == [0, 2, 2, 0, 0, 0, 0, 0, 0, 4]
+    assert a.length_counts.tolist() == [0, 2, 1, 0, 1]
+
+
+def test_add_grows_to_fit():
+    stats = SequenceStats()
+    stats.add(batch_summary(np.array([5]), np.array([0, 1])))
+    stats.add(batch_summary(np.array([2, 2]), np.array([0, 2])))
+    assert stats.token_counts.tolist() == [0, 0, 2, 0, 0, 1]
+    assert stats.length_counts.tolist() == [0, 1, 1]
+
+
+def test_percentile():
+    # 90 lines of length 1 and 10 of length 5
+    offsets = np.concatenate([np.arange(91), 90 + 5 * np.arange(1, 11)])
+    stats = stats_of(np.zeros(offsets[-1], dtype=int), offsets)
+    assert stats.percentile(50) == 1
+    assert stats.percentile(90) == 1
+    assert stats.percentile(95) == 5
+    assert stats.percentile(100) == 5
+    assert SequenceStats().percentile(50) == 0
+
+
+def test_save_load(tmp_path):
+    stats = stats_of([1, 2, 2], [0, 1, 3], artists=1, songs=2)
+    path = str(tmp_path / "stats.json.gz")
+    stats.save(path)
+
+    loaded = SequenceStats.load(path)
+    assert loaded.to_dict() == stats.to_dict()
+    assert loaded.to_dict()["percentiles"][50] == 1
@@ -0,0 +1,79 @@
+import collections
+
+import pytest
+
+from doom.vocab import Vocabulary, count_words, encode_file_batch, split_words
+
+lines = [
+    "All caps when you spell the man name",
+    "all CAPS, when you spell... the man's name!",
+    "the villain",
+]
+
+
+def test_split_words():
+    assert split_words("Hey, you--what's\tup?") == ["hey", "you", "what's", "up"]
+    assert split_words("Hey You", lower=False) == ["Hey", "You"]
+
+
+def test_count_words():
+    counts = count_words(lines)
+    assert counts["the"] == 3
+    assert counts["caps"] == 2
+    assert counts["man's"] == 1
+    assert count_words(lines, lower=False)["All"] == 1
+
+
+def test_from_counts_orders_by_count_then_first_seen():
+    counts = collections.Counter(["b", "a", "c", "a", "c", "d"])
+    vocab = Vocabulary.from_counts(counts)
+    assert vocab.words == ["a", "c", "b", "d"]
+    assert vocab.index == {"a": 1, "c": 2, "b": 3, "d": 4}
+
+    assert Vocabulary.from_counts(counts, min_count=2).words == ["a", "c"]
+    assert Vocabulary.from_counts(counts, top_k=3).words == ["a", "c", "b"]
+
+
+def test_encode_drops_or_maps_unknown_words():
+    counts = count_words(lines)
+    vocab = Vocabulary.from_counts(counts, min_count=2)
+    assert vocab.total_words == len(vocab) + 1
+    assert "villain" not in vocab.index
+    assert vocab("the CAPS, villain") == [vocab.index["the"], vocab.index["caps"]]
+
+    oov = Vocabulary.from_counts(counts, min_count=2, oov_token="<unk>")
+    assert oov.total_words == len(oov) + 2
+    assert oov.word_index["<unk>"] == 1
+    assert oov("the villain") == [oov.index["the"], 1]
+    assert min(oov.index.values()) == 2
+
+
+def test_encode_batch():
+    vocab = Vocabulary.from_counts(count_words(lines))
+    ids, offsets = vocab.encode_batch(lines)
+    assert offsets.tolist() == [0, 8, 16, 18]
+    for i, line in enumerate(lines):
+        assert ids[offsets[i] : offsets[i + 1]].tolist() == vocab(line)
+    assert vocab.texts_to_sequences(lines[:1]) == [vocab(lines[0])]
+
+
+def test_save_load(tmp_path):
+    path = str(tmp_path / "vocab.json.gz")
+    vocab = Vocabulary.from_counts(count_words(lines), oov_token="<unk>")
+    vocab.save(path)
+
+    loaded = Vocabulary.load(path)
+    assert loaded.words == vocab.words and loaded.counts == vocab.counts
+    assert loaded.word_index == vocab.word_index
+    ids, offsets = encode_file_batch(path, lines)
+    assert ids.tolist() == vocab.encode_batch(lines)[0].tolist()
+
+
+def test_matches_keras_tokenizer():
+    text = pytest.importorskip("keras.preprocessing.text")
+    tokenizer = text.Tokenizer()
+    tokenizer.fit_on_texts(lines)
+
+    vocab = Vocabulary.from_counts(count_words(lines))
+    assert vocab.word_index == tokenizer.word_index
+    assert vocab.texts_to_sequences(lines) == tokenizer.texts_to_sequences(lines)